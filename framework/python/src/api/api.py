@@ -91,7 +91,11 @@ class Api:
                                methods=["POST"])
     self._router.add_api_route("/system/version", self.get_version)
     self._router.add_api_route("/system/modules", self.get_test_modules)
+    self._router.add_api_route("/system/modules/{module_name}/log",
+                               self.get_test_module_log)
     self._router.add_api_route("/system/testpacks", self.get_test_packs)
+    self._router.add_api_route("/system/network/stats",
+                               self.get_network_stats)
 
     # Report endpoints
     self._router.add_api_route("/reports", self.get_reports)
@@ -659,19 +663,19 @@ class Api:
             False, "A device with that MAC address already exists")
 
       # Update the device
-      device.mac_addr = device_json.get(DEVICE_MAC_ADDR_KEY).lower()
-      device.manufacturer = device_json.get(DEVICE_MANUFACTURER_KEY)
-      device.model = device_json.get(DEVICE_MODEL_KEY)
-      device.test_pack = device_json.get(DEVICE_TEST_PACK_KEY)
-      device.type = device_json.get(DEVICE_TYPE_KEY)
-      device.technology = device_json.get(DEVICE_TECH_KEY)
-      device.additional_info = device_json.get(DEVICE_ADDITIONAL_INFO_KEY)
-      device.test_modules = device_json.get(DEVICE_TEST_MODULES_KEY)
-
-      # Update device status to valid now that configuration is complete
-      device.status = "Valid"
-
-      self._testrun.save_device(device)
+      self._testrun.save_device(device, {
+          "mac_addr": device_json.get(DEVICE_MAC_ADDR_KEY).lower(),
+          "manufacturer": device_json.get(DEVICE_MANUFACTURER_KEY),
+          "model": device_json.get(DEVICE_MODEL_KEY),
+          "test_pack": device_json.get(DEVICE_TEST_PACK_KEY),
+          "type": device_json.get(DEVICE_TYPE_KEY),
+          "technology": device_json.get(DEVICE_TECH_KEY),
+          "additional_info": device_json.get(DEVICE_ADDITIONAL_INFO_KEY),
+          "test_modules": device_json.get(DEVICE_TEST_MODULES_KEY),
+
+          # Device status is valid now that configuration is complete
+          "status": "Valid"
+      })
       response.status_code = status.HTTP_200_OK
 
       return device.to_config_json()
@@ -1027,8 +1031,28 @@ class Api:
         modules.append(module.display_name)
     return modules
 
+  def get_test_module_log(self,
+                          response: Response,
+                          module_name: str,
+                          lines: int = None):
+    """Most recent log lines of a test module run in this session"""
+    tail = self._testrun.get_test_orc().get_module_log_tail(module_name, lines)
+    if tail is None:
+      response.status_code = 404
+      return self._generate_msg(False, "Test module has not been run")
+    return {"module": module_name, "lines": tail}
+
   def get_test_packs(self):
     test_packs: list[str] = []
     for test_pack in self._testrun.get_test_orc().get_test_packs():
       test_packs.append(test_pack.name)
     return test_packs
+
+  def get_network_stats(self, response: Response):
+    """Packets received and dropped by the device listener in the
+    last second"""
+    listener = self._testrun.get_net_orc().get_listener()
+    if listener is None:
+      response.status_code = 404
+      return self._generate_msg(False, "Network listener is not available")
+    return listener.get_stats()
@@ -14,13 +14,35 @@
 
 """MQTT client"""
 import json
+import threading
+import time
 import typing as t
+from collections import deque
 import paho.mqtt.client as mqtt_client
 from common import logger
 
 LOGGER = logger.get_logger("mqtt")
 WEBSOCKETS_HOST = "localhost"
 WEBSOCKETS_PORT = 1883
+KEEPALIVE = 60
+
+# Delay in seconds between reconnect attempts, doubling up to the maximum
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+
+# Maximum number of messages waiting to be published
+MAX_QUEUE_SIZE = 100
+
+# Time in seconds to publish queued messages when disconnecting
+DRAIN_TIMEOUT = 1
+
+# Every message on the topic is published, the oldest queued message
+# is dropped when the queue is full
+QUEUE_POLICY = "queue"
+
+# Only the latest message on the topic is published, a queued message
+# is replaced by a newer one
+MERGE_POLICY = "merge"
 
 class MQTTException(Exception):
   def __init__(self, message: str) -> None:
@@ -29,33 +51,221 @@ class MQTTException(Exception):
 
 class MQTT:
   """ MQTT client class"""
-  def __init__(self) -> None:
+  def __init__(self, max_queue_size: int = MAX_QUEUE_SIZE) -> None:
     self._host = WEBSOCKETS_HOST
     self._client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2)
     self._client.enable_logger(LOGGER)
+    self._client.on_connect = self._on_connect
+    self._client.on_disconnect = self._on_disconnect
+    self._client.reconnect_delay_set(min_delay=MIN_RECONNECT_DELAY,
+                                     max_delay=MAX_RECONNECT_DELAY)
+    self._subscriptions = {}
+    self._connect_callbacks = []
     LOGGER.setLevel(logger.logging.INFO)
 
+    # Outbound messages, published in order by the publish thread
+    self._max_queue_size = max_queue_size
+    self._queue = deque()
+    self._merged = {}
+    self._policies = {}
+    self._retained = set()
+    self._condition = threading.Condition()
+    self._connected = False
+    self._stopping = False
+
+    self._published = 0
+    self._dropped = 0
+    self._merge_count = 0
+    self._total_latency = 0.0
+    self._max_latency = 0.0
+
+    self._publish_thread = None
+    self._connect()
+
   def _connect(self):
-    """Establish connection to MQTT broker"""
-    if not self._client.is_connected():
-      try:
-        self._client.connect(self._host, WEBSOCKETS_PORT, 60)
-      except (ValueError, ConnectionRefusedError):
-        LOGGER.error("Cannot connect to MQTT broker")
+    """Establish a persistent connection to the MQTT broker. Connecting
+    and reconnecting happens in the background so this never blocks"""
+    try:
+      self._client.connect_async(self._host, WEBSOCKETS_PORT, KEEPALIVE)
+    except ValueError:
+      LOGGER.error("Cannot connect to MQTT broker")
+      return
+    self._client.loop_start()
+
+    self._publish_thread = threading.Thread(target=self._publish_messages)
+    self._publish_thread.daemon = True
+    self._publish_thread.start()
+
+  def _on_connect(self, client, userdata, flags, reason_code, properties): # pylint: disable=W0613
+    if reason_code.is_failure:
+      LOGGER.debug(f"MQTT broker refused connection: {reason_code}")
+      return
+    LOGGER.debug("Connected to MQTT broker")
+    with self._condition:
+      self._connected = True
+      self._condition.notify_all()
+    for topic in self._subscriptions:
+      self._client.subscribe(topic)
+    for callback in self._connect_callbacks:
+      callback()
+
+  def _on_disconnect(self, client, userdata, flags, reason_code, properties): # pylint: disable=W0613
+    with self._condition:
+      if self._connected:
+        LOGGER.debug(f"Disconnected from MQTT broker: {reason_code}")
+      self._connected = False
+
+  def subscribe(self, topic: str, callback: t.Callable[[bytes], None]) -> None:
+    """Call the callback with the payload of each message on a topic
+
+    Args:
+        topic (str): mqtt topic
+        callback (t.Callable[[bytes], None]): message handler
+    """
+    self._subscriptions[topic] = callback
+    self._client.message_callback_add(
+        topic, lambda client, userdata, message: callback(message.payload))
+    if self._client.is_connected():
+      self._client.subscribe(topic)
+
+  def add_connect_callback(self, callback: t.Callable[[], None]) -> None:
+    """Call the callback each time the client connects to the broker"""
+    self._connect_callbacks.append(callback)
+
+  def set_topic_policy(self, topic: str, policy: str) -> None:
+    """Set how queued messages on a topic are handled
+
+    Args:
+        topic (str): mqtt topic
+        policy (str): QUEUE_POLICY (default) or MERGE_POLICY
+    """
+    if policy not in [QUEUE_POLICY, MERGE_POLICY]:
+      raise MQTTException(f"Unknown topic policy {policy}")
+    with self._condition:
+      self._policies[topic] = policy
+
+  def set_topic_retained(self, topic: str, retain: bool = True) -> None:
+    """Set whether the broker keeps the last message on a topic for
+    clients that subscribe later
+
+    Args:
+        topic (str): mqtt topic
+        retain (bool): whether messages are retained
+    """
+    with self._condition:
+      if retain:
+        self._retained.add(topic)
+      else:
+        self._retained.discard(topic)
 
   def disconnect(self):
     """Disconnect the local client from the MQTT broker"""
-    if self._client.is_connected():
-      self._client.disconnect()
+    with self._condition:
+      if self._connected:
+        self._condition.wait_for(lambda: not self._queue,
+                                 timeout=DRAIN_TIMEOUT)
+      self._stopping = True
+      self._condition.notify_all()
+    self._client.disconnect()
+    self._client.loop_stop()
 
   def send_message(self, topic: str, message: t.Union[str, dict]) -> None:
-    """Send message to specific topic
+    """Queue a message to be sent to a specific topic. Returns
+    immediately, the message is published in the background
 
     Args:
         topic (str): mqtt topic
         message (t.Union[str, dict]): message
     """
-    self._connect()
     if isinstance(message, dict):
       message = json.dumps(message)
-    self._client.publish(topic, str(message))
+    payload = str(message)
+
+    with self._condition:
+      if self._policies.get(topic) == MERGE_POLICY and topic in self._merged:
+        # Replace the earlier message, queueing the latest at the end so
+        # that it stays in order with messages on other topics
+        self._queue.remove(self._merged.pop(topic))
+        self._merge_count += 1
+
+      if len(self._queue) >= self._max_queue_size:
+        self._drop_message()
+
+      entry = [topic, payload, time.monotonic()]
+      self._queue.append(entry)
+      if self._policies.get(topic) == MERGE_POLICY:
+        self._merged[topic] = entry
+      self._condition.notify_all()
+
+  def _drop_message(self):
+    topic = self._queue.popleft()[0]
+    self._merged.pop(topic, None)
+    self._dropped += 1
+    LOGGER.debug(f"MQTT queue is full, dropped message on {topic}")
+
+  def _publish_messages(self):
+    """Publish queued messages whilst connected. Should be called in
+    a thread"""
+    while True:
+      with self._condition:
+        self._condition.wait_for(
+            lambda: self._stopping or (self._connected and self._queue))
+        if self._stopping:
+          return
+        entry = self._queue.popleft()
+        if self._merged.get(entry[0]) is entry:
+          del self._merged[entry[0]]
+
+      topic, payload, queued = entry
+      info = self._client.publish(topic,
+                                  payload,
+                                  retain=topic in self._retained)
+
+      with self._condition:
+        if info.rc == mqtt_client.MQTT_ERR_NO_CONN:
+          # Connection was lost, try again once reconnected
+          self._connected = False
+          self._requeue_message(entry)
+          continue
+
+        if info.rc != mqtt_client.MQTT_ERR_SUCCESS:
+          LOGGER.debug(f"Failed to publish message on {topic}: {info.rc}")
+          self._dropped += 1
+          continue
+
+        latency = time.monotonic() - queued
+        self._published += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+  def _requeue_message(self, entry):
+    topic = entry[0]
+    merge = self._policies.get(topic) == MERGE_POLICY
+
+    # Drop the message if a newer message on the topic has been queued
+    # or there is no room left in the queue
+    if ((merge and topic in self._merged) or
+        len(self._queue) >= self._max_queue_size):
+      self._dropped += 1
+      return
+
+    self._queue.appendleft(entry)
+    if merge:
+      self._merged[topic] = entry
+
+  def get_metrics(self) -> dict:
+    """Returns the outbound queue depth and publish statistics. Latency
+    is the time in milliseconds between a message being queued and
+    being published"""
+    with self._condition:
+      average = (self._total_latency / self._published
+                 if self._published else 0)
+      return {
+          "connected": self._connected,
+          "queue_depth": len(self._queue),
+          "published": self._published,
+          "dropped": self._dropped,
+          "merged": self._merge_count,
+          "average_latency": round(average * 1000, 3),
+          "max_latency": round(self._max_latency * 1000, 3)
+      }
@@ -0,0 +1,337 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar index of the packets captured from a device.
+
+The index is built by the network orchestrator whilst the device is
+captured and saved when monitoring finishes, so that test modules can
+query the captures without dissecting every packet again."""
+from array import array
+import os
+import numpy as np
+from scapy.layers.dhcp import DHCP
+from scapy.layers.dns import DNS
+from scapy.layers.inet import ICMP, IP, TCP, UDP
+from scapy.layers.inet6 import ICMPv6ND_NS, IPv6
+from scapy.layers.l2 import ARP, Ether
+from scapy.layers.ntp import NTP
+from scapy.utils import PcapReader
+
+PACKET_INDEX_FILE = 'packets.npz'
+
+# Values of the capture column
+CAPTURE_STARTUP = 0
+CAPTURE_MONITOR = 1
+
+# Bits of the flags column
+FLAG_ARP = 1 << 0
+FLAG_DHCP = 1 << 1
+FLAG_DNS = 1 << 2
+FLAG_NTP = 1 << 3
+FLAG_TLS = 1 << 4
+FLAG_ICMP = 1 << 5
+FLAG_ND_NS = 1 << 6
+
+# Code of an empty string column
+NO_STRING = -1
+
+# Column names with their array type code and value when the field is
+# not present
+COLUMNS = {
+    'time': ('d', 0),
+    'capture': ('B', 0),
+    'length': ('I', 0),
+    'src_mac': ('i', NO_STRING),
+    'dst_mac': ('i', NO_STRING),
+    'ip_version': ('B', 0),
+    'src_ip': ('i', NO_STRING),
+    'dst_ip': ('i', NO_STRING),
+    'proto': ('B', 0),
+    'src_port': ('H', 0),
+    'dst_port': ('H', 0),
+    'flags': ('I', 0),
+    'dhcp_type': ('B', 0),
+    'arp_op': ('H', 0),
+    'arp_hwsrc': ('i', NO_STRING),
+    'arp_psrc': ('i', NO_STRING),
+    'icmp_type': ('h', -1),
+    'nd_target': ('i', NO_STRING),
+    'dns_qr': ('b', -1),
+    'dns_qname': ('i', NO_STRING),
+    'dns_answer': ('i', NO_STRING),
+    'ntp_version': ('B', 0),
+    'ntp_mode': ('B', 0),
+    'tls_version': ('H', 0)
+}
+
+# Columns holding codes into the string table of the index
+STRING_COLUMNS = [
+    'src_mac', 'dst_mac', 'src_ip', 'dst_ip', 'arp_hwsrc', 'arp_psrc',
+    'nd_target', 'dns_qname', 'dns_answer'
+]
+
+# DNS answer record types resolving to an address
+DNS_TYPE_A = 1
+DNS_TYPE_AAAA = 28
+
+# TLS record content types: change cipher spec, alert, handshake and
+# application data
+TLS_CONTENT_TYPES = (20, 21, 22, 23)
+
+
+class PacketIndex:
+  """Packet fields stored as one NumPy array per column.
+
+  Each row describes one packet. String fields such as addresses are
+  stored as codes into a shared string table so that filters compare
+  integers, e.g:
+
+      rows = index.has(FLAG_ARP) & index.equals('src_mac', mac_addr)
+      for psrc in index.strings('arp_psrc', rows):
+        ...
+  """
+
+  def __init__(self, columns, strings):
+    self._columns = columns
+    self._strings = strings
+    self._codes = {value: code for code, value in enumerate(strings)}
+
+  @classmethod
+  def load(cls, file_path):
+    """Load an index saved by the network orchestrator"""
+    with np.load(file_path) as data:
+      columns = {name: data[name] for name in COLUMNS}
+      strings = data['strings'].tolist()
+    return cls(columns, strings)
+
+  @classmethod
+  def from_pcaps(cls, capture_files):
+    """Build an index by reading capture files. The capture column
+    holds the position of the file in the list"""
+    builder = PacketIndexBuilder()
+    for capture, capture_file in enumerate(capture_files):
+      with PcapReader(capture_file) as reader:
+        for packet in reader:
+          builder.add(packet, capture=capture)
+    return builder.build()
+
+  @classmethod
+  def concat(cls, indexes):
+    """Join indexes into a single index with one string table"""
+    strings = []
+    codes = {}
+    parts = {name: [] for name in COLUMNS}
+    for index in indexes:
+      # Map the codes of this index onto the joined string table,
+      # with the last entry mapping NO_STRING onto itself
+      mapping = np.empty(len(index._strings) + 1, dtype=np.int32)  # pylint: disable=W0212
+      for code, value in enumerate(index._strings):  # pylint: disable=W0212
+        mapping[code] = codes.setdefault(value, len(strings))
+        if mapping[code] == len(strings):
+          strings.append(value)
+      mapping[-1] = NO_STRING
+      for name, values in parts.items():
+        column = index[name]
+        values.append(mapping[column] if name in STRING_COLUMNS else column)
+    columns = {
+        name: (np.concatenate(values) if values else np.array(
+            [], dtype=COLUMNS[name][0])) for name, values in parts.items()
+    }
+    return cls(columns, strings)
+
+  def save(self, file_path):
+    """Write the index to an npz file, replacing it in one step so
+    that a partly written index is never read"""
+    temp_file = file_path + '.tmp'
+    with open(temp_file, 'wb') as f:
+      np.savez(f,
+               strings=np.array(self._strings, dtype=str),
+               **self._columns)
+    os.replace(temp_file, file_path)
+
+  def __len__(self):
+    return len(self._columns['time'])
+
+  def __getitem__(self, column):
+    return self._columns[column]
+
+  def code(self, value):
+    """Returns the code of a string, or NO_STRING if no packet has it"""
+    return self._codes.get(value, NO_STRING)
+
+  def string(self, code):
+    return None if code == NO_STRING else self._strings[code]
+
+  def equals(self, column, value):
+    """Returns a mask of the rows where a string column has the value"""
+    code = self.code(value)
+    if code == NO_STRING:
+      return np.zeros(len(self), dtype=bool)
+    return self._columns[column] == code
+
+  def has(self, flag):
+    """Returns a mask of the rows with the protocol flag set"""
+    return (self._columns['flags'] & flag) != 0
+
+  def strings(self, column, mask=None):
+    """Returns the values of a string column for the masked rows"""
+    codes = self._columns[column]
+    if mask is not None:
+      codes = codes[mask]
+    return [self.string(code) for code in codes.tolist()]
+
+
+class PacketIndexBuilder:
+  """Adds packets to an index one at a time as they are captured"""
+
+  def __init__(self):
+    self._columns = {
+        name: array(typecode) for name, (typecode, _) in COLUMNS.items()
+    }
+    self._strings = []
+    self._codes = {}
+
+    # Single value arrays used to check that a value fits its column
+    self._checks = {
+        name: array(typecode, [default])
+        for name, (typecode, default) in COLUMNS.items()
+    }
+
+  def __len__(self):
+    return len(self._columns['time'])
+
+  def add(self, packet, capture=CAPTURE_STARTUP):
+    """Add the fields of a scapy packet as a new row"""
+    row = {name: default for name, (_, default) in COLUMNS.items()}
+    row['time'] = float(packet.time)
+    row['capture'] = capture
+    row['length'] = len(packet)
+
+    try:
+      self._add_fields(packet, row)
+    except Exception:  # pylint: disable=W0703
+      # Keep the fields read before a malformed layer
+      pass
+
+    # Every value is checked before any column is appended to so that
+    # the columns always have the same length
+    for name, value in row.items():
+      if name in STRING_COLUMNS and value != NO_STRING:
+        value = self._code(value)
+      try:
+        self._checks[name][0] = value
+      except (OverflowError, TypeError):
+        value = COLUMNS[name][1]
+      row[name] = value
+
+    for name, value in row.items():
+      self._columns[name].append(value)
+
+  def build(self):
+    columns = {
+        name: np.array(values, dtype=values.typecode)
+        for name, values in self._columns.items()
+    }
+    return PacketIndex(columns, list(self._strings))
+
+  def save(self, file_path):
+    self.build().save(file_path)
+
+  def _code(self, value):
+    code = self._codes.get(value)
+    if code is None:
+      code = len(self._strings)
+      self._codes[value] = code
+      self._strings.append(value)
+    return code
+
+  def _add_fields(self, packet, row):
+    if Ether in packet:
+      row['src_mac'] = packet[Ether].src
+      row['dst_mac'] = packet[Ether].dst
+
+    if IP in packet:
+      row['ip_version'] = 4
+      row['src_ip'] = packet[IP].src
+      row['dst_ip'] = packet[IP].dst
+      row['proto'] = packet[IP].proto
+    elif IPv6 in packet:
+      row['ip_version'] = 6
+      row['src_ip'] = packet[IPv6].src
+      row['dst_ip'] = packet[IPv6].dst
+      row['proto'] = packet[IPv6].nh
+
+    for layer in (UDP, TCP):
+      if layer in packet:
+        row['proto'] = 17 if layer is UDP else 6
+        row['src_port'] = packet[layer].sport
+        row['dst_port'] = packet[layer].dport
+        break
+
+    if ARP in packet:
+      row['flags'] |= FLAG_ARP
+      row['arp_op'] = packet[ARP].op
+      row['arp_hwsrc'] = packet[ARP].hwsrc
+      row['arp_psrc'] = packet[ARP].psrc
+
+    if ICMP in packet:
+      row['flags'] |= FLAG_ICMP
+      row['icmp_type'] = packet[ICMP].type
+
+    if ICMPv6ND_NS in packet:
+      row['flags'] |= FLAG_ND_NS
+      row['nd_target'] = str(packet[ICMPv6ND_NS].tgt)
+
+    if DHCP in packet:
+      row['flags'] |= FLAG_DHCP
+      for option in packet[DHCP].options:
+        if isinstance(option, tuple) and option[0] == 'message-type':
+          row['dhcp_type'] = option[1]
+          break
+
+    if NTP in packet:
+      row['flags'] |= FLAG_NTP
+      row['ntp_version'] = packet[NTP].version
+      row['ntp_mode'] = packet[NTP].mode
+
+    if TCP in packet:
+      payload = bytes(packet[TCP].payload)
+      if (len(payload) >= 5 and payload[0] in TLS_CONTENT_TYPES and
+          payload[1] == 3):
+        row['flags'] |= FLAG_TLS
+        row['tls_version'] = payload[1] << 8 | payload[2]
+
+    # DNS is read last as malformed DNS payloads are common
+    if DNS in packet:
+      row['flags'] |= FLAG_DNS
+      self._add_dns_fields(packet[DNS], row)
+
+  def _add_dns_fields(self, dns, row):
+    row['dns_qr'] = dns.qr
+    if dns.qdcount > 0 and dns.qd is not None and dns.qd.qname:
+      row['dns_qname'] = dns.qd.qname.decode()
+    if dns.qr == 1 and dns.ancount > 0:
+      for i in range(dns.ancount):
+        answer = dns.an[i]
+        if answer.type in (DNS_TYPE_A, DNS_TYPE_AAAA):
+          row['dns_answer'] = str(answer.rdata)
+          break
+
+
+def load_device_index(index_file, capture_files):
+  """Load the index saved by the network orchestrator, or build it from
+  the capture files if it is not available"""
+  if os.path.exists(index_file):
+    return PacketIndex.load(index_file)
+  return PacketIndex.from_pcaps(capture_files)
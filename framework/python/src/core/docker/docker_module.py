@@ -15,6 +15,7 @@
 import docker
 from docker.models.containers import Container
 import os
+import requests
 from common import logger
 import json
 
@@ -66,6 +67,9 @@ class Module:
         'enable_container', True)
     self.container: Container = None
 
+    # Docker client is created on first use and reused thereafter
+    self._client = None
+
     self._add_logger(log_name=self.name, module_name=self.name)
     self.setup_module(module_json)
 
@@ -75,9 +79,14 @@ class Module:
         log_file=f'{module_name}_module',
         log_dir=log_dir)
 
+  def _get_client(self):
+    if self._client is None:
+      self._client = docker.from_env()
+    return self._client
+
   def build(self):
     self.logger.debug('Building module ' + self.dir_name)
-    client = docker.from_env()
+    client = self._get_client()
     client.images.build(
         dockerfile=os.path.join(self.dir, self.build_file),
         path=self._path,
@@ -87,7 +96,7 @@ class Module:
   def get_container(self):
     container = None
     try:
-      client = docker.from_env()
+      client = self._get_client()
       container = client.containers.get(self.container_name)
     except docker.errors.NotFound:
       self.logger.debug('Container ' + self.container_name + ' not found')
@@ -129,7 +138,7 @@ class Module:
                        container name: {self.container_name}""")
 
     try:
-      client = docker.from_env()
+      client = self._get_client()
       self.container = client.containers.run(
           self.image_name,
           auto_remove=True,
@@ -146,6 +155,25 @@ class Module:
       self.logger.error('Container run error')
       self.logger.error(error)
 
+  def wait(self):
+    """Block until the module container has exited and return
+    the exit code, or None if the container could not be waited on"""
+    if self.container is None:
+      return None
+    try:
+      # Passing timeout=None disables the default request timeout so
+      # this call blocks in the Docker daemon without polling
+      response = self.container.wait(timeout=None)
+      return response.get('StatusCode')
+    except docker.errors.NotFound:
+      # Container has already exited and been removed
+      self.logger.debug('Container ' + self.container_name + ' not found')
+    except (docker.errors.APIError,
+            requests.exceptions.ConnectionError) as error:
+      self.logger.error('Failed to wait for container')
+      self.logger.error(error)
+    return None
+
   def stop(self, kill=False):
     self.logger.debug('Stopping module ' + self.container_name)
     try:
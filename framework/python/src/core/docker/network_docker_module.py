@@ -13,6 +13,7 @@
 # limitations under the License.
 """Represents a test module."""
 from core.docker.docker_module import Module
+import docker
 import os
 from docker.types import Mount
 
@@ -20,6 +21,7 @@ RUNTIME_DIR = 'runtime'
 RUNTIME_TEST_DIR = os.path.join(RUNTIME_DIR, 'test')
 DEFAULT_TIMEOUT = 60  # time in seconds
 DEFAULT_DOCKER_NETWORK = 'none'
+RESET_COMMAND = '/testrun/bin/reset_module'
 
 
 class NetworkModule(Module):
@@ -75,6 +77,26 @@ class NetworkModule(Module):
   def get_mounts(self):
     return self._mounts
 
+  def reset(self):
+    """Reset the per device state of the running container, such as
+    leases and packet captures, so that it can be used for another
+    test run"""
+    self.logger.debug('Resetting module ' + self.display_name)
+    container = self.get_container()
+    if container is None:
+      return False
+    try:
+      result = container.exec_run(RESET_COMMAND)
+    except docker.errors.APIError as error:
+      self.logger.error('Failed to reset module ' + self.display_name)
+      self.logger.error(error)
+      return False
+    if result.exit_code != 0:
+      self.logger.error('Failed to reset module ' + self.display_name)
+      self.logger.debug(result.output.decode('utf-8', errors='replace'))
+      return False
+    return True
+
 
 class NetworkModuleNetConfig:
   """Define all the properties of the network config for a network module"""
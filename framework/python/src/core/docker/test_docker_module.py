@@ -22,24 +22,37 @@ from docker.types import Mount
 RUNTIME_DIR = 'runtime'
 RUNTIME_TEST_DIR = os.path.join(RUNTIME_DIR, 'test')
 DEFAULT_TIMEOUT = 60  # time in seconds
+DEFAULT_IP_INDEX = 9
+
+# Test modules do not run any tests whilst this file exists
+HOLD_FILE = '.hold'
 
 
 class TestModule(Module):
   """Represents a test module."""
 
-  def __init__(self, module_config_file, session, extra_hosts):
+  def __init__(self,
+               module_config_file,
+               session,
+               extra_hosts,
+               ip_index=DEFAULT_IP_INDEX):
     super().__init__(module_config_file=module_config_file,
                      session=session,
                      extra_hosts=extra_hosts)
 
-    # Set IP Index for all test modules
-    self.ip_index = 9
+    # IP index determines the address of the module on the device bridge.
+    # Each test module is given a unique index so that modules can
+    # share the device bridge whilst running in parallel
+    self.ip_index = ip_index
+
+    # Whether the container should be held once started
+    self._hold = False
 
   def setup_module(self, module_json):
     # Set the defaults
     self.network = True
     self.total_tests = 0
-    self.time = DEFAULT_TIMEOUT
+    self.timeout = DEFAULT_TIMEOUT
     self.tests: list = []
 
     if 'timeout' in module_json['config']['docker']:
@@ -49,6 +62,10 @@ class TestModule(Module):
     if 'network' in module_json['config']:
       self.network = module_json['config']['network']
 
+    # Exclusive modules alter the network or device state (e.g. DHCP
+    # changes) so cannot run at the same time as other test modules
+    self.exclusive = module_json['config'].get('exclusive', False)
+
     # Load test cases
     if 'tests' in module_json['config']:
       self.total_tests = len(module_json['config']['tests'])
@@ -88,9 +105,37 @@ class TestModule(Module):
     host_user = self.get_session().get_host_user()
     util.run_command(f'chown -R {host_user} {self.device_startup_capture}')
 
+    # Monitor capture does not exist yet if the module is started in advance
     self.device_monitor_capture = os.path.join(self.device_test_dir,
                                                'monitor.pcap')
-    util.run_command(f'chown -R {host_user} {self.device_monitor_capture}')
+    if os.path.exists(self.device_monitor_capture):
+      util.run_command(f'chown -R {host_user} {self.device_monitor_capture}')
+
+    # Remove results streamed by a previous run of this module
+    self.results_stream_file = os.path.join(self.container_runtime_dir,
+                                            f'{self.name}-result.jsonl')
+    if os.path.exists(self.results_stream_file):
+      os.remove(self.results_stream_file)
+
+    self.hold_file = os.path.join(self.container_runtime_dir, HOLD_FILE)
+    if self._hold:
+      with open(self.hold_file, 'w', encoding='utf-8'):
+        pass
+    elif os.path.exists(self.hold_file):
+      os.remove(self.hold_file)
+
+  def start(self, device=None, hold=False):
+    """Start the test module container. A held container is started
+    but does not run any tests until it is released"""
+    self._hold = hold
+    super().start(device)
+
+  def release(self):
+    """Allow a held test module to run its tests"""
+    self.logger.debug('Releasing module ' + self.container_name)
+    self._hold = False
+    if os.path.exists(self.hold_file):
+      os.remove(self.hold_file)
 
   def get_environment(self, device):
     environment = {
@@ -123,12 +168,10 @@ class TestModule(Module):
               source=self.network_runtime_dir,
               type='bind',
               read_only=True),
-        Mount(target='/runtime/device/startup.pcap',
-              source=self.device_startup_capture,
-              type='bind',
-              read_only=True),
-        Mount(target='/runtime/device/monitor.pcap',
-              source=self.device_monitor_capture,
+        # Device captures are provided by mounting the device directory
+        # since the monitor capture is created after a held module starts
+        Mount(target='/runtime/device',
+              source=self.device_test_dir,
               type='bind',
               read_only=True)
     ]
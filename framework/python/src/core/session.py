@@ -17,10 +17,12 @@ import datetime
 import pytz
 import json
 import os
+import threading
 from fastapi.encoders import jsonable_encoder
 from common import util, logger, mqtt
 from common.risk_profile import RiskProfile
 from common.statuses import TestrunStatus, TestResult
+from core.status_publisher import StatusPublisher
 from net_orc.ip_control import IPControl
 
 # Certificate dependencies
@@ -33,6 +35,10 @@ DEVICE_INTF_KEY = 'device_intf'
 INTERNET_INTF_KEY = 'internet_intf'
 MONITOR_PERIOD_KEY = 'monitor_period'
 STARTUP_TIMEOUT_KEY = 'startup_timeout'
+NETWORK_TIMEOUT_KEY = 'network_timeout'
+CAPTURE_SNAPLEN_KEY = 'capture_snaplen'
+MAX_CAPTURE_SIZE_KEY = 'max_capture_size'
+WARM_NETWORK_KEY = 'warm_network'
 LOG_LEVEL_KEY = 'log_level'
 API_URL_KEY = 'api_url'
 API_PORT_KEY = 'api_port'
@@ -40,13 +46,17 @@ MAX_DEVICE_REPORTS_KEY = 'max_device_reports'
 ORG_NAME_KEY = 'org_name'
 CERTS_PATH = 'local/root_certs'
 CONFIG_FILE_PATH = 'local/system.json'
-STATUS_TOPIC = 'status'
 
 MAKE_CONTROL_DIR =  'make/DEBIAN/control'
 
 PROFILE_FORMAT_PATH = 'resources/risk_assessment.json'
 PROFILES_DIR = 'local/risk_profiles'
 
+# Device repository indexes
+DEVICE_MAC_ADDR_INDEX = 'mac_addr'
+DEVICE_FOLDER_INDEX = 'device_folder'
+DEVICE_MAKE_MODEL_INDEX = 'make_model'
+
 LOGGER = logger.get_logger('session')
 
 
@@ -56,11 +66,9 @@ def session_tracker(method):
 
     result = method(self, *args, **kwargs)
 
+    # Changes are combined and published shortly after
     if self.get_status() != TestrunStatus.IDLE:
-      self.get_mqtt_client().send_message(
-                                        STATUS_TOPIC,
-                                        jsonable_encoder(self.to_json())
-                                        )
+      self.get_status_publisher().notify()
 
     return result
   return wrapper
@@ -93,8 +101,14 @@ class TestrunSession():
     self._started = None
     self._finished = None
 
-    # Current testing results
-    self._results = []
+    # Current testing results, keyed by test name in the order added
+    self._results = {}
+
+    # Names of the current tests by result
+    self._status_results = {}
+
+    # Results are added by each test module as it runs
+    self._results_lock = threading.Lock()
 
     # All historical reports
     self._module_reports = []
@@ -105,6 +119,12 @@ class TestrunSession():
     # All device configurations
     self._device_repository = []
 
+    # Device configurations by MAC address, folder and make and model
+    self._device_lock = threading.Lock()
+    self._device_indexes = {}
+    self._device_keys = {}
+    self._clear_device_indexes()
+
     # Number of tests to be run this session
     self._total_tests = 0
 
@@ -152,6 +172,8 @@ class TestrunSession():
 
     # MQTT client
     self._mqtt_client = mqtt.MQTT()
+    self._status_publisher = StatusPublisher(
+        self._mqtt_client, lambda: jsonable_encoder(self.to_json()))
 
   def start(self):
     self.reset()
@@ -170,9 +192,9 @@ class TestrunSession():
 
   def finish(self):
     # Set any in progress test results to Error
-    for test_result in self._results:
-      if test_result.result == TestResult.IN_PROGRESS:
-        test_result.result = TestResult.ERROR
+    with self._results_lock:
+      for name in list(self._status_results.get(TestResult.IN_PROGRESS, {})):
+        self._set_result(self._results[name], TestResult.ERROR)
 
     self._finished = datetime.datetime.now()
 
@@ -184,7 +206,11 @@ class TestrunSession():
         },
         'log_level': 'INFO',
         'startup_timeout': 60,
+        'network_timeout': 120,
         'monitor_period': 30,
+        'capture_snaplen': 262144,
+        'max_capture_size': 0,
+        'warm_network': False,
         'max_device_reports': 0,
         'api_url': 'http://localhost',
         'api_port': 8000,
@@ -219,10 +245,21 @@ class TestrunSession():
         self._config[STARTUP_TIMEOUT_KEY] = config_file_json.get(
             STARTUP_TIMEOUT_KEY)
 
+      if NETWORK_TIMEOUT_KEY in config_file_json:
+        self._config[NETWORK_TIMEOUT_KEY] = config_file_json.get(
+            NETWORK_TIMEOUT_KEY)
+
       if MONITOR_PERIOD_KEY in config_file_json:
         self._config[MONITOR_PERIOD_KEY] = config_file_json.get(
             MONITOR_PERIOD_KEY)
 
+      for capture_key in [CAPTURE_SNAPLEN_KEY, MAX_CAPTURE_SIZE_KEY]:
+        if capture_key in config_file_json:
+          self._config[capture_key] = config_file_json.get(capture_key)
+
+      if WARM_NETWORK_KEY in config_file_json:
+        self._config[WARM_NETWORK_KEY] = config_file_json.get(WARM_NETWORK_KEY)
+
       if LOG_LEVEL_KEY in config_file_json:
         self._config[LOG_LEVEL_KEY] = config_file_json.get(LOG_LEVEL_KEY)
 
@@ -319,6 +356,21 @@ class TestrunSession():
   def get_startup_timeout(self):
     return self._config.get(STARTUP_TIMEOUT_KEY)
 
+  def get_network_timeout(self):
+    return self._config.get(NETWORK_TIMEOUT_KEY)
+
+  def get_warm_network(self):
+    """Whether the network is kept running between test runs"""
+    return self._config.get(WARM_NETWORK_KEY)
+
+  def get_capture_snaplen(self):
+    return self._config.get(CAPTURE_SNAPLEN_KEY)
+
+  def get_max_capture_size(self):
+    """Returns the maximum size of each packet capture in bytes,
+    or 0 if there is no limit"""
+    return self._config.get(MAX_CAPTURE_SIZE_KEY) * 1024 * 1024
+
   def get_api_url(self):
     return self._config.get(API_URL_KEY)
 
@@ -343,33 +395,87 @@ class TestrunSession():
     return self._device
 
   def get_device_by_name(self, device_name):
-    for device in self._device_repository:
-      if device.device_folder.lower() == device_name.lower():
-        return device
-    return None
+    return self._find_device(DEVICE_FOLDER_INDEX, device_name)
 
   def get_device_by_make_and_model(self, make, model):
-    for device in self._device_repository:
-      if device.manufacturer == make and device.model == model:
-        return device
+    return self._find_device(DEVICE_MAKE_MODEL_INDEX, (make, model))
 
   def get_device_repository(self):
     return self._device_repository
 
   def add_device(self, device):
-    self._device_repository.append(device)
+    with self._device_lock:
+      self._device_repository.append(device)
+      self._index_device(device)
 
   def clear_device_repository(self):
-    self._device_repository = []
+    with self._device_lock:
+      self._device_repository = []
+      self._clear_device_indexes()
 
   def get_device(self, mac_addr):
-    for device in self._device_repository:
-      if device.mac_addr.lower() == mac_addr.lower():
-        return device
-    return None
+    return self._find_device(DEVICE_MAC_ADDR_INDEX, mac_addr)
 
   def remove_device(self, device):
-    self._device_repository.remove(device)
+    with self._device_lock:
+      self._device_repository.remove(device)
+      self._unindex_device(device)
+
+  def update_device(self, device, fields):
+    """Edit the fields of a device, such as the MAC address, make or
+    model. The old index keys are removed before the device is changed
+    so that lookups never return the device by a stale key"""
+    with self._device_lock:
+      self._unindex_device(device)
+      for name, value in fields.items():
+        setattr(device, name, value)
+      self._index_device(device)
+
+  def _clear_device_indexes(self):
+    self._device_indexes = {
+        DEVICE_MAC_ADDR_INDEX: {},
+        DEVICE_FOLDER_INDEX: {},
+        DEVICE_MAKE_MODEL_INDEX: {}
+    }
+    self._device_keys = {}
+
+  def _get_device_key(self, index, value):
+    if index == DEVICE_MAKE_MODEL_INDEX:
+      return value
+    if value is None:
+      return None
+    return value.strip().lower()
+
+  def _find_device(self, index, value):
+    return self._device_indexes[index].get(self._get_device_key(index, value))
+
+  def _index_device(self, device):
+    keys = {
+        DEVICE_MAC_ADDR_INDEX:
+            self._get_device_key(DEVICE_MAC_ADDR_INDEX, device.mac_addr),
+        DEVICE_FOLDER_INDEX:
+            self._get_device_key(DEVICE_FOLDER_INDEX, device.device_folder),
+        DEVICE_MAKE_MODEL_INDEX: (device.manufacturer, device.model)
+    }
+    self._device_keys[id(device)] = keys
+
+    # The first device loaded takes precedence for duplicate keys
+    for index, key in keys.items():
+      self._device_indexes[index].setdefault(key, device)
+
+  def _unindex_device(self, device):
+    keys = self._device_keys.pop(id(device), {})
+    for index, key in keys.items():
+      if self._device_indexes[index].get(key) is not device:
+        continue
+      del self._device_indexes[index][key]
+
+      # Another device may share the key
+      for other in self._device_repository:
+        if other is not device and self._device_keys.get(
+            id(other), {}).get(index) == key:
+          self._device_indexes[index][key] = other
+          break
 
   def get_ipv4_subnet(self):
     return self._ipv4_subnet
@@ -387,7 +493,19 @@ class TestrunSession():
     self._description = desc
 
   def get_test_results(self):
-    return self._results
+    with self._results_lock:
+      return list(self._results.values())
+
+  def get_test_statuses(self):
+    """Returns each result held by at least one current test"""
+    with self._results_lock:
+      return [status for status, names in self._status_results.items() if names]
+
+  def get_test_results_by_status(self, status):
+    with self._results_lock:
+      return [
+          self._results[name] for name in self._status_results.get(status, {})
+      ]
 
   def get_module_reports(self):
     return self._module_reports
@@ -395,66 +513,82 @@ class TestrunSession():
   def get_report_tests(self):
     """Returns the current test results in JSON-friendly format
     (in Python dictionary)"""
-    test_results = []
-    for test_result in self._results:
-      test_results.append(test_result.to_dict())
+    with self._results_lock:
+      test_results = [
+          test_result.to_dict() for test_result in self._results.values()
+      ]
 
     return {'total': self.get_total_tests(), 'results': test_results}
 
   def add_test_result(self, result):
 
-    updated = False
-
-    # Check if test has already been added
-    for test_result in self._results:
-
-      # result type is TestCase object
-      if test_result.name == result.name:
+    with self._results_lock:
 
-        # Just update the result, description and recommendations
-        if len(result.description) != 0:
-          test_result.description = result.description
+      # Check if test has already been added
+      test_result = self._results.get(result.name)
 
-        # Add recommendations if provided
-        if result.recommendations is not None:
-          test_result.recommendations = result.recommendations
+      if test_result is None:
+        self._insert_result(result)
+        return
 
-          if len(result.recommendations) == 0:
-            test_result.recommendations = None
+      # Just update the result, description and recommendations
+      if len(result.description) != 0:
+        test_result.description = result.description
 
-        if result.result is not None:
+      # Add recommendations if provided
+      if result.recommendations is not None:
+        test_result.recommendations = result.recommendations
 
-          # Any informational test should always report informational
-          if test_result.required_result == 'Informational':
+        if len(result.recommendations) == 0:
+          test_result.recommendations = None
 
-            # Set test result to informational
-            if result.result in [
-              TestResult.NON_COMPLIANT,
-              TestResult.COMPLIANT,
-              TestResult.INFORMATIONAL
-            ]:
-              test_result.result = TestResult.INFORMATIONAL
-            else:
-              test_result.result = result.result
+      if result.result is not None:
 
-            # Copy any test recommendations to optional
-            test_result.optional_recommendations = result.recommendations
+        # Any informational test should always report informational
+        if test_result.required_result == 'Informational':
 
-            # Remove recommendations from informational tests
-            test_result.recommendations = None
+          # Set test result to informational
+          if result.result in [
+            TestResult.NON_COMPLIANT,
+            TestResult.COMPLIANT,
+            TestResult.INFORMATIONAL
+          ]:
+            self._set_result(test_result, TestResult.INFORMATIONAL)
           else:
-            test_result.result = result.result
+            self._set_result(test_result, result.result)
 
-        updated = True
+          # Copy any test recommendations to optional
+          test_result.optional_recommendations = result.recommendations
 
-    if not updated:
-      self._results.append(result)
+          # Remove recommendations from informational tests
+          test_result.recommendations = None
+        else:
+          self._set_result(test_result, result.result)
 
   def set_test_result_error(self, result):
     """Set test result error"""
-    result.result = TestResult.ERROR
-    result.recommendations = None
-    self._results.append(result)
+    with self._results_lock:
+      test_result = self._results.get(result.name)
+      if test_result is None:
+        result.result = TestResult.ERROR
+        result.recommendations = None
+        self._insert_result(result)
+      else:
+        self._set_result(test_result, TestResult.ERROR)
+        test_result.recommendations = None
+
+  def _insert_result(self, result):
+    self._results[result.name] = result
+    self._status_results.setdefault(result.result, {})[result.name] = None
+
+  def _set_result(self, test_result, status):
+    """Update the result of a test, keeping the status index current"""
+    if test_result.result == status:
+      return
+    self._status_results.get(test_result.result, {}).pop(test_result.name,
+                                                          None)
+    self._status_results.setdefault(status, {})[test_result.name] = None
+    test_result.result = status
 
   def add_module_report(self, module_report):
     self._module_reports.append(module_report)
@@ -783,7 +917,9 @@ question {question.get('question')}''')
     self._report_url = None
     self._total_tests = 0
     self._module_reports = []
-    self._results = []
+    with self._results_lock:
+      self._results = {}
+      self._status_results = {}
     self._started = None
     self._finished = None
     self._ifaces = IPControl.get_sys_interfaces()
@@ -962,5 +1098,8 @@ question {question.get('question')}''')
   def get_mqtt_client(self):
     return self._mqtt_client
 
+  def get_status_publisher(self):
+    return self._status_publisher
+
   def get_ifaces(self):
     return self._ifaces
@@ -0,0 +1,139 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Publishes changes to the Testrun session over MQTT."""
+import threading
+from common import logger, mqtt
+
+LOGGER = logger.get_logger('session')
+
+# Full session status, also sent when requested or on reconnect
+STATUS_TOPIC = 'status'
+
+# Changes to the session status since the previous message
+STATUS_DELTA_TOPIC = 'status/delta'
+
+# Any message on this topic causes a full status to be sent
+STATUS_REQUEST_TOPIC = 'status/request'
+
+# Time in seconds over which session changes are combined
+PUBLISH_WINDOW = 0.1
+
+
+def make_patch(source, target, path=''):
+  """Returns the JSON patch (RFC 6902) operations that change the
+  source document into the target document"""
+  if source == target:
+    return []
+
+  if isinstance(source, dict) and isinstance(target, dict):
+    operations = []
+    for key in source:
+      if key not in target:
+        operations.append({'op': 'remove', 'path': _child_path(path, key)})
+    for key, value in target.items():
+      child_path = _child_path(path, key)
+      if key in source:
+        operations.extend(make_patch(source[key], value, child_path))
+      else:
+        operations.append({'op': 'add', 'path': child_path, 'value': value})
+    return operations
+
+  if isinstance(source, list) and isinstance(target, list):
+    operations = []
+    shared = min(len(source), len(target))
+    for index in range(shared):
+      operations.extend(
+          make_patch(source[index], target[index], f'{path}/{index}'))
+    for index in range(shared, len(target)):
+      operations.append({
+          'op': 'add',
+          'path': f'{path}/{index}',
+          'value': target[index]
+      })
+
+    # Remove from the end so that earlier indexes remain valid
+    for index in reversed(range(shared, len(source))):
+      operations.append({'op': 'remove', 'path': f'{path}/{index}'})
+    return operations
+
+  return [{'op': 'replace', 'path': path, 'value': target}]
+
+
+def _child_path(path, key):
+  return path + '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+
+class StatusPublisher:
+  """Combines session changes made within a short window and publishes
+  them as a single delta against the previously published status."""
+
+  def __init__(self, mqtt_client, get_status, window=PUBLISH_WINDOW):
+    self._mqtt_client = mqtt_client
+    self._get_status = get_status
+    self._window = window
+
+    self._lock = threading.Lock()
+    self._timer = None
+    self._status = None
+    self._sequence = 0
+
+    # Only the latest full status needs to be sent, whereas every
+    # delta is needed to follow the status
+    self._mqtt_client.set_topic_policy(STATUS_TOPIC, mqtt.MERGE_POLICY)
+    self._mqtt_client.subscribe(STATUS_REQUEST_TOPIC,
+                                lambda payload: self.publish_status())
+    self._mqtt_client.add_connect_callback(self.publish_status)
+
+  def notify(self):
+    """Publish the session status once the current window ends"""
+    with self._lock:
+      if self._timer is None:
+        self._timer = threading.Timer(self._window, self._publish_changes)
+        self._timer.daemon = True
+        self._timer.start()
+
+  def publish_status(self):
+    """Publish the full session status immediately"""
+    with self._lock:
+      self._publish(full=True)
+
+  def _publish_changes(self):
+    with self._lock:
+      self._timer = None
+      self._publish(full=self._status is None)
+
+  def _publish(self, full):
+    try:
+      status = self._get_status()
+    except Exception as e:  # pylint: disable=W0703
+      LOGGER.error('Failed to resolve the session status')
+      LOGGER.debug(e)
+      return
+
+    if full:
+      self._sequence += 1
+      self._mqtt_client.send_message(STATUS_TOPIC,
+                                     dict(status, sequence=self._sequence))
+    else:
+      patch = make_patch(self._status, status)
+      if not patch:
+        return
+      self._sequence += 1
+      self._mqtt_client.send_message(STATUS_DELTA_TOPIC, {
+          'sequence': self._sequence,
+          'patch': patch
+      })
+
+    self._status = status
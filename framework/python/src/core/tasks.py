@@ -20,12 +20,10 @@ import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import FastAPI
 
-from common import logger
+from common import logger, mqtt
 
-# Check adapters period seconds
-# Check adapters period seconds
-CHECK_NETWORK_ADAPTERS_PERIOD = 5
 CHECK_INTERNET_PERIOD = 2
+MQTT_METRICS_PERIOD = 60
 INTERNET_CONNECTION_TOPIC = 'events/internet'
 NETWORK_ADAPTERS_TOPIC = 'events/adapter'
 
@@ -40,20 +38,21 @@ class PeriodicTasks:
   ) -> None:
     self._testrun = testrun_obj
     self._mqtt_client = self._testrun.get_mqtt_client()
+
+    # Only the current internet connection state needs to be sent. It is
+    # only sent when it changes, so is retained for clients that
+    # subscribe later
+    self._mqtt_client.set_topic_policy(INTERNET_CONNECTION_TOPIC,
+                                       mqtt.MERGE_POLICY)
+    self._mqtt_client.set_topic_retained(INTERNET_CONNECTION_TOPIC)
     local_tz = datetime.datetime.now().astimezone().tzinfo
     self._scheduler = AsyncIOScheduler(timezone=local_tz)
     # Prevent scheduler warnings
     self._scheduler._logger.setLevel(logging.ERROR)
 
-    self.adapters_checker_job = self._scheduler.add_job(
-        func=self._testrun.get_net_orc().network_adapters_checker,
-        kwargs={
-                'mqtt_client': self._mqtt_client,
-                'topic': NETWORK_ADAPTERS_TOPIC
-                },
-        trigger='interval',
-        seconds=CHECK_NETWORK_ADAPTERS_PERIOD,
-    )
+    # Network adapter changes are pushed as the kernel reports them
+    self._testrun.get_net_orc().get_interface_monitor().subscribe(
+        self._interface_changed)
     # add internet connection cheking job only in single-intf mode
     if 'single_intf' not in self._testrun.get_session().get_runtime_params():
       self.internet_shecker = self._scheduler.add_job(
@@ -66,6 +65,17 @@ class PeriodicTasks:
           seconds=CHECK_INTERNET_PERIOD,
       )
 
+    self._mqtt_dropped = 0
+    self.mqtt_metrics_job = self._scheduler.add_job(
+        func=self._log_mqtt_metrics,
+        trigger='interval',
+        seconds=MQTT_METRICS_PERIOD,
+    )
+
+  def _interface_changed(self, event, interface_name, state):  # pylint: disable=unused-argument
+    self._testrun.get_net_orc().network_adapters_checker(
+        mqtt_client=self._mqtt_client, topic=NETWORK_ADAPTERS_TOPIC)
+
   @asynccontextmanager
   async def start(self, app: FastAPI):  # pylint: disable=unused-argument
     """Start background tasks
@@ -73,6 +83,17 @@ class PeriodicTasks:
     Args:
         app (FastAPI): app instance
     """
-    # Job that checks for changes in network adapters
+    # Job that checks the internet connection
     self._scheduler.start()
     yield
+
+  def _log_mqtt_metrics(self):
+    """Log the MQTT queue depth and publish latency, as a warning if
+    messages have been dropped since the last report"""
+    metrics = self._mqtt_client.get_metrics()
+    message = f'MQTT client metrics: {metrics}'
+    if metrics['dropped'] > self._mqtt_dropped:
+      LOGGER.warning(message)
+    else:
+      LOGGER.debug(message)
+    self._mqtt_dropped = metrics['dropped']
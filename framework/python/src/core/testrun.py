@@ -329,9 +329,13 @@ class Testrun:  # pylint: disable=too-few-public-methods
 
     return device.to_config_json()
 
-  def save_device(self, device: Device):
+  def save_device(self, device: Device, fields=None):
     """Edit and save an existing device config."""
 
+    # The MAC address, make or model may change
+    if fields:
+      self._session.update_device(device, fields)
+
     # Obtain the config file path
     config_file_path = os.path.join(self._root_dir,
                                       LOCAL_DEVICES_DIR,
@@ -373,6 +377,10 @@ class Testrun:  # pylint: disable=too-few-public-methods
     if self._net_only:
       LOGGER.info('Network only option configured, no tests will be run')
     else:
+      self.get_net_orc().get_listener().register_callback(
+          self._device_monitoring,
+          [NetworkEvent.DEVICE_MONITORING]
+      )
       self.get_net_orc().get_listener().register_callback(
           self._device_stable,
           [NetworkEvent.DEVICE_STABLE]
@@ -398,9 +406,6 @@ class Testrun:  # pylint: disable=too-few-public-methods
 
     self.get_session().set_status(TestrunStatus.CANCELLED)
 
-    # Disconnect before WS server stops to prevent error
-    self._mqtt_client.disconnect()
-
     self._stop_network(kill=True)
 
   def _register_exits(self):
@@ -412,7 +417,14 @@ class Testrun:  # pylint: disable=too-few-public-methods
   def shutdown(self):
     LOGGER.info('Shutting down Testrun')
     self.stop()
+
+    # The network may have been kept running after the test run
+    if self.get_session().get_warm_network():
+      self.get_net_orc().stop(kill=True)
     self._stop_ui()
+
+    # Disconnect before WS server stops to prevent error
+    self._mqtt_client.disconnect()
     self._stop_ws()
 
   def _exit_handler(self, signum, arg):  # pylint: disable=unused-argument
@@ -446,7 +458,9 @@ class Testrun:  # pylint: disable=too-few-public-methods
       sys.exit(1)
 
   def _stop_network(self, kill=True):
-    self.get_net_orc().stop(kill)
+    # The network is reused by the next test run in warm network mode
+    self.get_net_orc().stop(kill,
+                            keep_network=self.get_session().get_warm_network())
 
   def _stop_tests(self):
     self._test_orc.stop()
@@ -456,10 +470,7 @@ class Testrun:  # pylint: disable=too-few-public-methods
 
   def get_device(self, mac_addr):
     """Returns a loaded device object from the device mac address."""
-    for device in self.get_session().get_device_repository():
-      if device.mac_addr == mac_addr:
-        return device
-    return None
+    return self.get_session().get_device(mac_addr)
 
   def _device_discovered(self, mac_addr):
 
@@ -480,10 +491,15 @@ class Testrun:  # pylint: disable=too-few-public-methods
         f'Discovered {device.manufacturer} {device.model} on the network. ' +
         'Waiting for device to obtain IP')
 
+  def _device_monitoring(self, mac_addr):
+    LOGGER.debug(f'Preparing test modules for device {mac_addr}')
+    self._test_orc.prepare_test_modules()
+
   def _device_stable(self, mac_addr):
 
     # Do not continue testing if Testrun has cancelled during monitor phase
     if self.get_session().get_status() == TestrunStatus.CANCELLED:
+      self._stop_tests()
       self._stop_network()
       return
 
@@ -0,0 +1,180 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tracks the state of the host network interfaces."""
+from enum import Enum
+import os
+import select
+import socket
+import threading
+from common import logger
+
+LOGGER = logger.get_logger('net_orc')
+
+SYS_CLASS_NET = '/sys/class/net'
+
+# rtnetlink multicast group for link changes
+RTMGRP_LINK = 1
+
+# Time in seconds between reads of the interface states when link
+# events are not available. The states are also read at this interval
+# when link events are available in case an event was missed.
+POLL_INTERVAL = 1
+
+
+class InterfaceEvent(Enum):
+  """Changes to a network interface."""
+  ADDED = 1
+  REMOVED = 2
+  CHANGED = 3
+
+
+class InterfaceMonitor:
+  """Keeps the state of each network interface, updated when the kernel
+  reports a link change, and notifies subscribers of any change.
+
+  Subscribers are called with the InterfaceEvent, the interface name
+  and the interface state, or None if the interface was removed."""
+
+  def __init__(self, poll_interval=POLL_INTERVAL):
+    self._poll_interval = poll_interval
+    self._lock = threading.Lock()
+    self._states = {}
+    self._subscribers = []
+    self._stop_event = threading.Event()
+    self._thread = None
+    self._update()
+
+  def start(self):
+    """Start following interface changes in the background"""
+    if self._thread is not None and self._thread.is_alive():
+      return
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._run,
+                                    name='Interface monitor',
+                                    daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop_event.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def subscribe(self, callback):
+    """Call the callback whenever an interface changes"""
+    with self._lock:
+      self._subscribers.append(callback)
+
+  def get_states(self):
+    """Returns the MAC address, operational state and carrier of
+    each interface by name"""
+    with self._lock:
+      return {name: dict(state) for name, state in self._states.items()}
+
+  def get_state(self, interface_name):
+    with self._lock:
+      state = self._states.get(interface_name)
+      return None if state is None else dict(state)
+
+  def is_up(self, interface_name):
+    """Whether the interface exists and is operationally up"""
+    state = self.get_state(interface_name)
+    return state is not None and state['operstate'] == 'up'
+
+  def _run(self):
+    sock = self._open_netlink()
+    try:
+      while not self._stop_event.is_set():
+        if sock is None:
+          self._stop_event.wait(self._poll_interval)
+        else:
+          readable, _, _ = select.select([sock], [], [], self._poll_interval)
+          if readable:
+            self._drain(sock)
+        self._update()
+    finally:
+      if sock is not None:
+        sock.close()
+
+  def _open_netlink(self):
+    try:
+      sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                           socket.NETLINK_ROUTE)
+      sock.bind((0, RTMGRP_LINK))
+      sock.setblocking(False)
+      return sock
+    except (AttributeError, OSError) as e:
+      LOGGER.debug(f'Link events are not available, polling instead: {e}')
+      return None
+
+  def _drain(self, sock):
+    """Read all pending link events. The events only signal that
+    something changed, the new states are read from sysfs"""
+    while True:
+      try:
+        if not sock.recv(65536):
+          return
+      except BlockingIOError:
+        return
+      except OSError:
+        # Events were lost because the socket buffer was full
+        continue
+
+  def _read_states(self):
+    states = {}
+    try:
+      interfaces = os.listdir(SYS_CLASS_NET)
+    except OSError:
+      return states
+    for name in interfaces:
+      path = os.path.join(SYS_CLASS_NET, name)
+      states[name] = {
+          'mac_addr': self._read_attr(path, 'address'),
+          'operstate': self._read_attr(path, 'operstate'),
+          'carrier': self._read_attr(path, 'carrier') == '1'
+      }
+    return states
+
+  def _read_attr(self, path, attr):
+    try:
+      with open(os.path.join(path, attr), encoding='utf-8') as f:
+        return f.read().strip()
+    except OSError:
+      # Some attributes cannot be read whilst the interface is down
+      return None
+
+  def _update(self):
+    states = self._read_states()
+    with self._lock:
+      previous = self._states
+      self._states = states
+      subscribers = list(self._subscribers)
+
+    events = []
+    for name in previous.keys() - states.keys():
+      events.append((InterfaceEvent.REMOVED, name, None))
+    for name, state in states.items():
+      if name not in previous:
+        events.append((InterfaceEvent.ADDED, name, state))
+      elif previous[name] != state:
+        events.append((InterfaceEvent.CHANGED, name, state))
+
+    for event in events:
+      LOGGER.debug(f'Interface {event[1]} {event[0].name.lower()}')
+      for callback in subscribers:
+        try:
+          callback(*event)
+        except Exception as e:  # pylint: disable=W0703
+          LOGGER.error(f'Error in interface callback: {e}')
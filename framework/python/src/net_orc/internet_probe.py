@@ -0,0 +1,199 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks internet connectivity from inside a network namespace."""
+import ctypes
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from common import logger
+
+LOGGER = logger.get_logger('net_orc')
+
+NETNS_DIR = '/var/run/netns'
+CLONE_NEWNET = 0x40000000
+
+# Address probed for the internet connection. An address is probed
+# rather than a host name so that the result does not depend on the
+# resolver of the host namespace and a resolver can not stall the probe
+PROBE_ADDRESS = '8.8.8.8'
+
+# Time in seconds to wait for a reply
+PROBE_TIMEOUT = 1
+
+# Time in seconds between probes, doubled after each probe with the
+# same result up to the maximum
+MIN_PROBE_INTERVAL = 2
+MAX_PROBE_INTERVAL = 16
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+
+def _setns(fd):
+  if hasattr(os, 'setns'):
+    os.setns(fd, CLONE_NEWNET)
+    return
+  libc = ctypes.CDLL(None, use_errno=True)
+  if libc.setns(fd, CLONE_NEWNET) != 0:
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
+
+
+def _checksum(data):
+  if len(data) % 2:
+    data += b'\x00'
+  total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+  total = (total >> 16) + (total & 0xffff)
+  total += total >> 16
+  return ~total & 0xffff
+
+
+class InternetProbe:
+  """Sends ICMP echo requests from a socket opened once inside the
+  network namespace and caches whether replies are received.
+
+  The socket is opened again if the namespace is recreated."""
+
+  def __init__(self,
+               namespace,
+               address=PROBE_ADDRESS,
+               min_interval=MIN_PROBE_INTERVAL,
+               max_interval=MAX_PROBE_INTERVAL):
+    self._namespace = namespace
+    self._address = address
+    self._min_interval = min_interval
+    self._max_interval = max_interval
+
+    self._socket = None
+    # Namespace the socket was opened in
+    self._socket_ns = None
+    self._identifier = os.getpid() & 0xffff
+    self._sequence = 0
+
+    self._connected = None
+    self._stop_event = threading.Event()
+    self._thread = None
+
+  def start(self):
+    """Start probing in the background"""
+    if self._thread is not None and self._thread.is_alive():
+      return
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._run,
+                                    name='Internet probe',
+                                    daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop_event.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    self._close()
+    self._connected = None
+
+  def is_connected(self):
+    """Returns the result of the last probe, or None if the probe has
+    not completed yet"""
+    return self._connected
+
+  def _run(self):
+    interval = self._min_interval
+    while not self._stop_event.is_set():
+      connected = self._probe()
+      if connected != self._connected:
+        LOGGER.debug(f'Internet connection from {self._namespace}: ' +
+                     str(connected))
+        self._connected = connected
+        interval = self._min_interval
+      else:
+        interval = min(interval * 2, self._max_interval)
+      self._stop_event.wait(interval)
+
+  def _probe(self):
+    try:
+      namespace = self._get_namespace()
+      if self._socket is not None and namespace != self._socket_ns:
+        LOGGER.debug(f'Namespace {self._namespace} has been recreated')
+        self._close()
+      if self._socket is None:
+        self._socket = self._open_socket()
+        self._socket_ns = namespace
+      return self._ping(self._address)
+    except OSError as e:
+      LOGGER.debug(f'Internet probe from {self._namespace} failed: {e}')
+      self._close()
+      return False
+
+  def _get_namespace(self):
+    """Returns the identity of the network namespace, which changes when
+    the namespace is recreated"""
+    stat = os.stat(os.path.join(NETNS_DIR, self._namespace))
+    return stat.st_dev, stat.st_ino
+
+  def _open_socket(self):
+    """Open a raw ICMP socket inside the namespace. Only the calling
+    thread changes namespace and it is changed back straight after"""
+    host_ns = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+      target_ns = os.open(os.path.join(NETNS_DIR, self._namespace),
+                          os.O_RDONLY)
+      try:
+        _setns(target_ns)
+        try:
+          return socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                               socket.IPPROTO_ICMP)
+        finally:
+          _setns(host_ns)
+      finally:
+        os.close(target_ns)
+    finally:
+      os.close(host_ns)
+
+  def _close(self):
+    if self._socket is not None:
+      self._socket.close()
+      self._socket = None
+      self._socket_ns = None
+
+  def _ping(self, address):
+    self._sequence = (self._sequence + 1) & 0xffff
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self._identifier,
+                         self._sequence)
+    payload = b'testrun'
+    checksum = _checksum(header + payload)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum,
+                         self._identifier, self._sequence)
+    self._socket.sendto(header + payload, (address, 0))
+
+    # The raw socket receives all ICMP packets in the namespace
+    deadline = time.monotonic() + PROBE_TIMEOUT
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return False
+      readable, _, _ = select.select([self._socket], [], [], remaining)
+      if not readable:
+        return False
+      data, source = self._socket.recvfrom(1024)
+      ip_header_len = (data[0] & 0x0f) * 4
+      icmp_type, _, _, identifier, sequence = struct.unpack(
+          '!BBHHH', data[ip_header_len:ip_header_len + 8])
+      if (icmp_type == ICMP_ECHO_REPLY and source[0] == address and
+          identifier == self._identifier and sequence == self._sequence):
+        return True
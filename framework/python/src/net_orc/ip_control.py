@@ -256,14 +256,6 @@ class IPControl:
       return False
     return True
 
-  def ping_via_gateway(self, host):
-    """Ping the host trough the gateway container"""
-    command = f'timeout 3 docker exec tr-ct-gateway ping -W 1 -c 1 {host}'
-    output = util.run_command(command)
-    if '0% packet loss' in output[0]:
-      return True
-    return False
-
   @staticmethod
   def get_sys_interfaces() -> t.Dict[str, t.Dict[str, str]]:
     """ Retrieves all Ethernet network interfaces from the host system
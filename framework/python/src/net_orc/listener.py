@@ -15,8 +15,11 @@
 """Intercepts network traffic between network services and the device
 under test."""
 import threading
-from scapy.all import AsyncSniffer, DHCP, get_if_hwaddr
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scapy.all import AsyncSniffer, DHCP, conf, get_if_hwaddr
 from net_orc.network_event import NetworkEvent
+from net_orc import packet_filter
 from common import logger
 
 LOGGER = logger.get_logger('listener')
@@ -27,6 +30,18 @@ DHCP_REQUEST = 3
 DHCP_ACK = 5
 CONTAINER_MAC_PREFIX = '9a:02:57:1e:8f'
 
+# Workers for the callbacks of captured packets
+PACKET_CALLBACK_WORKERS = 4
+
+# Callbacks for captured packets that may be waiting for a worker,
+# after which further packet callbacks are dropped
+MAX_PENDING_CALLBACKS = 64
+
+# Network events raised for each captured packet. Callbacks for any
+# other event, such as a device being discovered, may run for the whole
+# test run so each has its own thread and none are dropped
+PACKET_EVENTS = [NetworkEvent.DHCP_LEASE_ACK]
+
 
 class Listener:
   """Methods to start and stop the network listener."""
@@ -36,34 +51,64 @@ class Listener:
     self._device_intf = self._session.get_device_interface()
     self._device_intf_mac = get_if_hwaddr(self._device_intf)
 
-    self._sniffer = AsyncSniffer(iface=self._device_intf,
-                                 prn=self._packet_callback)
+    self._sniffer = None
+    self._socket = None
 
     self._callbacks = []
-    self._discovered_devices = []
+    self._discovered_devices = set()
+    self._lock = threading.Lock()
+
+    self._executor = ThreadPoolExecutor(
+        max_workers=PACKET_CALLBACK_WORKERS,
+        thread_name_prefix='Packet callback thread')
+    self._pending_callbacks = 0
+
+    # Counters for the current second and the last complete second
+    self._second = int(time.monotonic())
+    self._counters = self._new_counters()
+    self._stats = self._new_counters()
 
   def start_listener(self):
     """Start sniffing packets on the device interface."""
 
     # Don't start the listener if it is already running
-    if self._sniffer.running:
+    if self.is_running():
       LOGGER.debug('Listener was already running')
       return
 
+    self._socket = conf.L2listen(iface=self._device_intf)
+    self._update_filter()
+
+    # Packets are handled as they arrive so are not stored
+    self._sniffer = AsyncSniffer(opened_socket=self._socket,
+                                 prn=self._packet_callback,
+                                 store=False)
     self._sniffer.start()
 
   def reset(self):
     self._callbacks = []
-    self._discovered_devices = []
+    with self._lock:
+      self._discovered_devices = set()
+      self._update_filter()
 
   def stop_listener(self):
     """Stop sniffing packets on the device interface."""
-    if self._sniffer.running:
+    if self.is_running():
       self._sniffer.stop()
+    if self._socket is not None:
+      self._socket.close()
+      self._socket = None
 
   def is_running(self):
     """Determine whether the sniffer is running."""
-    return self._sniffer.running
+    return self._sniffer is not None and self._sniffer.running
+
+  def get_stats(self):
+    """Returns the packets received by the listener, the packets dropped
+    by the kernel and the packet callbacks dropped in the last second."""
+    with self._lock:
+      self._update_stats()
+      return dict(self._stats)
 
   def register_callback(self, callback, events=[]):  # pylint: disable=dangerous-default-value
     """Register a callback for specified events."""
@@ -71,26 +116,91 @@ class Listener:
 
   def call_callback(self, net_event, *args):
     for callback in self._callbacks:
-      if net_event in callback['events']:
-        callback_thread = threading.Thread(target=callback['callback'],
+      if net_event not in callback['events']:
+        continue
+      if net_event not in PACKET_EVENTS:
+        callback_thread = threading.Thread(target=self._run_callback,
                                            name='Callback thread',
-                                           args=args)
+                                           args=(net_event,
+                                                 callback['callback']) + args)
         callback_thread.start()
+        continue
+      with self._lock:
+        # Callbacks for packets are dropped rather than queued
+        # without limit if the workers cannot keep up
+        if self._pending_callbacks >= MAX_PENDING_CALLBACKS:
+          self._counters['callbacks_dropped'] += 1
+          continue
+        self._pending_callbacks += 1
+      self._executor.submit(self._run_callback, net_event,
+                            callback['callback'], *args)
+
+  def _run_callback(self, net_event, callback, *args):
+    if net_event in PACKET_EVENTS:
+      with self._lock:
+        self._pending_callbacks -= 1
+    try:
+      callback(*args)
+    except Exception as e:  # pylint: disable=W0703
+      LOGGER.error(f'Error in callback for {net_event}: {e}')
 
   def _packet_callback(self, packet):
+    with self._lock:
+      self._update_stats()
+      self._counters['packets'] += 1
 
     # DHCP ACK callback
     if DHCP in packet and self._get_dhcp_type(packet) == DHCP_ACK:
       self.call_callback(NetworkEvent.DHCP_LEASE_ACK, packet)
 
     # New device discovered callback
-    if not packet.src is None and packet.src not in self._discovered_devices:
-      # Ignore packets originating from our containers
-      if packet.src.startswith(
-          CONTAINER_MAC_PREFIX) or packet.src == self._device_intf_mac:
+    if packet.src is None:
+      return
+    with self._lock:
+      # Packets from our containers are normally filtered out by the
+      # kernel, so this only applies if the filter is not attached
+      if (packet.src in self._discovered_devices or
+          packet.src.startswith(CONTAINER_MAC_PREFIX) or
+          packet.src == self._device_intf_mac):
         return
-      self._discovered_devices.append(packet.src)
-      self.call_callback(NetworkEvent.DEVICE_DISCOVERED, packet.src)
+      self._discovered_devices.add(packet.src)
+      self._update_filter()
+    self.call_callback(NetworkEvent.DEVICE_DISCOVERED, packet.src)
+
+  def _update_filter(self):
+    """Only pass DHCP packets and packets from undiscovered devices
+    from the kernel to the listener"""
+    if self._socket is None:
+      return
+    try:
+      packet_filter.attach_filter(
+          self._socket.ins,
+          packet_filter.build_listener_filter(
+              [self._device_intf_mac] + list(self._discovered_devices),
+              CONTAINER_MAC_PREFIX))
+    except OSError as e:
+      LOGGER.error(f'Failed to attach packet filter: {e}')
+
+  def _new_counters(self):
+    return {'packets': 0, 'packets_dropped': 0, 'callbacks_dropped': 0}
+
+  def _update_stats(self):
+    """Move the counters to the stats at the end of each second"""
+    second = int(time.monotonic())
+    if second == self._second:
+      return
+    if self._socket is not None:
+      try:
+        _, self._counters['packets_dropped'] = packet_filter.get_socket_stats(
+            self._socket.ins)
+      except OSError as e:
+        LOGGER.debug(f'Failed to read socket statistics: {e}')
+
+    # No packets were received in a second without a callback
+    self._stats = (self._counters
+                   if second == self._second + 1 else self._new_counters())
+    self._second = second
+    self._counters = self._new_counters()
 
   def _get_dhcp_type(self, packet):
     return packet[DHCP].options[0][1]
@@ -0,0 +1,302 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Netlink IP Control Module"""
+import ipaddress
+import os
+import typing as t
+from dataclasses import dataclass, field
+import docker
+from common import logger
+from net_orc.ip_control import IPControl
+
+try:
+  from pyroute2 import IPRoute, NetNS, netns
+  NETLINK_AVAILABLE = True
+except ImportError:
+  NETLINK_AVAILABLE = False
+
+LOGGER = logger.get_logger('ip_ctrl')
+NETNS_DIR = '/var/run/netns'
+
+
+@dataclass
+class IPOperation:
+  """A single rtnetlink request on a network interface"""
+
+  # 'link' or 'addr'
+  kind: str
+
+  # 'add', 'set' or 'del'
+  action: str
+
+  interface: str
+  attrs: t.Dict[str, t.Any] = field(default_factory=dict)
+
+
+@dataclass
+class IPResult:
+  """The outcome of an IPOperation"""
+  operation: IPOperation
+  success: bool
+  error: t.Optional[str] = None
+
+
+def create_ip_control():
+  """Returns an IPControl that uses netlink if it is available,
+  otherwise one that uses the ip command"""
+  if NETLINK_AVAILABLE:
+    return NetlinkIPControl()
+  LOGGER.info('pyroute2 is not installed, using ip commands for networking')
+  return IPControl()
+
+
+class NetlinkIPControl(IPControl):
+  """IP Control using rtnetlink rather than the ip command"""
+
+  def apply(self, operations, namespace=None) -> t.List[IPResult]:
+    """Apply the operations in order over a single netlink socket,
+    in the network namespace if given. Stops at the first failure.
+
+    Returns:
+        List[IPResult]: the result of each operation attempted
+    """
+    results = []
+
+    # Interface indexes resolved so far, saving a lookup per operation
+    indexes = {}
+    try:
+      with self._open(namespace) as ipr:
+        for operation in operations:
+          result = self._apply_operation(ipr, operation, indexes)
+          results.append(result)
+          if not result.success:
+            break
+    except Exception as e:  # pylint: disable=W0703
+      # Failed to open the socket or the namespace
+      operation = operations[min(len(results), len(operations) - 1)]
+      results.append(IPResult(operation, False, str(e)))
+    return results
+
+  def _open(self, namespace):
+    if namespace is None:
+      return IPRoute()
+    return NetNS(namespace)
+
+  def _apply_operation(self, ipr, operation, indexes):
+    try:
+      attrs = dict(operation.attrs)
+      if operation.kind == 'link' and operation.action == 'add':
+        ipr.link('add', ifname=operation.interface, **attrs)
+        return IPResult(operation, True)
+
+      index = indexes.get(operation.interface)
+      if index is None:
+        found = ipr.link_lookup(ifname=operation.interface)
+        if not found:
+          return IPResult(operation, False,
+                          f'Interface {operation.interface} not found')
+        index = found[0]
+      getattr(ipr, operation.kind)(operation.action, index=index, **attrs)
+
+      # Keep the index of the interface whilst it is in this namespace
+      indexes.pop(operation.interface, None)
+      if operation.kind == 'addr' or not (operation.action == 'del' or
+                                          'net_ns_fd' in attrs):
+        indexes[attrs.get('ifname', operation.interface)] = index
+      return IPResult(operation, True)
+    except Exception as e:  # pylint: disable=W0703
+      return IPResult(operation, False, str(e))
+
+  def _apply_all(self, operations, namespace=None):
+    """Apply the operations and log any failure"""
+    for result in self.apply(operations, namespace):
+      if not result.success:
+        operation = result.operation
+        LOGGER.error(f'Failed to {operation.action} {operation.kind} ' +
+                     f'{operation.interface}: {result.error}')
+        return False
+    return True
+
+  def add_link(self, interface_name, peer_name):
+    """Create an ip link with a peer"""
+    return self._apply_all([
+        IPOperation('link', 'add', interface_name, {
+            'kind': 'veth',
+            'peer': peer_name
+        })
+    ])
+
+  def add_namespace(self, namespace):
+    """Add a network namespace"""
+    exists = self.namespace_exists(namespace)
+    LOGGER.info('Namespace exists: ' + str(exists))
+    if exists:
+      return True
+    try:
+      netns.create(namespace)
+      return True
+    except OSError as e:
+      LOGGER.error(f'Failed to add namespace {namespace}: {e}')
+      return False
+
+  def check_interface_status(self, interface_name):
+    link = self.get_link(interface_name)
+    return link is not None and link['state'] == 'UP'
+
+  def delete_link(self, interface_name):
+    """Delete an ip link"""
+    return self._apply_all([IPOperation('link', 'del', interface_name)])
+
+  def delete_namespace(self, interface_name):
+    """Delete an ip namespace"""
+    try:
+      netns.remove(interface_name)
+      return True
+    except OSError as e:
+      LOGGER.error(f'Failed to delete namespace {interface_name}: {e}')
+      return False
+
+  def get_link(self, interface_name, namespace=None):
+    """Returns the name, index, state and MAC address of an interface,
+    or None if it does not exist"""
+    for link in self.get_link_details(namespace):
+      if link['name'] == interface_name:
+        return link
+    return None
+
+  def get_link_details(self, namespace=None):
+    """Returns the name, index, state and MAC address of all interfaces"""
+    try:
+      with self._open(namespace) as ipr:
+        return [{
+            'name': link.get_attr('IFLA_IFNAME'),
+            'index': link['index'],
+            'state': link.get_attr('IFLA_OPERSTATE'),
+            'mac_addr': link.get_attr('IFLA_ADDRESS')
+        } for link in ipr.get_links()]
+    except Exception as e:  # pylint: disable=W0703
+      LOGGER.error(f'Failed to list interfaces: {e}')
+      return []
+
+  def get_links(self):
+    return [link['name'] for link in self.get_link_details()]
+
+  def get_namespaces(self):
+    return netns.listnetns()
+
+  def set_namespace(self, interface_name, namespace):
+    """Attach an interface to a network namespace"""
+    return self._apply_all(
+        [IPOperation('link', 'set', interface_name, {'net_ns_fd': namespace})])
+
+  def rename_interface(self, interface_name, namespace, new_name):
+    """Rename an interface"""
+    return self._apply_all(
+        [IPOperation('link', 'set', interface_name, {'ifname': new_name})],
+        namespace)
+
+  def set_interface_mac(self, interface_name, namespace, mac_addr):
+    """Set MAC address of an interface"""
+    return self._apply_all(
+        [IPOperation('link', 'set', interface_name, {'address': mac_addr})],
+        namespace)
+
+  def set_interface_ip(self, interface_name, namespace, ipaddr):
+    """Set IP address of an interface"""
+    return self._apply_all([self._address_operation(interface_name, ipaddr)],
+                           namespace)
+
+  def set_interface_up(self, interface_name, namespace=None):
+    """Set the interface to the up state"""
+    return self._apply_all(
+        [IPOperation('link', 'set', interface_name, {'state': 'up'})],
+        namespace)
+
+  def _address_operation(self, interface_name, ipaddr):
+    interface = ipaddress.ip_interface(ipaddr)
+    return IPOperation('addr', 'add', interface_name, {
+        'address': str(interface.ip),
+        'prefixlen': interface.network.prefixlen
+    })
+
+  def _link_container_namespace(self, container_name, namespace):
+    """Expose the network namespace of a running container by name"""
+    try:
+      client = docker.from_env()
+      container_pid = client.containers.get(container_name).attrs['State'][
+          'Pid']
+    except (docker.errors.NotFound, docker.errors.APIError) as e:
+      LOGGER.error(f'Failed to resolve pid for {container_name}: {e}')
+      return False
+
+    if not container_pid:
+      LOGGER.error(f'Failed to resolve pid for {container_name}')
+      return False
+
+    netns_path = os.path.join(NETNS_DIR, namespace)
+    try:
+      os.makedirs(NETNS_DIR, exist_ok=True)
+      if os.path.lexists(netns_path):
+        os.remove(netns_path)
+      os.symlink(f'/proc/{container_pid}/ns/net', netns_path)
+    except OSError as e:
+      LOGGER.error(f'Failed to link {container_name} to namespace ' +
+                   f'{namespace}: {e}')
+      return False
+    return True
+
+  def configure_container_interface(self,
+                                    bridge_intf,
+                                    container_intf,
+                                    namespace_intf,
+                                    namespace,
+                                    mac_addr,
+                                    container_name=None,
+                                    ipv4_addr=None,
+                                    ipv6_addr=None):
+
+    # Cleanup old interface
+    if self.link_exists(bridge_intf) and not self.delete_link(bridge_intf):
+      return False
+
+    if container_name is not None:
+      if not self._link_container_namespace(container_name, namespace):
+        return False
+
+    # Create the interface pair, then move the container interface
+    # into the container network namespace
+    if not self._apply_all([
+        IPOperation('link', 'add', bridge_intf, {
+            'kind': 'veth',
+            'peer': container_intf
+        }),
+        IPOperation('link', 'set', container_intf, {'address': mac_addr}),
+        IPOperation('link', 'set', container_intf, {'net_ns_fd': namespace}),
+        IPOperation('link', 'set', bridge_intf, {'state': 'up'})
+    ]):
+      return False
+
+    # Configure the container interface inside the namespace
+    namespace_operations = [
+        IPOperation('link', 'set', container_intf, {'ifname': namespace_intf})
+    ]
+    for ipaddr in [ipv4_addr, ipv6_addr]:
+      if ipaddr is not None:
+        namespace_operations.append(
+            self._address_operation(namespace_intf, ipaddr))
+    namespace_operations.append(
+        IPOperation('link', 'set', namespace_intf, {'state': 'up'}))
+
+    return self._apply_all(namespace_operations, namespace)
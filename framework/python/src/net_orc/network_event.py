@@ -21,3 +21,4 @@ class NetworkEvent(Enum):
   DEVICE_DISCOVERED = 1
   DEVICE_STABLE = 2
   DHCP_LEASE_ACK = 3
+  DEVICE_MONITORING = 4
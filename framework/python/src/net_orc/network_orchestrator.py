@@ -16,20 +16,28 @@ all of the virtual network services"""
 import ipaddress
 import json
 import os
-from scapy.all import sniff, wrpcap, BOOTP, AsyncSniffer
+from scapy.all import sniff, BOOTP, AsyncSniffer
 from scapy.error import Scapy_Exception
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from common import logger, util, mqtt
+from common.packet_index import (PacketIndexBuilder, PACKET_INDEX_FILE,
+                                 CAPTURE_STARTUP, CAPTURE_MONITOR)
 from common.statuses import TestrunStatus
+from net_orc.interface_monitor import InterfaceMonitor
+from net_orc.internet_probe import InternetProbe
 from net_orc.listener import Listener
 from net_orc.network_event import NetworkEvent
 from net_orc.network_validator import NetworkValidator
 from net_orc.ovs_control import OVSControl
-from net_orc.ip_control import IPControl
+from net_orc.netlink_control import create_ip_control
+from net_orc.packet_capture import PacketCapture
 from core.docker.network_docker_module import NetworkModule
 
 LOGGER = logger.get_logger('net_orc')
@@ -45,6 +53,8 @@ DEVICE_BRIDGE = 'tr-d'
 INTERNET_BRIDGE = 'tr-c'
 PRIVATE_DOCKER_NET = 'tr-private-net'
 CONTAINER_NAME = 'network_orchestrator'
+CONTAINER_MAC_PREFIX = '9a:02:57:1e:8f:'
+GATEWAY_NAMESPACE = 'tr-ctns-gateway'
 
 
 class NetworkOrchestrator:
@@ -54,7 +64,6 @@ class NetworkOrchestrator:
 
     self._session = session
     self._monitor_in_progress = False
-    self._monitor_packets = []
     self._listener = None
     self._net_modules = []
 
@@ -66,7 +75,20 @@ class NetworkOrchestrator:
     self.validator = NetworkValidator()
     self.network_config = NetworkConfig()
     self._ovs = OVSControl(self._session)
-    self._ip_ctrl = IPControl()
+    self._ip_ctrl = create_ip_control()
+
+    # Set whilst the device interface is down or missing
+    self._device_disconnected = threading.Event()
+    self._interface_monitor = InterfaceMonitor()
+    self._interface_monitor.subscribe(self._interface_changed)
+    self._interface_monitor.start()
+
+    # Checks the internet connection from the gateway container
+    self._internet_probe = InternetProbe(GATEWAY_NAMESPACE)
+    self._internet_message = None
+
+    # Network settings whilst the network is running
+    self._network_settings = None
 
     # Load subnet information into the session
     self._session.set_subnets(self.network_config.ipv4_network,
@@ -77,9 +99,6 @@ class NetworkOrchestrator:
 
     LOGGER.debug('Starting network orchestrator')
 
-    # Delete the runtime/network directory
-    shutil.rmtree(os.path.join(os.getcwd(), NET_DIR), ignore_errors=True)
-
     # Cleanup any old config files test files
     conf_runtime_dir = os.path.join(RUNTIME_DIR, 'conf')
     shutil.rmtree(conf_runtime_dir, ignore_errors=True)
@@ -90,6 +109,13 @@ class NetworkOrchestrator:
     with open(system_conf_runtime, 'w', encoding='utf-8') as f:
       json.dump(self.get_session().get_config(), f, indent=2)
 
+    # Reuse the network from the previous test run if it is kept running
+    if self._session.get_warm_network() and self._reset_network():
+      return True
+
+    # Delete the runtime/network directory
+    shutil.rmtree(os.path.join(os.getcwd(), NET_DIR), ignore_errors=True)
+
     # Get all components ready
     self.load_network_modules()
 
@@ -98,6 +124,53 @@ class NetworkOrchestrator:
 
     self.start_network()
 
+    self._network_settings = self._get_network_settings()
+
+    return True
+
+  def _get_network_settings(self):
+    """Settings which require the network to be started again
+    if they are changed"""
+    return (self._session.get_device_interface(),
+            self._session.get_internet_interface(),
+            sorted(self._session.get_runtime_params()))
+
+  def _reset_network(self):
+    """Reset the per device state of the running network services.
+    Returns False if the network is not running as expected and should
+    be started again"""
+    if (self._network_settings is None or
+        self._network_settings != self._get_network_settings()):
+      return False
+
+    net_modules = [
+        net_module for net_module in self._net_modules
+        if net_module.enable_container
+    ]
+    if not all(
+        net_module.get_status() == 'running' for net_module in net_modules):
+      LOGGER.info('Network services are not running, restarting network')
+      return False
+
+    if not self._ovs.validate_baseline_network():
+      LOGGER.info('Baseline network is not valid, restarting network')
+      return False
+
+    LOGGER.info('Resetting the running network')
+
+    # Remove files describing the previous device
+    net_dir = os.path.join(os.getcwd(), NET_DIR)
+    for file in os.listdir(net_dir):
+      if file.startswith('ethtool_'):
+        os.remove(os.path.join(net_dir, file))
+
+    with ThreadPoolExecutor(max_workers=max(len(net_modules), 1)) as executor:
+      if not all(executor.map(lambda net_module: net_module.reset(),
+                              net_modules)):
+        LOGGER.info('Failed to reset network services, restarting network')
+        return False
+
+    self._create_listener()
     return True
 
   def check_config(self):
@@ -153,10 +226,12 @@ class NetworkOrchestrator:
     LOGGER.debug('Starting network listener')
     self.get_listener().start_listener()
 
-  def stop(self, kill=False):
-    """Stop the network orchestrator."""
-    self.stop_validator(kill=kill)
-    self.stop_network(kill=kill)
+  def stop(self, kill=False, keep_network=False):
+    """Stop the network orchestrator. The network is left running
+    if keep_network is set, so that it can be reused."""
+    if not keep_network:
+      self.stop_validator(kill=kill)
+      self.stop_network(kill=kill)
 
     # Listener may not have been defined yet
     if self.get_listener() is not None:
@@ -170,6 +245,8 @@ class NetworkOrchestrator:
 
   def stop_network(self, kill=False):
     """Stop the virtual testing network."""
+    self._network_settings = None
+
     # Shutdown network
     self.stop_networking_services(kill=kill)
     self.restore_net()
@@ -209,10 +286,20 @@ class NetworkOrchestrator:
 
     util.run_command(f'chown -R {util.get_host_user()} {device_runtime_dir}')
 
-    packet_capture = sniff(iface=self._session.get_device_interface(),
-                           timeout=self._session.get_startup_timeout(),
-                           stop_filter=self._device_has_ip)
-    wrpcap(os.path.join(device_runtime_dir, 'startup.pcap'), packet_capture)
+    # Index the device packets as they are captured so that test
+    # modules do not need to dissect the captures
+    packet_index = PacketIndexBuilder()
+
+    startup_capture = self._create_capture(
+        os.path.join(device_runtime_dir, 'startup.pcap'),
+        index=packet_index,
+        capture_id=CAPTURE_STARTUP)
+    sniff(iface=self._session.get_device_interface(),
+          timeout=self._session.get_startup_timeout(),
+          prn=startup_capture.write,
+          store=False,
+          stop_filter=self._device_has_ip)
+    startup_capture.close()
 
     # Copy the device config file to the runtime directory
     runtime_device_conf = os.path.join(device_runtime_dir, 'device_config.json')
@@ -234,7 +321,7 @@ class NetworkOrchestrator:
 
     # Don't monitor devices when in network only mode
     if 'net_only' not in self._session.get_runtime_params():
-      self._start_device_monitor(device)
+      self._start_device_monitor(device, packet_index)
 
   def _get_conn_stats(self):
     """ Extract information about the physical connection
@@ -281,24 +368,33 @@ class NetworkOrchestrator:
     # TODO: Check if device is None
     device.ip_addr = packet[BOOTP].yiaddr
 
-  def _start_device_monitor(self, device):
+  def _start_device_monitor(self, device, packet_index):
     """Start a timer until the steady state has been reached and
         callback the steady state method for this device."""
     self.get_session().set_status(TestrunStatus.MONITORING)
-    self._monitor_packets = []
     LOGGER.info(f'Monitoring device with mac addr {device.mac_addr} '
                 f'for {str(self._session.get_monitor_period())} seconds')
 
     device_runtime_dir = os.path.join(RUNTIME_DIR, TEST_DIR,
                                       device.mac_addr.replace(':', ''))
 
+    monitor_capture = os.path.join(device_runtime_dir, MONITOR_PCAP)
+    capture = self._create_capture(monitor_capture,
+                                   index=packet_index,
+                                   capture_id=CAPTURE_MONITOR)
     sniffer = AsyncSniffer(iface=self._session.get_device_interface(),
                            timeout=self._session.get_monitor_period(),
-                           prn=self._monitor_packet_callback)
+                           prn=capture.write,
+                           store=False)
     sniffer.start()
 
+    # Allow test modules to be prepared whilst the device is monitored
+    self.get_listener().call_callback(NetworkEvent.DEVICE_MONITORING,
+                                      device.mac_addr)
+
     while sniffer.running:
-      time.sleep(1)
+      # Woken early if the device interface is disconnected
+      self._device_disconnected.wait(timeout=1)
 
       # Check Testrun hasn't been cancelled
       if self._session.get_status() in (
@@ -306,10 +402,10 @@ class NetworkOrchestrator:
                                         TestrunStatus.CANCELLED
                                         ):
         sniffer.stop()
+        capture.close()
         return
 
-      if not self._ip_ctrl.check_interface_status(
-          self._session.get_device_interface()):
+      if not self.is_device_connected():
         try:
           sniffer.stop()
         except Scapy_Exception:
@@ -318,28 +414,41 @@ class NetworkOrchestrator:
           self._session.set_status(TestrunStatus.CANCELLED)
           LOGGER.error('Device interface disconnected, cancelling Testrun')
 
-    LOGGER.debug('Writing packets to monitor.pcap')
-    wrpcap(os.path.join(device_runtime_dir, 'monitor.pcap'),
-           self._monitor_packets)
+    capture.close()
+    util.run_command(f'chown -R {util.get_host_user()} {monitor_capture}')
+    self._save_packet_index(packet_index, device_runtime_dir)
     self._monitor_in_progress = False
     self._get_port_stats(pre_monitor=False)
     self.get_listener().call_callback(NetworkEvent.DEVICE_STABLE,
                                       device.mac_addr)
 
-  def _monitor_packet_callback(self, packet):
-    self._monitor_packets.append(packet)
-
-  def _check_network_services(self):
-    LOGGER.debug('Checking network modules...')
-    for net_module in self._net_modules:
-      if net_module.enable_container:
-        LOGGER.debug('Checking network module: ' + net_module.display_name)
-        success = self._ping(net_module)
-        if success:
-          LOGGER.debug(net_module.display_name + ' responded succesfully: ' +
-                       str(success))
-        else:
-          LOGGER.error(net_module.display_name + ' failed to respond to ping')
+  def _create_capture(self, file_path, index=None, capture_id=0):
+    return PacketCapture(
+        file_path,
+        snaplen=self._session.get_capture_snaplen(),
+        max_bytes=self._session.get_max_capture_size(),
+        index=index,
+        capture_id=capture_id)
+
+  def _save_packet_index(self, packet_index, device_runtime_dir):
+    """Save the index of the device captures for the test modules.
+    Test modules read the captures instead if this fails"""
+    index_file = os.path.join(device_runtime_dir, PACKET_INDEX_FILE)
+    try:
+      packet_index.save(index_file)
+      util.run_command(f'chown -R {util.get_host_user()} {index_file}')
+      LOGGER.debug(f'Indexed {len(packet_index)} packets to {index_file}')
+    except Exception as e:  # pylint: disable=W0703
+      LOGGER.error(f'Failed to save packet index: {e}')
+
+  def _check_network_service(self, net_module):
+    LOGGER.debug('Checking network module: ' + net_module.display_name)
+    success = self._ping(net_module)
+    if success:
+      LOGGER.debug(net_module.display_name + ' responded succesfully: ' +
+                   str(success))
+    else:
+      LOGGER.error(net_module.display_name + ' failed to respond to ping')
 
   def _ping(self, net_module):
     host = net_module.net_config.ipv4_address
@@ -416,6 +525,9 @@ class NetworkOrchestrator:
     # a use case is determined
     #self._create_private_net()
 
+    self._create_listener()
+
+  def _create_listener(self):
     # Listener may have already been created. Only create if not
     if self._listener is None:
       self._listener = Listener(self._session)
@@ -489,6 +601,14 @@ class NetworkOrchestrator:
     net_module.start()
     if net_module.get_network() != 'host':
       self._attach_service_to_network(net_module)
+      self._check_network_service(net_module)
+
+  def _start_network_service_after(self, net_module, dependency):
+    """Start the network service once its dependency is running"""
+    if dependency is not None:
+      # Raises if the dependency failed to start
+      dependency.result()
+    self._start_network_service(net_module)
 
   def _stop_service_module(self, net_module, kill=False):
     LOGGER.debug('Stopping network container ' + net_module.container_name)
@@ -496,6 +616,7 @@ class NetworkOrchestrator:
 
   def stop_networking_services(self, kill=False):
     LOGGER.info('Stopping network services')
+    self._internet_probe.stop()
     for net_module in self._net_modules:
       # Network modules may just be Docker images,
       # so we do not want to stop them
@@ -508,25 +629,48 @@ class NetworkOrchestrator:
 
     os.makedirs(os.path.join(os.getcwd(), NET_DIR), exist_ok=True)
 
-    for net_module in self._net_modules:
-
-      # Network modules may just be Docker images,
-      # so we do not want to start them as containers
-      if not net_module.enable_container:
-        continue
+    # Network modules may just be Docker images,
+    # so we do not want to start them as containers
+    net_modules = [
+        net_module for net_module in self._net_modules
+        if net_module.enable_container
+    ]
+    deadline = time.monotonic() + self._session.get_network_timeout()
+
+    # Start services concurrently, each after the service it depends on.
+    # Dependencies are loaded before the modules that depend on them
+    executor = ThreadPoolExecutor(max_workers=max(len(net_modules), 1))
+    started = {}
+    for net_module in net_modules:
+      dependency = self._get_network_module(net_module.depends_on)
+      started[net_module.dir_name] = executor.submit(
+          self._start_network_service_after, net_module,
+          started.get(dependency.dir_name) if dependency else None)
+
+    _, not_done = futures.wait(started.values(),
+                               timeout=max(deadline - time.monotonic(), 0))
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    if not_done:
+      LOGGER.error('Network services did not start within ' +
+                   f'{self._session.get_network_timeout()} seconds. Exiting.')
+      sys.exit(1)
 
-      self._start_network_service(net_module)
+    # Raise any error from starting a service, including exiting
+    for future in started.values():
+      future.result()
 
     LOGGER.info('All network services are running')
-    self._check_network_services()
+    self._internet_probe.start()
 
-  def attach_test_module_to_network(self, test_module):
+  def attach_test_module_to_network(self, test_module, connect=True):
+    """Configure the network interface of a test module container.
+    If connect is False, the interface is not added to the device bridge
+    until connect_test_module_to_network is called"""
     LOGGER.debug('Attaching test module  ' + test_module.display_name +
                  ' to device bridge')
 
-    # Device bridge interface example:
-    # tr-d-t-baseline (Test Run Device Interface for Test container)
-    bridge_intf = DEVICE_BRIDGE + '-t-' + test_module.dir_name
+    bridge_intf = self._get_test_module_bridge_intf(test_module)
 
     # Container interface example:
     # tr-cti-baseline-test (Test Run Container Interface for test container)
@@ -535,36 +679,9 @@ class NetworkOrchestrator:
     # Container network namespace name
     container_net_ns = 'tr-test-' + test_module.dir_name
 
-    # Create interface pair
-    util.run_command('ip link add ' + bridge_intf + ' type veth peer name ' +
-                     container_intf)
-
-    # Add bridge interface to device bridge
-    self._ovs.add_port(port=bridge_intf, bridge_name=DEVICE_BRIDGE)
-
-    # Get PID for running container
-    # TODO: Some error checking around missing PIDs might be required
-    container_pid = util.run_command('docker inspect -f {{.State.Pid}} ' +
-                                     test_module.container_name)[0]
-
-    # Create symlink for container network namespace
-    util.run_command('ln -sf /proc/' + container_pid +
-                     '/ns/net /var/run/netns/' + container_net_ns)
-
-    # Attach container interface to container network namespace
-    util.run_command('ip link set ' + container_intf + ' netns ' +
-                     container_net_ns)
-
-    # Rename container interface name to veth0
-    util.run_command('ip netns exec ' + container_net_ns + ' ip link set dev ' +
-                     container_intf + ' name veth0')
-
-    # Set MAC address of container interface
-    util.run_command('ip netns exec ' + container_net_ns +
-                     ' ip link set dev veth0 address 9a:02:57:1e:8f:' +
-                     str(test_module.ip_index))
-
-    # Set IP address of container interface
+    # Resolve the interface information from the ip index of the module
+    # so each test module has its own identity on the device bridge
+    mac_addr = CONTAINER_MAC_PREFIX + f'{test_module.ip_index:02x}'
     ipv4_address = self.network_config.ipv4_network[test_module.ip_index]
     ipv6_address = self.network_config.ipv6_network[test_module.ip_index]
 
@@ -573,16 +690,31 @@ class NetworkOrchestrator:
     ipv6_address_with_prefix = str(ipv6_address) + '/' + str(
         self.network_config.ipv6_network.prefixlen)
 
-    util.run_command('ip netns exec ' + container_net_ns + ' ip addr add ' +
-                     ipv4_address_with_prefix + ' dev veth0')
+    # Add and configure the interface container
+    if not self._ip_ctrl.configure_container_interface(
+        bridge_intf, container_intf, 'veth0', container_net_ns, mac_addr,
+        test_module.container_name, ipv4_address_with_prefix,
+        ipv6_address_with_prefix):
+      LOGGER.error('Failed to configure local networking for ' +
+                   test_module.name)
+      return False
+
+    if not connect:
+      return True
 
-    util.run_command('ip netns exec ' + container_net_ns + ' ip addr add ' +
-                     ipv6_address_with_prefix + ' dev veth0')
+    return self.connect_test_module_to_network(test_module)
 
-    # Set interfaces up
-    util.run_command('ip link set dev ' + bridge_intf + ' up')
-    util.run_command('ip netns exec ' + container_net_ns +
-                     ' ip link set dev veth0 up')
+  def connect_test_module_to_network(self, test_module):
+    """Add the interface of an attached test module to the device bridge"""
+    LOGGER.debug('Connecting test module ' + test_module.display_name +
+                 ' to device bridge')
+    bridge_intf = self._get_test_module_bridge_intf(test_module)
+    return self._ovs.add_port(port=bridge_intf, bridge_name=DEVICE_BRIDGE)
+
+  def _get_test_module_bridge_intf(self, test_module):
+    # Device bridge interface example:
+    # tr-d-t-baseline (Test Run Device Interface for Test container)
+    return DEVICE_BRIDGE + '-t-' + test_module.dir_name
 
   # TODO: Let's move this into a separate script? It does not look great
   def _attach_service_to_network(self, net_module):
@@ -601,7 +733,7 @@ class NetworkOrchestrator:
     container_net_ns = 'tr-ctns-' + net_module.dir_name
 
     # Resolve the interface information
-    mac_addr = '9a:02:57:1e:8f:' + str(net_module.net_config.ip_index)
+    mac_addr = CONTAINER_MAC_PREFIX + f'{net_module.net_config.ip_index:02x}'
     ipv4_addr = net_module.net_config.get_ipv4_addr_with_prefix()
     ipv6_addr = net_module.net_config.get_ipv6_addr_with_prefix()
 
@@ -614,11 +746,8 @@ class NetworkOrchestrator:
       sys.exit(1)
 
     # Add bridge interface to device bridge
-    if self._ovs.add_port(port=bridge_intf, bridge_name=DEVICE_BRIDGE):
-      if not self._ovs.port_exists(bridge_name=DEVICE_BRIDGE, port=bridge_intf):
-        LOGGER.error('Failed to add ' + net_module.name + ' to device bridge ' +
-                     DEVICE_BRIDGE + '. Exiting.')
-        sys.exit(1)
+    transaction = self._ovs.transaction()
+    transaction.add_port(port=bridge_intf, bridge_name=DEVICE_BRIDGE)
 
     if net_module.net_config.enable_wan:
       LOGGER.debug('Attaching net service ' + net_module.display_name +
@@ -639,12 +768,13 @@ class NetworkOrchestrator:
         sys.exit(1)
 
       # Attach bridge interface to internet bridge
-      if self._ovs.add_port(port=bridge_intf, bridge_name=INTERNET_BRIDGE):
-        if not self._ovs.port_exists(bridge_name=INTERNET_BRIDGE,
-                                     port=bridge_intf):
-          LOGGER.error('Failed to add ' + net_module.name +
-                       ' to internet bridge ' + DEVICE_BRIDGE + '. Exiting.')
-          sys.exit(1)
+      transaction.add_port(port=bridge_intf, bridge_name=INTERNET_BRIDGE)
+
+    # Add all ports of the service together and check they were added
+    if not transaction.commit(verify=True):
+      LOGGER.error('Failed to add ' + net_module.name + ' to the virtual ' +
+                   'network. Exiting.')
+      sys.exit(1)
 
   def remove_arp_filters(self):
     LOGGER.info('Removing ARP inspection filters')
@@ -695,9 +825,18 @@ class NetworkOrchestrator:
 
   def is_device_connected(self):
     """Check if device connected"""
-    return self._ip_ctrl.check_interface_status(
-        self._session.get_device_interface()
-      )
+    return self._interface_monitor.is_up(self._session.get_device_interface())
+
+  def get_interface_monitor(self):
+    return self._interface_monitor
+
+  def _interface_changed(self, event, interface_name, state):  # pylint: disable=unused-argument
+    if interface_name != self._session.get_device_interface():
+      return
+    if state is None or state['operstate'] != 'up':
+      self._device_disconnected.set()
+    else:
+      self._device_disconnected.clear()
 
   def internet_conn_checker(self, mqtt_client: mqtt.MQTT, topic: str):
     """Checks internet connection and sends a status to frontend"""
@@ -718,16 +857,16 @@ class NetworkOrchestrator:
       iface = self._session.get_internet_interface()
 
       # Check that an internet intf has been selected
-      if iface and iface in self._ip_ctrl.get_sys_interfaces():
-
-        # Ping google.com from gateway container
-        internet_connection = self._ip_ctrl.ping_via_gateway('google.com')
+      if iface and iface in self._interface_monitor.get_states():
 
-        if internet_connection:
+        # Result of the last probe from the gateway container
+        if self._internet_probe.is_connected():
           message['connection'] = True
 
-      # Broadcast via MQTT client
+    # Broadcast via MQTT client when the connection changes
+    if message != self._internet_message:
       mqtt_client.send_message(topic, message)
+      self._internet_message = message
 
 class NetworkConfig:
   """Define all the properties of the network configuration"""
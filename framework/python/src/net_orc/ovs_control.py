@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """OVS Control Module"""
+import json
+import os
+import tempfile
 from common import logger
 from common import util
 
@@ -22,12 +25,99 @@ DEVICER_ARP_COOKIE = '1000'
 UNKNOWN_ARP_COOKIE = '1183'
 CONTAINER_MAC_PREFIX = '9a:02:57:1e:8f'
 
+class OVSTransaction:
+  """Collects bridge, port and flow changes so that they are applied
+  by a single ovs-vsctl invocation and a single ovs-ofctl invocation
+  per bridge"""
+
+  def __init__(self, ovs):
+    self._ovs = ovs
+    self._commands = []
+    self._flows = {}
+    self._bridges = []
+    self._ports = []
+
+  def add_bridge(self, bridge_name):
+    LOGGER.debug('Adding OVS bridge: ' + bridge_name)
+    # Uses the --may-exist option to prevent failures
+    # if this bridge already exists by this name
+    self._commands.append(f'--may-exist add-br {bridge_name}')
+    self._bridges.append(bridge_name)
+    return self
+
+  def add_port(self, port, bridge_name):
+    LOGGER.debug('Adding port ' + port + ' to OVS bridge: ' + bridge_name)
+    # Uses the --may-exist option to prevent failures
+    # if this port already exists on the bridge
+    self._commands.append(f'--may-exist add-port {bridge_name} {port}')
+    self._ports.append((port, bridge_name))
+    return self
+
+  def add_flow(self, bridge_name, flow):
+    LOGGER.debug(f'Adding flow {flow} to bridge: {bridge_name}')
+    self._flows.setdefault(bridge_name, []).append(flow)
+    return self
+
+  def commit(self, verify=True):
+    """Apply all changes, then read back the bridges once to check that
+    each bridge and port exists if verify is set"""
+    success = True
+
+    if self._commands:
+      command = 'ovs-vsctl ' + ' '.join(f'-- {cmd}' for cmd in self._commands)
+      success = util.run_command(command, output=False)
+      if not success:
+        LOGGER.error('Failed to apply OVS changes: ' + command)
+
+    for bridge_name, flows in self._flows.items():
+      success = self._add_flows(bridge_name, flows) and success
+
+    if success and verify:
+      success = self.verify()
+    return success
+
+  def verify(self):
+    """Check that all bridges and ports in the transaction exist"""
+    bridges = self._ovs.get_bridges()
+    for bridge_name in self._bridges:
+      if bridge_name not in bridges:
+        LOGGER.error(f'OVS bridge {bridge_name} does not exist')
+        return False
+    for port, bridge_name in self._ports:
+      if port not in bridges.get(bridge_name, []):
+        LOGGER.error(f'Port {port} is not on OVS bridge {bridge_name}')
+        return False
+    return True
+
+  def _add_flows(self, bridge_name, flows):
+    # Flows are read from a file so they are added by one ovs-ofctl run
+    with tempfile.NamedTemporaryFile('w',
+                                     prefix='tr-flows-',
+                                     suffix='.txt',
+                                     delete=False) as f:
+      f.write('\n'.join(flows) + '\n')
+      flows_file = f.name
+    try:
+      success = util.run_command(
+          f'ovs-ofctl add-flows {bridge_name} {flows_file}', output=False)
+    finally:
+      os.remove(flows_file)
+    if not success:
+      LOGGER.error(f'Failed to add flows to bridge {bridge_name}')
+    return success
+
+
 class OVSControl:
   """OVS Control"""
 
   def __init__(self, session):
     self._session = session
 
+  def transaction(self):
+    """Returns a new transaction for batching bridge, port and
+    flow changes"""
+    return OVSTransaction(self)
+
   def add_bridge(self, bridge_name):
     LOGGER.debug('Adding OVS bridge: ' + bridge_name)
     # Create the bridge using ovs-vsctl commands
@@ -59,6 +149,31 @@ class OVSControl:
     success = util.run_command(f'ovs-ofctl del-flows {bridge_name} \'{flow}\'')
     return success
 
+  def get_bridges(self):
+    """Returns the ports of every bridge, read with one ovs-vsctl call"""
+    response = util.run_command(
+        'ovs-vsctl --format=json --data=json '
+        '-- --columns=name,ports list Bridge '
+        '-- --columns=_uuid,name list Port',
+        output=True)
+    try:
+      bridge_table, port_table = [
+          json.loads(line) for line in response[0].splitlines() if line
+      ]
+    except ValueError:
+      LOGGER.error('Failed to read OVS bridges')
+      return {}
+
+    port_names = {row[0][1]: row[1] for row in port_table['data']}
+    bridges = {}
+    for name, ports in bridge_table['data']:
+      # A set with a single member is not wrapped by OVSDB
+      port_uuids = ports[1] if ports[0] == 'set' else [ports]
+      bridges[name] = [
+          port_names[port[1]] for port in port_uuids if port[1] in port_names
+      ]
+    return bridges
+
   def get_bridge_ports(self, bridge_name):
     # Get a list of all the ports on a bridge
     response = util.run_command(f'ovs-vsctl list-ports {bridge_name}',
@@ -84,61 +199,72 @@ class OVSControl:
     dev_bridge = True
     int_bridge = True
 
+    # Read the state of all bridges once
+    bridges = self.get_bridges()
+
     # Verify the device bridge
     dev_bridge = self.verify_bridge(DEVICE_BRIDGE,
-                                    [self._session.get_device_interface()])
+                                    [self._session.get_device_interface()],
+                                    bridges)
     LOGGER.debug('Device bridge verified: ' + str(dev_bridge))
 
     # Verify the internet bridge
     if 'single_intf' not in self._session.get_runtime_params():
       int_bridge = self.verify_bridge(INTERNET_BRIDGE,
-                                      [self._session.get_internet_interface()])
+                                      [self._session.get_internet_interface()],
+                                      bridges)
       LOGGER.debug('Internet bridge verified: ' + str(int_bridge))
 
     return dev_bridge and int_bridge
 
-  def verify_bridge(self, bridge_name, ports):
+  def verify_bridge(self, bridge_name, ports, bridges=None):
     LOGGER.debug('Verifying bridge: ' + bridge_name)
-    verified = True
-    if self.bridge_exists(bridge_name):
-      bridge_ports = self.get_bridge_ports(bridge_name)
-      LOGGER.debug('Checking bridge for ports: ' + str(ports))
-      for port in ports:
-        if port not in bridge_ports:
-          verified = False
-          break
-    else:
-      verified = False
-    return verified
+    if bridges is None:
+      bridges = self.get_bridges()
+    if bridge_name not in bridges:
+      return False
+    LOGGER.debug('Checking bridge for ports: ' + str(ports))
+    for port in ports:
+      if port not in bridges[bridge_name]:
+        return False
+    return True
 
   def create_baseline_net(self, verify=True):
     LOGGER.debug('Creating baseline network')
 
+    transaction = self.transaction()
+
     # Create data plane
-    self.add_bridge(DEVICE_BRIDGE)
+    transaction.add_bridge(DEVICE_BRIDGE)
 
     # Create control plane
-    self.add_bridge(INTERNET_BRIDGE)
+    transaction.add_bridge(INTERNET_BRIDGE)
 
     # Add external interfaces to data and control plane
-    self.add_port(self._session.get_device_interface(), DEVICE_BRIDGE)
+    transaction.add_port(self._session.get_device_interface(), DEVICE_BRIDGE)
 
     # Remove IP from internet adapter
     if not 'single_intf' in self._session.get_runtime_params():
       self.set_interface_ip(interface=self._session.get_internet_interface(),
                             ip_addr='0.0.0.0')
-      self.add_port(self._session.get_internet_interface(), INTERNET_BRIDGE)
+      transaction.add_port(self._session.get_internet_interface(),
+                           INTERNET_BRIDGE)
 
     # Enable forwarding of eapol packets
-    self.add_flow(bridge_name=DEVICE_BRIDGE,
-                  flow='table=0, dl_dst=01:80:c2:00:00:03, actions=flood')
+    transaction.add_flow(
+        bridge_name=DEVICE_BRIDGE,
+        flow='table=0, dl_dst=01:80:c2:00:00:03, actions=flood')
 
     # Add a DHCP snooping equivalent to the device bridge
     # ToDo Define these IP's dynamically
     dhcp_server_primary_ip = '10.10.10.2'
     dhcp_server_secondary_ip = '10.10.10.3'
     self.add_dhcp_filters(dhcp_server_primary_ip=dhcp_server_primary_ip,
-      dhcp_server_secondary_ip=dhcp_server_secondary_ip)
+      dhcp_server_secondary_ip=dhcp_server_secondary_ip,
+      transaction=transaction)
+
+    # Bridges and ports are verified by validate_baseline_network
+    transaction.commit(verify=False)
 
     # Set ports up
     self.set_bridge_up(DEVICE_BRIDGE)
@@ -151,32 +277,48 @@ class OVSControl:
     else:
       return None
 
-  def add_dhcp_filters(self,dhcp_server_primary_ip,dhcp_server_secondary_ip):
+  def add_dhcp_filters(self,
+                       dhcp_server_primary_ip,
+                       dhcp_server_secondary_ip,
+                       transaction=None):
+
+    # Apply straight away unless part of a larger transaction
+    commit = transaction is None
+    if commit:
+      transaction = self.transaction()
 
     # Allow DHCP traffic from primary server
     allow_primary_dhcp_server = (
       'table=0, dl_type=0x800, priority=65535, tp_src=67, ' +
       f'tp_dst=68, nw_src={dhcp_server_primary_ip}, actions=normal')
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=allow_primary_dhcp_server)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE,
+                         flow=allow_primary_dhcp_server)
 
     # Allow DHCP traffic from secondary server
     allow_secondary_dhcp_server = (
       'table=0, dl_type=0x800, priority=65535, ' +
       f'tp_src=67, tp_dst=68, nw_src={dhcp_server_secondary_ip},' +
        ' actions=normal''')
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=allow_secondary_dhcp_server)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE,
+                         flow=allow_secondary_dhcp_server)
 
     # Drop DHCP packets not associated with known servers
     drop_dhcp_flow = ('table=0, dl_type=0x800, priority=0, ' +
                       'tp_src=67, tp_dst=68, actions=drop')
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=drop_dhcp_flow)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE, flow=drop_dhcp_flow)
+
+    if commit:
+      return transaction.commit()
+    return True
 
   def add_arp_inspection_filter(self,ip_address,mac_address):
+    transaction = self.transaction()
+
     # Allow ARP packets with known MAC-to-IP mappings
     allow_known_arps= (f'table=0, cookie={DEVICER_ARP_COOKIE}, ' +
                        f'priority=65535, arp, arp_tpa={ip_address}, ' +
                        f'arp_tha={mac_address}, action=normal')
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=allow_known_arps)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE, flow=allow_known_arps)
 
     dhcp1_mac = f'{CONTAINER_MAC_PREFIX}:02'
     dhcp2_mac = f'{CONTAINER_MAC_PREFIX}:03'
@@ -187,15 +329,16 @@ class OVSControl:
                   f'arp_tpa={dhcp1_ip}, arp_tha={dhcp1_mac}, action=normal')
     dhcp_2_arps= ('table=0, priority=65535, arp, ' +
                   f'arp_tpa={dhcp2_ip}, arp_tha={dhcp2_mac}, action=normal')
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=dhcp_1_arps)
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=dhcp_2_arps)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE, flow=dhcp_1_arps)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE, flow=dhcp_2_arps)
 
     # Drop ARP packets with unknown MAC-to-IP mappings
     drop_unknown_arps = (
         f'table=0, cookie={UNKNOWN_ARP_COOKIE} priority=100, arp, '
         f'action=drop'
     )
-    self.add_flow(bridge_name=DEVICE_BRIDGE,flow=drop_unknown_arps)
+    transaction.add_flow(bridge_name=DEVICE_BRIDGE, flow=drop_unknown_arps)
+    return transaction.commit()
 
   def delete_arp_inspection_filter(self):
     self.delete_flow(bridge_name=DEVICE_BRIDGE,
@@ -222,6 +365,9 @@ class OVSControl:
     LOGGER.debug('Network is restored')
 
   def show_config(self):
+    # Only worth running ovs-vsctl if the output will be logged
+    if not LOGGER.isEnabledFor(logger.logging.DEBUG):
+      return None
     LOGGER.debug('Show current config of OVS')
     success = util.run_command('ovs-vsctl show', output=True)
     LOGGER.debug(f'OVS Config\n{success[0]}')
@@ -0,0 +1,102 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes captured packets to a pcap file as they arrive."""
+import threading
+from scapy.utils import RawPcapWriter
+from common import logger
+
+LOGGER = logger.get_logger('capture')
+
+# Ethernet link type
+LINKTYPE_ETHERNET = 1
+
+DEFAULT_SNAPLEN = 262144
+
+
+class PacketCapture:
+  """Streams packets to a pcap file so that memory use does not grow
+  with the length of the capture.
+
+  Packets are truncated to the snaplen and no more packets are written
+  once the capture reaches max_bytes.
+
+  If a packet index builder is given, each packet written is also added
+  to the index with the capture id."""
+
+  def __init__(self,
+               file_path,
+               snaplen=DEFAULT_SNAPLEN,
+               max_bytes=0,
+               index=None,
+               capture_id=0):
+    self._file_path = file_path
+    self._snaplen = snaplen
+    self._max_bytes = max_bytes
+    self._index = index
+    self._capture_id = capture_id
+
+    self._lock = threading.Lock()
+
+    self.packets = 0
+    self.dropped = 0
+    self.size = 0
+
+    self._writer = RawPcapWriter(file_path,
+                                 linktype=LINKTYPE_ETHERNET,
+                                 snaplen=snaplen)
+
+    # Write the file header now so that an empty capture is valid
+    self._writer.write_header(None)
+
+  def write(self, packet):
+    """Write a scapy packet to the capture"""
+    data = bytes(packet)
+    length = min(len(data), self._snaplen)
+    record_size = 16 + length
+
+    with self._lock:
+      if self._writer is None:
+        return
+      if self._max_bytes and self.size + record_size > self._max_bytes:
+        if not self.dropped:
+          LOGGER.warning(f'Capture {self._file_path} reached ' +
+                         f'{self._max_bytes} bytes, further packets ' +
+                         'will not be written')
+        self.dropped += 1
+        return
+
+      sec = int(packet.time)
+      usec = int(round((packet.time - sec) * 1000000))
+      self._writer.write_packet(data[:length],
+                                sec=sec,
+                                usec=usec,
+                                caplen=length,
+                                wirelen=len(data))
+      self.packets += 1
+      self.size += record_size
+
+      if self._index is not None:
+        self._index.add(packet, capture=self._capture_id)
+
+  def close(self):
+    """Finish writing the capture file"""
+    with self._lock:
+      if self._writer is None:
+        return
+      self._writer.close()
+      self._writer = None
+    LOGGER.debug(f'Wrote {self.packets} packets to {self._file_path}' +
+                 (f', {self.dropped} packets not written' if self.dropped
+                  else ''))
@@ -0,0 +1,113 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Kernel packet filters for the listener socket.
+
+The filters are built as classic BPF programs so that libpcap is not
+needed to compile them."""
+import ctypes
+import socket
+import struct
+
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+# Classic BPF instruction codes
+LD_W_ABS = 0x20
+LD_H_ABS = 0x28
+LD_B_ABS = 0x30
+LD_H_IND = 0x48
+LDX_B_MSH = 0xb1
+JMP_JEQ_K = 0x15
+JMP_JSET_K = 0x45
+RET_K = 0x06
+
+# Bytes of each accepted packet passed to the socket
+SNAP_LEN = 262144
+
+# Kernel limit on the length of a filter program
+MAX_INSTRUCTIONS = 4096
+
+DHCP_PORTS = [67, 68]
+
+
+def build_listener_filter(excluded_macs, excluded_prefix):
+  """Returns a BPF program accepting IPv4 DHCP packets and any packet
+  whose source MAC address is not excluded or does not start with the
+  excluded five byte prefix.
+
+  Args:
+      excluded_macs: MAC addresses to filter out, e.g '00:11:22:33:44:55'
+      excluded_prefix: MAC address prefix to filter out, e.g '9a:02:57:1e:8f'
+  """
+  program = [
+      # Continue to the source MAC checks unless this is an
+      # unfragmented IPv4 UDP packet to or from a DHCP port
+      (LD_H_ABS, 0, 0, 12),
+      (JMP_JEQ_K, 0, 12, 0x0800),
+      (LD_B_ABS, 0, 0, 23),
+      (JMP_JEQ_K, 0, 10, socket.IPPROTO_UDP),
+      (LD_H_ABS, 0, 0, 20),
+      (JMP_JSET_K, 8, 0, 0x1fff),
+      (LDX_B_MSH, 0, 0, 14),
+      (LD_H_IND, 0, 0, 14),
+      (JMP_JEQ_K, 4, 0, DHCP_PORTS[0]),
+      (JMP_JEQ_K, 3, 0, DHCP_PORTS[1]),
+      (LD_H_IND, 0, 0, 16),
+      (JMP_JEQ_K, 1, 0, DHCP_PORTS[0]),
+      (JMP_JEQ_K, 0, 1, DHCP_PORTS[1]),
+      (RET_K, 0, 0, SNAP_LEN),
+
+      # Drop packets from the excluded prefix
+      (LD_W_ABS, 0, 0, 6),
+      (JMP_JEQ_K, 0, 3, int(excluded_prefix.replace(':', '')[:8], 16)),
+      (LD_B_ABS, 0, 0, 10),
+      (JMP_JEQ_K, 0, 1, int(excluded_prefix.replace(':', '')[8:10], 16)),
+      (RET_K, 0, 0, 0),
+  ]
+
+  # Each MAC address is checked by a self contained block of five
+  # instructions so that no jump exceeds the BPF jump limit
+  for mac_addr in excluded_macs:
+    if len(program) + 6 > MAX_INSTRUCTIONS:
+      break
+    mac = mac_addr.replace(':', '')
+    program += [
+        (LD_W_ABS, 0, 0, 6),
+        (JMP_JEQ_K, 0, 3, int(mac[:8], 16)),
+        (LD_H_ABS, 0, 0, 10),
+        (JMP_JEQ_K, 0, 1, int(mac[8:12], 16)),
+        (RET_K, 0, 0, 0),
+    ]
+
+  program.append((RET_K, 0, 0, SNAP_LEN))
+  return program
+
+
+def attach_filter(sock, program):
+  """Attach a BPF program to a socket, replacing any existing filter"""
+  instructions = b''.join(
+      struct.pack('HBBI', code, jt, jf, k) for code, jt, jf, k in program)
+  buffer = ctypes.create_string_buffer(instructions)
+  fprog = struct.pack('HL', len(program), ctypes.addressof(buffer))
+  sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def get_socket_stats(sock):
+  """Returns the packets received and dropped by a packet socket
+  since this was last called"""
+  packets, drops = struct.unpack(
+      'II', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+  return packets, drops
@@ -0,0 +1,79 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Captures the log output of a test module container."""
+import codecs
+import re
+import threading
+from collections import deque
+
+# Only log lines from the test module itself are echoed to the console
+LOG_REGEX = re.compile(
+    r"^[A-Z][a-z]{2} [0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} test_")
+
+# Number of recent log lines held in memory for each module
+MAX_TAIL_LINES = 500
+
+
+class ModuleLog:
+  """Writes the log stream of a test module container straight to file,
+  keeping only the most recent lines in memory."""
+
+  def __init__(self, log_file, max_lines=MAX_TAIL_LINES):
+    self._log_file = log_file
+    self._tail = deque(maxlen=max_lines)
+    self._lock = threading.Lock()
+
+  def capture(self, log_stream):
+    """Write all log data in the containers log_stream to the log file.
+    This method is blocking so should be called in a thread"""
+
+    # Chunks may end part way through a line or a multi-byte character
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    partial_line = ""
+
+    with open(self._log_file, "w", encoding="utf-8") as f:
+      for log_chunk in log_stream:
+        lines = (partial_line + decoder.decode(log_chunk)).split("\n")
+        partial_line = lines.pop()
+        self._write_lines(f, lines)
+
+      # Write anything remaining once the stream has ended
+      self._write_lines(f, [partial_line + decoder.decode(b"", final=True)])
+
+  def _write_lines(self, f, lines):
+    for line in lines:
+
+      # Process each line and strip blank space
+      line = line.strip()
+      if not line:
+        continue
+
+      f.write(line + "\n")
+      with self._lock:
+        self._tail.append(line)
+
+      if LOG_REGEX.search(line):
+        print(line)
+
+    # Flush so the log file is complete if Testrun exits unexpectedly
+    f.flush()
+
+  def get_tail(self, lines=None):
+    """Returns the most recent log lines, up to the number requested"""
+    with self._lock:
+      tail = list(self._tail)
+    if lines is not None:
+      tail = tail[-lines:] if lines > 0 else []
+    return tail
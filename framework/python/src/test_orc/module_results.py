@@ -0,0 +1,71 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Follows the results streamed by a test module container."""
+import json
+import os
+from common import logger
+
+LOGGER = logger.get_logger("test_orc")
+
+# Time in seconds between reads of the results stream
+POLL_INTERVAL = 0.5
+
+
+class ModuleResults:
+  """Reads test results from a test module as each test finishes.
+
+  Test modules append one JSON object per line to the results stream,
+  so only complete lines are read and anything after the last newline
+  is left until the next read."""
+
+  def __init__(self, results_file, callback):
+    self._results_file = results_file
+    self._callback = callback
+    self._position = 0
+
+  def follow(self, stop_event, poll_interval=POLL_INTERVAL):
+    """Read new results until the stop event is set, then read any
+    remaining results. This method is blocking so should be called
+    in a thread"""
+    while not stop_event.wait(timeout=poll_interval):
+      self.read()
+    self.read()
+
+  def read(self):
+    """Pass any results added since the last read to the callback"""
+    try:
+      if os.path.getsize(self._results_file) <= self._position:
+        return
+      with open(self._results_file, "rb") as f:
+        f.seek(self._position)
+        data = f.read()
+    except OSError:
+      # The module has not finished a test yet
+      return
+
+    # Ignore a partially written line, it will be read next time
+    end = data.rfind(b"\n") + 1
+    self._position += end
+
+    for line in data[:end].splitlines():
+      if not line.strip():
+        continue
+      try:
+        test_result = json.loads(line)
+      except json.JSONDecodeError as error:
+        LOGGER.error(f"Invalid result in {self._results_file}")
+        LOGGER.error(error)
+        continue
+      self._callback(test_result)
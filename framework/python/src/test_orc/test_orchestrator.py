@@ -15,7 +15,6 @@
 import copy
 import os
 import json
-import re
 import time
 import shutil
 import docker
@@ -24,9 +23,13 @@ from common import logger, util
 from common.testreport import TestReport
 from common.statuses import TestrunStatus, TestResult
 from core.docker.test_docker_module import TestModule
+from test_orc.module_log import ModuleLog
+from test_orc.module_results import ModuleResults
 from test_orc.test_case import TestCase
 from test_orc.test_pack import TestPack
 import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 LOG_NAME = "test_orc"
@@ -45,9 +48,17 @@ SAVED_DEVICE_REPORTS = "report/{device_folder}/"
 LOCAL_DEVICE_REPORTS = "local/devices/{device_folder}/reports"
 DEVICE_ROOT_CERTS = "local/root_certs"
 
-LOG_REGEX = r"^[A-Z][a-z]{2} [0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} test_"
 API_URL = "http://localhost:8000"
 
+# IP indexes given to the test modules in load order. These are clear of
+# the DHCP range and the address the connection module reserves for the
+# device, and each index must fit in the last octet of the module MAC
+TEST_MODULE_IP_INDEX = 100
+MAX_TEST_MODULE_IP_INDEX = 199
+
+# Time in seconds to wait for container logs once a module has exited
+LOG_DRAIN_TIMEOUT = 5
+
 
 class TestOrchestrator:
   """Manages and controls the test modules."""
@@ -56,8 +67,8 @@ class TestOrchestrator:
 
     self._test_modules: List[TestModule] = []
     self._test_packs: List[TestPack] = []
+    self._next_ip_index = TEST_MODULE_IP_INDEX
 
-    self._container_logs = []
     self._session = session
 
     self._api_url = (self.get_session().get_api_url() + ":" +
@@ -71,7 +82,17 @@ class TestOrchestrator:
             os.path.dirname(
                 os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
     self._test_modules_running = []
-    self._current_module = 0
+    self._test_modules_started = set()
+
+    # Events set when a running test module exits or Testrun is stopped
+    self._module_events = {}
+
+    # Log output of each test module run during this session
+    self._module_logs = {}
+
+    # Test modules started whilst the device is monitored
+    self._prepared_modules = {}
+    self._prepare_lock = threading.Lock()
 
   def start(self):
     LOGGER.debug("Starting test orchestrator")
@@ -89,39 +110,89 @@ class TestOrchestrator:
 
   def stop(self):
     """Stop any running tests"""
+    # Wake up the orchestrator if it is waiting on any test modules
+    for module_event in list(self._module_events.values()):
+      module_event.set()
     self._stop_modules()
+    self._prepared_modules = {}
+
+  def prepare_test_modules(self):
+    """Start the enabled test modules whilst the device is monitored.
+    Modules are held until they are released when the module is run"""
+    with self._prepare_lock:
+
+      # Only prepare test modules whilst the device is being monitored
+      if self.get_session().get_status() != TestrunStatus.MONITORING:
+        return
+
+      device = self.get_session().get_target_device()
+
+      for module in self._get_enabled_test_modules(device):
+
+        # Stop preparing modules if monitoring has finished or was cancelled
+        if self.get_session().get_status() != TestrunStatus.MONITORING:
+          break
+
+        LOGGER.debug(f"Preparing test module {module.name}")
+        module.start(device, hold=True)
+
+        # Configure the module interface without connecting it to the
+        # device bridge, so it does not appear in the monitor capture
+        if module.network:
+          self._net_orc.attach_test_module_to_network(module, connect=False)
+
+        self._prepared_modules[module.name] = module
+
+  def _release_prepared_module(self, module):
+    """Release a test module that was started in advance. Returns False
+    if the module was not prepared or is no longer running"""
+    if self._prepared_modules.pop(module.name, None) is None:
+      return False
+
+    if module.get_status() != "running":
+      LOGGER.debug(f"Prepared test module {module.name} is not running")
+      return False
+
+    if module.network:
+      LOGGER.debug("Connecting test module to the network")
+      if not self._net_orc.connect_test_module_to_network(module):
+        LOGGER.error(f"Failed to connect test module {module.name} " +
+                     "to the network")
+
+    module.release()
+    return True
+
+  def _stop_prepared_modules(self):
+    """Stop any test modules that were prepared but not run"""
+    for module in list(self._prepared_modules.values()):
+      LOGGER.debug(f"Stopping unused test module {module.name}")
+      module.stop(kill=True)
+    self._prepared_modules = {}
 
   def run_test_modules(self):
     """Iterates through each test module and starts the container."""
 
-    # Do not start test modules if status is not in progress, e.g. Stopping
-    if self.get_session().get_status() != TestrunStatus.IN_PROGRESS:
-      return
+    # Wait for any test modules that are still being prepared
+    with self._prepare_lock:
+
+      # Do not start test modules if status is not in progress, e.g. Stopping
+      if self.get_session().get_status() != TestrunStatus.IN_PROGRESS:
+        self._stop_prepared_modules()
+        return
+
+      self._test_in_progress = True
 
     device = self.get_session().get_target_device()
     test_pack_name = device.test_pack
     test_pack = self.get_test_pack(test_pack_name)
     LOGGER.debug("Using test pack " + test_pack.name)
 
-    self._test_in_progress = True
-
     LOGGER.info(
         f"Running test modules on device with mac addr {device.mac_addr}")
 
-    test_modules = []
-
-    for module in self._test_modules:
+    test_modules = self._get_enabled_test_modules(device)
 
-      # Ignore test modules that are just base images etc
-      if module is None or not module.enable_container:
-        continue
-
-      # Ignore test modules that are disabled for this device
-      if not self._is_module_enabled(module, device):
-        continue
-
-      # Add module to list of modules to run
-      test_modules.append(module)
+    for module in test_modules:
 
       for test in module.tests:
 
@@ -148,12 +219,13 @@ class TestOrchestrator:
 
     # Store enabled test modules in the TestsOrchectrator object
     self._test_modules_running = test_modules
-    self._current_module = 0
+    self._test_modules_started = set()
+    self._module_logs = {}
 
-    for index, module in enumerate(test_modules):
+    self._run_scheduled_test_modules(test_modules)
 
-      self._current_module = index
-      self._run_test_module(module)
+    # Stop any prepared test modules that did not run, e.g. if cancelled
+    self._stop_prepared_modules()
 
     LOGGER.info("All tests complete")
 
@@ -197,6 +269,78 @@ class TestOrchestrator:
 
     return report.get_status()
 
+  def _get_enabled_test_modules(self, device):
+    """Returns the test modules to be run for the device"""
+    test_modules = []
+    for module in self._test_modules:
+
+      # Ignore test modules that are just base images etc
+      if module is None or not module.enable_container:
+        continue
+
+      # Ignore test modules that are disabled for this device
+      if not self._is_module_enabled(module, device):
+        continue
+
+      test_modules.append(module)
+    return test_modules
+
+  def _get_module_graph(self, test_modules):
+    """Resolve the modules that each test module must wait for before
+    it can start. Modules without a dependency between them run in
+    parallel, exclusive modules always run on their own."""
+
+    module_names = [module.name for module in test_modules]
+    graph = {}
+    last_exclusive = None
+
+    for index, module in enumerate(test_modules):
+      dependencies = set()
+
+      # Wait for a module that this module depends on if it is being run
+      if module.depends_on in module_names:
+        dependencies.add(module.depends_on)
+
+      if module.exclusive:
+        # Wait for every module that has been scheduled before this one
+        dependencies.update(module_names[:index])
+        last_exclusive = module.name
+      elif last_exclusive is not None:
+        # Do not start until the previous exclusive module has finished
+        dependencies.add(last_exclusive)
+
+      graph[module.name] = dependencies
+
+    return graph
+
+  def _run_scheduled_test_modules(self, test_modules):
+    """Run the test modules in parallel where the module graph allows"""
+
+    # Exclusive modules are run last so that the remaining modules are able
+    # to run together. Sorting is stable so the load order is otherwise kept
+    test_modules = sorted(test_modules, key=lambda module: module.exclusive)
+    graph = self._get_module_graph(test_modules)
+
+    module_futures = {}
+    with ThreadPoolExecutor(max_workers=max(len(test_modules), 1),
+                            thread_name_prefix="Test module") as executor:
+      for module in test_modules:
+        dependencies = [module_futures[name] for name in graph[module.name]]
+        LOGGER.debug(f"Scheduling test module {module.name}, waiting for: " +
+                     str(sorted(graph[module.name])))
+        module_futures[module.name] = executor.submit(
+            self._run_test_module_after, module, dependencies)
+
+    for name, module_future in module_futures.items():
+      if module_future.exception() is not None:
+        LOGGER.error(f"An error occurred whilst running test module {name}")
+        LOGGER.error(module_future.exception())
+
+  def _run_test_module_after(self, module, dependencies):
+    """Wait for all dependencies to complete and then run the module"""
+    futures.wait(dependencies)
+    self._run_test_module(module)
+
   def _write_reports(self, test_report):
 
     out_dir = os.path.join(
@@ -241,23 +385,26 @@ class TestOrchestrator:
     return report
 
   def _calculate_result(self):
-    result = TestResult.COMPLIANT
-    for test_result in self.get_session().get_test_results():
+    session = self.get_session()
+    for status in session.get_test_statuses():
 
-      # Check Required tests
-      if (test_result.required_result.lower() == "required"
-          and test_result.result not in [
-            TestResult.COMPLIANT,
-            TestResult.ERROR
-          ]):
-        result = TestResult.NON_COMPLIANT
+      # Compliant and errored tests do not affect the overall result
+      if status in [TestResult.COMPLIANT, TestResult.ERROR]:
+        continue
 
-      # Check Required if Applicable tests
-      elif (test_result.required_result.lower() == "required if applicable"
-            and test_result.result == TestResult.NON_COMPLIANT):
-        result = TestResult.NON_COMPLIANT
+      for test_result in session.get_test_results_by_status(status):
+        required_result = test_result.required_result.lower()
 
-    return result
+        # Check Required tests
+        if required_result == "required":
+          return TestResult.NON_COMPLIANT
+
+        # Check Required if Applicable tests
+        if (required_result == "required if applicable"
+            and status == TestResult.NON_COMPLIANT):
+          return TestResult.NON_COMPLIANT
+
+    return TestResult.COMPLIANT
 
   def _cleanup_old_test_results(self, device):
 
@@ -413,6 +560,11 @@ class TestOrchestrator:
   def _run_test_module(self, module):
     """Start the test container and extract the results."""
 
+    # Create the module event before checking the status so that a
+    # stop request received from here on is not missed
+    module_event = threading.Event()
+    self._module_events[module.name] = module_event
+
     # Check that Testrun is not stopping
     if self.get_session().get_status() != TestrunStatus.IN_PROGRESS:
       return
@@ -420,6 +572,7 @@ class TestOrchestrator:
     device = self.get_session().get_target_device()
 
     LOGGER.info(f"Running test module {module.name}")
+    self._test_modules_started.add(module.name)
 
     # Get all tests to be executed and set to in progress
     for current_test, test in enumerate(module.tests):
@@ -427,7 +580,7 @@ class TestOrchestrator:
       # Check that device is connected
       if not self._net_orc.is_device_connected():
         LOGGER.error("Device was disconnected")
-        self._set_test_modules_error(current_test)
+        self._set_test_modules_error(module, current_test)
         self.get_session().set_status(TestrunStatus.CANCELLED)
         return
 
@@ -443,37 +596,55 @@ class TestOrchestrator:
 
       self.get_session().add_test_result(test_copy)
 
-    # Start the test module
-    module.start(device)
-
-    # Mount the test container to the virtual network if requried
-    if module.network:
-      LOGGER.debug("Attaching test module to the network")
-      self._net_orc.attach_test_module_to_network(module)
+    # Release the test module if it was started whilst the device was
+    # monitored, otherwise start the test module now
+    if not self._release_prepared_module(module):
+      module.start(device)
 
-    # Determine the module timeout time
-    test_module_timeout = time.time() + module.timeout
+      # Mount the test container to the virtual network if requried
+      if module.network:
+        LOGGER.debug("Attaching test module to the network")
+        if not self._net_orc.attach_test_module_to_network(module):
+          LOGGER.error(f"Failed to attach test module {module.name} " +
+                       "to the network")
 
     # Resolving container logs is blocking so we need to spawn a new thread
+    module_log = ModuleLog(module.container_log_file)
+    self._module_logs[module.name] = module_log
     log_stream = module.container.logs(stream=True, stdout=True, stderr=True)
-    log_thread = threading.Thread(target=self._get_container_logs,
+    log_thread = threading.Thread(target=module_log.capture,
                                   args=(log_stream, ))
     log_thread.daemon = True
     log_thread.start()
 
-    while (module.get_status() == "running"
-           and self.get_session().get_status() == TestrunStatus.IN_PROGRESS):
-
-      # Check that timeout has not exceeded
-      if time.time() > test_module_timeout:
-        LOGGER.error("Module timeout exceeded, killing module: " + module.name)
-        module.stop(kill=True)
-        break
-
-    # Save all container logs to file
-    with open(module.container_log_file, "w", encoding="utf-8") as f:
-      for line in self._container_logs:
-        f.write(line + "\n")
+    # Results are added to the session as each test finishes so that they
+    # are visible during the run and kept if the module does not finish
+    results_stream = ModuleResults(module.results_stream_file,
+                                   self._add_streamed_result)
+    results_thread = threading.Thread(target=results_stream.follow,
+                                      args=(module_event, ))
+    results_thread.daemon = True
+    results_thread.start()
+
+    # Waiting on the container is blocking so it runs in a separate thread
+    # which signals the module event when the container exits
+    wait_thread = threading.Thread(target=self._wait_for_module,
+                                   args=(module, module_event))
+    wait_thread.daemon = True
+    wait_thread.start()
+
+    # Block until the container exits, Testrun is stopped or the
+    # module timeout is exceeded
+    if not module_event.wait(timeout=module.timeout):
+      LOGGER.error("Module timeout exceeded, killing module: " + module.name)
+      module.stop(kill=True)
+      module_event.set()
+
+    # Read any results streamed before the module exited
+    results_thread.join()
+
+    # Allow the log stream to drain once the container has exited
+    log_thread.join(timeout=LOG_DRAIN_TIMEOUT)
 
     # Check that Testrun has not been stopped whilst this module was running
     if self.get_session().get_status() == TestrunStatus.STOPPING:
@@ -490,27 +661,14 @@ class TestOrchestrator:
         module_results_json = json.load(f)
         module_results = module_results_json["results"]
         for test_result in module_results:
-
-          # Convert dict from json into TestCase object
-          test_case = TestCase(
-              name=test_result["name"],
-              result=test_result["result"],
-              description=test_result["description"])
-
-          # Add steps to resolve if test is non-compliant
-          if (test_case.result == TestResult.NON_COMPLIANT and
-              "recommendations" in test_result):
-            test_case.recommendations = test_result["recommendations"]
-          else:
-            test_case.recommendations = []
-
-          self.get_session().add_test_result(test_case)
+          self._add_test_result(test_result)
 
     except (FileNotFoundError, PermissionError,
             json.JSONDecodeError) as results_error:
       LOGGER.error(
           f"Error occurred whilst obtaining results for module {module.name}")
       LOGGER.error(results_error)
+      LOGGER.info("Only results streamed before the module exited are kept")
 
     # Get the markdown report from the module if generated
     markdown_file = f"{module.container_runtime_dir}/{module.name}_report.md"
@@ -533,20 +691,45 @@ class TestOrchestrator:
 
     LOGGER.info(f"Test module {module.name} has finished")
 
-  def _get_container_logs(self, log_stream):
-    """Resolve all current log data in the containers log_stream
-    this method is blocking so should be called in
-    a thread or within a proper blocking context"""
-    self._container_logs = []
-    for log_chunk in log_stream:
-      lines = log_chunk.decode("utf-8").splitlines()
-
-      # Process each line and strip blank space
-      processed_lines = [line.strip() for line in lines if line.strip()]
-      self._container_logs.extend(processed_lines)
-      for line in lines:
-        if re.search(LOG_REGEX, line):
-          print(line)
+  def _add_test_result(self, test_result):
+    """Convert a test result from a test module into a TestCase
+    and add it to the session"""
+    test_case = TestCase(name=test_result["name"],
+                         result=test_result["result"],
+                         description=test_result["description"])
+
+    # Add steps to resolve if test is non-compliant
+    if (test_case.result == TestResult.NON_COMPLIANT and
+        "recommendations" in test_result):
+      test_case.recommendations = test_result["recommendations"]
+    else:
+      test_case.recommendations = []
+
+    self.get_session().add_test_result(test_case)
+
+  def _add_streamed_result(self, test_result):
+    # Results from a module that is being stopped are discarded
+    if self.get_session().get_status() != TestrunStatus.IN_PROGRESS:
+      return
+    try:
+      self._add_test_result(test_result)
+    except KeyError as error:
+      LOGGER.error(f"Streamed result is missing {error}")
+
+  def _wait_for_module(self, module, module_event):
+    """Block until the module container exits and then set the
+    module event. Should be called in a thread"""
+    exit_code = module.wait()
+    LOGGER.debug(f"Test module {module.name} exited with code {exit_code}")
+    module_event.set()
+
+  def get_module_log_tail(self, name, lines=None):
+    """Returns the most recent log lines of a test module that has been
+    run during this session, or None if the module has not been run"""
+    module_log = self._module_logs.get(name)
+    if module_log is None:
+      return None
+    return module_log.get_tail(lines)
 
   def _get_module_status(self, module):
     container = self._get_module_container(module)
@@ -612,7 +795,8 @@ class TestOrchestrator:
 
       if self._get_test_module(module_dir) is None:
         loaded_module = self._load_test_module(module_dir)
-        loaded_modules += loaded_module.dir_name + " "
+        if loaded_module is not None:
+          loaded_modules += loaded_module.dir_name + " "
 
     LOGGER.info(loaded_modules)
 
@@ -637,7 +821,14 @@ class TestOrchestrator:
       module_conf_file = os.path.join(self._root_path, modules_dir, module_dir,
                                       MODULE_CONFIG)
 
-      module = TestModule(module_conf_file, self.get_session(), extra_hosts)
+      # Give each test module a unique address on the device bridge,
+      # including any module it depends on which is loaded after it
+      if self._next_ip_index > MAX_TEST_MODULE_IP_INDEX:
+        LOGGER.error("No address left for test module " + module_dir)
+        return None
+      module = TestModule(module_conf_file, self.get_session(), extra_hosts,
+                          self._next_ip_index)
+      self._next_ip_index += 1
       if module.depends_on is not None:
         self._load_test_module(module.depends_on)
       self._test_modules.append(module)
@@ -691,11 +882,13 @@ class TestOrchestrator:
   def get_session(self):
     return self._session
 
-  def _set_test_modules_error(self, current_test):
-    """Set all remaining tests to error"""
-    for i in range(self._current_module, len(self._test_modules_running)):
-      start_idx = current_test if i == self._current_module else 0
-      for j in range(start_idx, len(self._test_modules_running[i].tests)):
-        self.get_session().set_test_result_error(
-          self._test_modules_running[i].tests[j]
-          )
+  def _set_test_modules_error(self, module, current_test):
+    """Set all remaining tests of the module and all tests of
+    modules that have not yet started to error"""
+    for test in module.tests[current_test:]:
+      self.get_session().set_test_result_error(test)
+    for pending_module in self._test_modules_running:
+      if pending_module.name in self._test_modules_started:
+        continue
+      for test in pending_module.tests:
+        self.get_session().set_test_result_error(test)
@@ -0,0 +1,138 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Waits for changes to a configuration file"""
+import ctypes
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+
+# Events of a file which is written and closed or replaced
+DEFAULT_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# Header of an inotify event followed by the file name
+EVENT_HEADER = struct.Struct('iIII')
+
+# Time in seconds without further changes before a change is reported
+DEBOUNCE_INTERVAL = 1
+
+# Time in seconds between checks when inotify is not available
+POLL_INTERVAL = 1
+
+
+class ConfigWatcher:
+  """Blocks until a file has changed.
+
+  The directory of the file is watched with inotify so that the file
+  is still watched when it is replaced rather than written in place.
+  Changes made in quick succession are reported once."""
+
+  def __init__(self,
+               file_path,
+               debounce=DEBOUNCE_INTERVAL,
+               events=DEFAULT_EVENTS):
+    self._file_path = file_path
+    self._directory, self._file_name = os.path.split(file_path)
+    self._debounce = debounce
+    self._events = events
+    self._fd = None
+    self._file_state = self._get_file_state()
+    try:
+      self._fd = self._add_watch()
+    except OSError:
+      # Fall back to checking the file state
+      self._fd = None
+
+  def wait(self, timeout=None):
+    """Returns True once the file has changed and has not been changed
+    again for the debounce interval, or False if the file has not
+    changed before the timeout"""
+    if self._fd is None:
+      return self._poll(timeout)
+    if not self._wait_for_event(timeout):
+      return False
+    while self._wait_for_event(self._debounce):
+      pass
+    return True
+
+  def close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def _add_watch(self):
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+    if libc.inotify_add_watch(fd, self._directory.encode(), self._events) < 0:
+      errno = ctypes.get_errno()
+      os.close(fd)
+      raise OSError(errno, os.strerror(errno))
+    return fd
+
+  def _wait_for_event(self, timeout):
+    """Returns True if the file changed before the timeout. Events for
+    other files in the directory do not extend the timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      remaining = None if deadline is None else max(
+          0, deadline - time.monotonic())
+      readable, _, _ = select.select([self._fd], [], [], remaining)
+      if not readable:
+        return False
+      if self._read_events():
+        return True
+
+  def _read_events(self):
+    data = os.read(self._fd, 4096)
+    changed = False
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+      _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+      start = offset + EVENT_HEADER.size
+      name = data[start:start + length].rstrip(b'\0').decode(errors='replace')
+      changed |= name == self._file_name
+      offset = start + length
+    return changed
+
+  def _get_file_state(self):
+    try:
+      stat = os.stat(self._file_path)
+      return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    except OSError:
+      return None
+
+  def _poll(self, timeout):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while self._get_file_state() == self._file_state:
+      if deadline is not None and time.monotonic() >= deadline:
+        return False
+      interval = POLL_INTERVAL if deadline is None else min(
+          POLL_INTERVAL, max(0, deadline - time.monotonic()))
+      time.sleep(interval)
+    self._file_state = self._get_file_state()
+    while True:
+      time.sleep(self._debounce)
+      file_state = self._get_file_state()
+      if file_state == self._file_state:
+        return True
+      self._file_state = file_state
@@ -0,0 +1,168 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit Testing for the DHCP Server leases"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from dhcp_leases import DHCPLeases
+
+LEASES_HEADER = """# The format of this file is documented in dhcpd.leases(5).
+# This lease file was written by isc-dhcp-4.4.3
+
+# authoring-byte-order entry is generated, DO NOT DELETE
+authoring-byte-order little-endian;
+
+server-duid "\\000\\001\\000\\001-\\023\\342\\255\\002B\\254\\021\\000\\002";
+
+"""
+
+
+def get_time(offset):
+  return time.strftime('%w %Y/%m/%d %H:%M:%S',
+                       time.gmtime(time.time() + offset))
+
+
+def make_lease(ip_addr, hw_addr, state='active', ends=600, hostname=None):
+  lease = f'lease {ip_addr} {{\n'
+  lease += f'  starts {get_time(-60)};\n'
+  lease += f'  ends {get_time(ends)};\n'
+  lease += f'  binding state {state};\n'
+  lease += '  next binding state free;\n'
+  lease += f'  hardware ethernet {hw_addr};\n'
+  if hostname is not None:
+    lease += f'  client-hostname "{hostname}";\n'
+  lease += '}\n'
+  return lease
+
+
+class DHCPLeasesTest(unittest.TestCase):
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self._leases_file = os.path.join(self._dir, 'dhcpd.leases')
+    self._leases6_file = os.path.join(self._dir, 'dhcpd6.leases')
+    self._write(LEASES_HEADER)
+    self._leases = DHCPLeases([self._leases_file, self._leases6_file])
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def _write(self, contents, path=None):
+    with open(path or self._leases_file, 'w', encoding='UTF-8') as f:
+      f.write(contents)
+
+  def _append(self, contents):
+    with open(self._leases_file, 'a', encoding='UTF-8') as f:
+      f.write(contents)
+
+  def test_get_lease(self):
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55', hostname='dut'))
+    self._append(make_lease('10.10.10.6', '00:11:22:33:44:66', state='free'))
+
+    lease = self._leases.get_lease('00:11:22:33:44:55')
+    self.assertEqual(lease.ip, '10.10.10.5')
+    self.assertEqual(lease.hostname, 'dut')
+    self.assertEqual(lease.expires.replace('-', '/'), get_time(600)[2:])
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:66'))
+    self.assertEqual(len(self._leases.get_leases()), 1)
+
+  def test_get_lease_appended(self):
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55'))
+    self.assertEqual(
+        self._leases.get_lease('00:11:22:33:44:55').hostname, '-NA-')
+
+    # Records written in parts are only read once complete
+    renewed = make_lease('10.10.10.5', '00:11:22:33:44:55', ends=1200)
+    self._append(renewed[:40])
+    self.assertEqual(
+        self._leases.get_lease('00:11:22:33:44:55').expires.replace('-', '/'),
+        get_time(600)[2:])
+    self._append(renewed[40:])
+    self.assertEqual(
+        self._leases.get_lease('00:11:22:33:44:55').expires.replace('-', '/'),
+        get_time(1200)[2:])
+
+    # A released lease replaces the active one
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55', state='free'))
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:55'))
+    self.assertIsNone(self._leases.get_lease_by_ip('10.10.10.5'))
+
+  def test_get_lease_expired(self):
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55', ends=-1))
+    self._append(make_lease('10.10.10.6', '00:11:22:33:44:66', ends=1))
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:55'))
+    self.assertIsNotNone(self._leases.get_lease('00:11:22:33:44:66'))
+    time.sleep(1.5)
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:66'))
+
+  def test_get_lease_replaced_file(self):
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55'))
+    self.assertIsNotNone(self._leases.get_lease('00:11:22:33:44:55'))
+
+    # The server rewrites the leases file as a new file
+    new_file = self._leases_file + '.new'
+    self._write(LEASES_HEADER + make_lease('10.10.10.7', '00:11:22:33:44:77'),
+                new_file)
+    os.rename(new_file, self._leases_file)
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:55'))
+    self.assertEqual(
+        self._leases.get_lease('00:11:22:33:44:77').ip, '10.10.10.7')
+
+  def test_get_lease_ipv6(self):
+    # IAID followed by a DUID-LL for the hardware address
+    self._write(
+        'ia-na "\\001\\002\\003\\004\\000\\003\\000\\001\\000\\021\\"3DU" {\n'
+        f'  cltt {get_time(-60)};\n'
+        '  iaaddr fd10:77be:4186::100 {\n'
+        '    binding state active;\n'
+        '    preferred-life 375;\n'
+        '    max-life 600;\n'
+        f'    ends {get_time(600)};\n'
+        '  }\n'
+        '}\n', self._leases6_file)
+    lease = self._leases.get_lease('00:11:22:33:44:55')
+    self.assertEqual(lease.ip, 'fd10:77be:4186::100')
+
+  def test_delete_lease(self):
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55'))
+    self._append(make_lease('10.10.10.6', '00:11:22:33:44:66'))
+    self._append(make_lease('10.10.10.5', '00:11:22:33:44:55'))
+    self._leases.get_leases()
+
+    with mock.patch('dhcp_leases.DHCP_LEASE_FILES', [self._leases_file]):
+      self._leases.delete_lease('10.10.10.5')
+
+    with open(self._leases_file, 'r', encoding='UTF-8') as f:
+      contents = f.read()
+    self.assertTrue(contents.startswith(LEASES_HEADER))
+    self.assertNotIn('10.10.10.5', contents)
+    self.assertIn('10.10.10.6', contents)
+    self.assertIsNone(self._leases.get_lease('00:11:22:33:44:55'))
+    self.assertIsNotNone(self._leases.get_lease('00:11:22:33:44:66'))
+
+
+if __name__ == '__main__':
+  suite = unittest.TestSuite()
+  suite.addTest(DHCPLeasesTest('test_get_lease'))
+  suite.addTest(DHCPLeasesTest('test_get_lease_appended'))
+  suite.addTest(DHCPLeasesTest('test_get_lease_expired'))
+  suite.addTest(DHCPLeasesTest('test_get_lease_replaced_file'))
+  suite.addTest(DHCPLeasesTest('test_get_lease_ipv6'))
+  suite.addTest(DHCPLeasesTest('test_delete_lease'))
+
+  runner = unittest.TextTestRunner()
+  runner.run(suite)
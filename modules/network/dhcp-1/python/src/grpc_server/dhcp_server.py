@@ -16,9 +16,11 @@ DHCP server"""
 import sys
 import time
 from common import logger
-from dhcp_config import DHCPConfig
+from config_watcher import ConfigWatcher
+from dhcp_config import DHCPConfig, CONFIG_FILE
 from radvd_server import RADVDServer
 from isc_dhcp_server import ISCDHCPServer
+from omapi_hosts import OMAPIHosts, OMAPIException
 
 LOG_NAME = 'dhcp_server'
 LOGGER = None
@@ -26,14 +28,49 @@ LOGGER = None
 class DHCPServer:
   """Represents the DHCP Server"""
 
-  def __init__(self):
+  def __init__(self, omapi_hosts=None):
     global LOGGER
     LOGGER = logger.get_logger(LOG_NAME, 'dhcp-1')
     self.dhcp_config = DHCPConfig()
     self.radvd = RADVDServer(enabled=True)
     self.isc_dhcp = ISCDHCPServer()
+    self.omapi_hosts = OMAPIHosts() if omapi_hosts is None else omapi_hosts
     self.dhcp_config.resolve_config()
 
+  def reload(self, dhcp_config):
+    """Change to a new config. Reserved hosts are added and removed on
+    the running server and it is only restarted for other changes."""
+    restart = self.dhcp_config.requires_restart(dhcp_config)
+    if not restart:
+      try:
+        self._update_reserved_hosts(self.dhcp_config, dhcp_config)
+      except OMAPIException as e:
+        LOGGER.error(str(e))
+        restart = True
+    self.dhcp_config = dhcp_config
+    if restart:
+      return self.restart()
+    LOGGER.info('DHCP server reserved hosts updated')
+    return True
+
+  def _update_reserved_hosts(self, old_config, new_config):
+    old_hosts = {
+        host.hw_addr: host.fixed_addr
+        for host in old_config.get_reserved_hosts()
+    }
+    new_hosts = {
+        host.hw_addr: host.fixed_addr
+        for host in new_config.get_reserved_hosts()
+    }
+    for hw_addr, ip_addr in old_hosts.items():
+      if new_hosts.get(hw_addr) != ip_addr:
+        LOGGER.info('Deleting reserved host ' + hw_addr)
+        self.omapi_hosts.delete_host(hw_addr)
+    for hw_addr, ip_addr in new_hosts.items():
+      if old_hosts.get(hw_addr) != ip_addr:
+        LOGGER.info('Adding reserved host ' + hw_addr + ': ' + ip_addr)
+        self.omapi_hosts.add_host(hw_addr, ip_addr)
+
   def restart(self):
     LOGGER.info('Restarting DHCP server')
     isc_started = self.isc_dhcp.restart()
@@ -84,6 +121,8 @@ class DHCPServer:
     return booted
 
 def run():
+  # Watch the config before it is first read so no change is missed
+  config_watcher = ConfigWatcher(CONFIG_FILE)
   dhcp_server = DHCPServer()
   booted = dhcp_server.boot()
 
@@ -93,14 +132,16 @@ def run():
 
   config = str(dhcp_server.dhcp_config)
   while True:
-    dhcp_server.dhcp_config.resolve_config()
-    new_config = str(dhcp_server.dhcp_config)
+    # Block until the config file is written, only reading the config
+    # once a series of writes has finished
+    config_watcher.wait()
+    dhcp_config = DHCPConfig()
+    dhcp_config.resolve_config()
+    new_config = str(dhcp_config)
     if config != new_config:
       LOGGER.info('DHCP server config changed')
       config = new_config
-      dhcp_server.restart()
-      dhcp_server.radvd.restart()
-      time.sleep(1)
+      dhcp_server.reload(dhcp_config)
 
 if __name__ == '__main__':
   run()
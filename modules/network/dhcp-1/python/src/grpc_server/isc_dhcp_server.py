@@ -13,11 +13,18 @@
 # limitations under the License.
 """Contains all the necessary classes to maintain the 
 isc-dhcp server booted from the isc-dhcp service file"""
+import os
+import re
 from common import logger
 from common import util
 
 LOG_NAME = 'isc-dhcp'
 LOGGER = None
+LEASES_FILE = '/var/lib/dhcp/dhcpd.leases'
+
+# Host objects added or deleted through OMAPI are written to the leases
+# file and would override the reserved hosts in the config
+LEASES_HOST_PATTERN = re.compile(r'^host\s[^{]*{[^}]*}\n?', re.MULTILINE)
 
 class ISCDHCPServer:
   """Represents the isc-dhcp server"""
@@ -28,12 +35,14 @@ class ISCDHCPServer:
 
   def restart(self):
     LOGGER.info('Restarting isc-dhcp server')
+    self._remove_lease_hosts()
     response = util.run_command('isc-dhcp-service restart', False)
     LOGGER.info('isc-dhcp server restarted: ' + str(response))
     return response
 
   def start(self):
     LOGGER.info('Starting isc-dhcp server')
+    self._remove_lease_hosts()
     response = util.run_command('isc-dhcp-service start', False)
     LOGGER.info('isc-dhcp server started: ' + str(response))
     return response
@@ -50,3 +59,18 @@ class ISCDHCPServer:
     running = response[0] == 'isc-dhcp service is running.'
     LOGGER.info('isc-dhcp server status: ' + str(running))
     return running
+
+  def _remove_lease_hosts(self):
+    """Remove the host objects from the leases file so that the server
+    starts with the reserved hosts in the config"""
+    if not os.path.exists(LEASES_FILE):
+      return
+    try:
+      with open(LEASES_FILE, 'r', encoding='UTF-8') as f:
+        leases = f.read()
+      cleaned = LEASES_HOST_PATTERN.sub('', leases)
+      if cleaned != leases:
+        with open(LEASES_FILE, 'w', encoding='UTF-8') as f:
+          f.write(cleaned)
+    except OSError as e:
+      LOGGER.error('Failed to remove hosts from leases file: ' + str(e))
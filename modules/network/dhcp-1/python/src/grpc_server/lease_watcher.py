@@ -0,0 +1,131 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Publishes the lease events of the DHCP server as they happen"""
+import queue
+import threading
+import time
+from config_watcher import ConfigWatcher, DEFAULT_EVENTS, IN_MODIFY
+from lease_file import get_expiry
+
+LEASES_FILE = '/var/lib/dhcp/dhcpd.leases'
+
+# Lease held by a device when watching started
+EVENT_ACTIVE = 'active'
+
+# All the active leases have been published
+EVENT_SYNCED = 'synced'
+
+EVENT_GRANTED = 'granted'
+EVENT_RENEWED = 'renewed'
+EVENT_EXPIRED = 'expired'
+
+# Time in seconds to wait for further writes to the leases file
+LEASES_DEBOUNCE = 0.2
+
+
+class LeaseWatcher:
+  """Reads the leases again whenever the leases file is written or a
+  lease expires, and publishes the differences as lease events.
+
+  Each subscriber receives a queue of (event type, lease) tuples which
+  starts with the active leases followed by a synced event."""
+
+  def __init__(self, dhcp_leases, leases_file=LEASES_FILE):
+    self._dhcp_leases = dhcp_leases
+    self._leases_file = leases_file
+    self._leases = {}
+    self._subscribers = []
+    self._lock = threading.Lock()
+    self._thread = None
+    self._file_watcher = None
+
+  def subscribe(self, hw_addr=None):
+    """Returns a queue of the lease events for a hardware address, or
+    for all hardware addresses if None"""
+    events = queue.Queue()
+    with self._lock:
+      self._start()
+      for lease in self._leases.values():
+        if hw_addr is None or lease.hw_addr == hw_addr:
+          events.put((EVENT_ACTIVE, lease))
+      events.put((EVENT_SYNCED, None))
+      self._subscribers.append((hw_addr, events))
+    return events
+
+  def unsubscribe(self, events):
+    with self._lock:
+      self._subscribers = [(hw_addr, subscriber_events)
+                           for hw_addr, subscriber_events in self._subscribers
+                           if subscriber_events is not events]
+
+  def _start(self):
+    if self._thread is not None:
+      return
+    # Watch the file before it is first read so no change is missed.
+    # The server appends to the leases file without closing it.
+    self._file_watcher = ConfigWatcher(self._leases_file,
+                                       debounce=LEASES_DEBOUNCE,
+                                       events=DEFAULT_EVENTS | IN_MODIFY)
+    self._leases = self._read_leases()
+    self._thread = threading.Thread(target=self._run,
+                                    name='Lease watcher',
+                                    daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    while True:
+      self._file_watcher.wait(timeout=self._time_to_next_expiry())
+      leases = self._read_leases()
+      with self._lock:
+        events = self._get_events(self._leases, leases)
+        self._leases = leases
+        for event_type, lease in events:
+          for hw_addr, subscriber_events in self._subscribers:
+            if hw_addr is None or lease.hw_addr == hw_addr:
+              subscriber_events.put((event_type, lease))
+
+  def _read_leases(self):
+    """Returns the leases which have not expired by hardware address"""
+    leases = {}
+    now = time.time()
+    try:
+      current_leases = self._dhcp_leases.get_leases()
+    except Exception:  # pylint: disable=W0718
+      # Keep the last leases read until the leases can be read again
+      current_leases = list(self._leases.values())
+    for lease in current_leases:
+      expiry = get_expiry(lease)
+      if expiry is None or expiry > now:
+        leases[lease.hw_addr] = lease
+    return leases
+
+  def _time_to_next_expiry(self):
+    expiries = [get_expiry(lease) for lease in self._leases.values()]
+    expiries = [expiry for expiry in expiries if expiry is not None]
+    if not expiries:
+      return None
+    return max(0, min(expiries) - time.time())
+
+  def _get_events(self, old_leases, new_leases):
+    events = []
+    for hw_addr, lease in old_leases.items():
+      if hw_addr not in new_leases:
+        events.append((EVENT_EXPIRED, lease))
+    for hw_addr, lease in new_leases.items():
+      old_lease = old_leases.get(hw_addr)
+      if old_lease is None or old_lease.ip != lease.ip:
+        events.append((EVENT_GRANTED, lease))
+      elif old_lease.expires != lease.expires:
+        events.append((EVENT_RENEWED, lease))
+    return events
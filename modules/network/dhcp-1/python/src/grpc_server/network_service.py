@@ -18,13 +18,18 @@ import proto.grpc_pb2 as pb2
 from dhcp_server import DHCPServer
 from dhcp_config import DHCPConfig
 from dhcp_leases import DHCPLeases
+from lease_watcher import LeaseWatcher
 
+import queue
 import traceback
 from common import logger
 
 LOG_NAME = 'network_service'
 LOGGER = None
 
+# Time in seconds between checks that a lease watcher is still connected
+WATCH_INTERVAL = 1
+
 
 class NetworkService(pb2_grpc.NetworkModule):
   """gRPC endpoints for the DHCP Server"""
@@ -33,13 +38,15 @@ class NetworkService(pb2_grpc.NetworkModule):
     self._dhcp_server = DHCPServer()
     self._dhcp_config = None
     self.dhcp_leases = DHCPLeases()
+    self._lease_watcher = LeaseWatcher(self.dhcp_leases)
     global LOGGER
     LOGGER = logger.get_logger(LOG_NAME, 'dhcp-1')
 
   def _get_dhcp_config(self):
-    if self._dhcp_config is None:
-      self._dhcp_config = DHCPConfig()
-      self._dhcp_config.resolve_config()
+    # Always read the current config, it is restored between test runs
+    # when the network is kept running
+    self._dhcp_config = DHCPConfig()
+    self._dhcp_config.resolve_config()
     return self._dhcp_config
 
   def RestartDHCPServer(self, request, context):  # pylint: disable=W0613
@@ -168,6 +175,30 @@ class NetworkService(pb2_grpc.NetworkModule):
       LOGGER.error(traceback.format_exc())
       return pb2.Response(code=500, message=fail_message)
 
+  def WatchLeases(self, request, context):
+    """
+      Stream the lease events for the provided MAC address, starting
+      with its current lease, until the client cancels the call
+    """
+    LOGGER.info('Watch leases called')
+    events = self._lease_watcher.subscribe(request.hw_addr or None)
+    try:
+      while context.is_active():
+        try:
+          event_type, lease = events.get(timeout=WATCH_INTERVAL)
+        except queue.Empty:
+          continue
+        event = pb2.LeaseEvent(type=event_type)
+        if lease is not None:
+          event.hw_addr = lease.hw_addr or ''
+          event.ip = lease.ip or ''
+          event.hostname = lease.hostname or ''
+          event.expires = lease.expires or ''
+          event.manufacturer = getattr(lease, 'manufacturer', None) or ''
+        yield event
+    finally:
+      self._lease_watcher.unsubscribe(events)
+
   def SetDHCPRange(self, request, context):  # pylint: disable=W0613
     """
       Change DHCP configuration and set the 
@@ -0,0 +1,107 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Changes the reserved hosts of the running isc-dhcp server through
+its OMAPI control channel"""
+import re
+import pypureomapi
+
+OMAPI_HOST = '127.0.0.1'
+OMAPI_PORT = 7911
+OMAPI_KEY_FILE = '/etc/dhcp/omapi.key'
+
+# Time in seconds to wait for the server to answer
+OMAPI_TIMEOUT = 5
+
+# A hardware address may have a host object from the config as well
+# as one added through OMAPI
+MAX_HOSTS_PER_HW_ADDR = 4
+
+
+class OMAPIException(Exception):
+
+  def __init__(self, message):
+    super().__init__(message)
+
+
+class OMAPIHosts:
+  """Host objects of the running isc-dhcp server.
+
+  A connection is opened for each change as the server may have been
+  restarted since the last one."""
+
+  def __init__(self,
+               host=OMAPI_HOST,
+               port=OMAPI_PORT,
+               key_file=OMAPI_KEY_FILE):
+    self._host = host
+    self._port = port
+    self._key_file = key_file
+
+  def add_host(self, hw_addr, ip_addr):
+    try:
+      omapi = self._connect()
+      try:
+        omapi.add_host(ip_addr, hw_addr)
+      finally:
+        omapi.close()
+    except (pypureomapi.OmapiError, OSError, ValueError) as e:
+      raise OMAPIException(f'Failed to add host {hw_addr}: {e}') from e
+
+  def delete_host(self, hw_addr):
+    """Delete every host object with the hardware address"""
+    try:
+      omapi = self._connect()
+      try:
+        for _ in range(MAX_HOSTS_PER_HW_ADDR):
+          omapi.del_host(hw_addr)
+      except pypureomapi.OmapiErrorNotFound:
+        pass
+      finally:
+        omapi.close()
+    except (pypureomapi.OmapiError, OSError, ValueError) as e:
+      raise OMAPIException(f'Failed to delete host {hw_addr}: {e}') from e
+
+  def _connect(self):
+    key_name, secret = self._read_key()
+    return pypureomapi.Omapi(self._host,
+                             self._port,
+                             username=key_name,
+                             key=secret,
+                             timeout=OMAPI_TIMEOUT)
+
+  def _read_key(self):
+    """Returns the name and secret of the key from a dhcpd key
+    statement"""
+    with open(self._key_file, 'r', encoding='UTF-8') as f:
+      key = f.read()
+    match = re.search(r'key\s+"?([\w.-]+)"?\s*{[^}]*secret\s+"([^"]+)"', key)
+    if match is None:
+      raise ValueError('No key found in ' + self._key_file)
+    return match.group(1).encode(), match.group(2).encode()
+
+
+class LocalOMAPIHosts:
+  """Stand-in for OMAPIHosts which keeps the host objects in memory"""
+
+  def __init__(self):
+    self.hosts = {}
+
+  def add_host(self, hw_addr, ip_addr):
+    # The server refuses a second host object for a hardware address
+    if hw_addr in self.hosts:
+      raise OMAPIException(f'Failed to add host {hw_addr}: already exists')
+    self.hosts[hw_addr] = ip_addr
+
+  def delete_host(self, hw_addr):
+    self.hosts.pop(hw_addr, None)
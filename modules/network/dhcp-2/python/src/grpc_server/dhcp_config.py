@@ -23,6 +23,9 @@ CONFIG_FILE = '/etc/dhcp/dhcpd.conf'
 
 DEFAULT_LEASE_TIME_KEY = 'default-lease-time'
 MAX_LEASE_TIME_KEY = 'max-lease-time'
+INCLUDE_KEY = 'include'
+OMAPI_PORT_KEY = 'omapi-port'
+OMAPI_KEY_KEY = 'omapi-key'
 
 
 class DHCPConfig:
@@ -34,6 +37,9 @@ class DHCPConfig:
     self._subnets = []
     self._peer = None
     self._reserved_hosts = []
+    self._include = None
+    self._omapi_port = None
+    self._omapi_key = None
     global LOGGER
     LOGGER = logger.get_logger(LOG_NAME, 'dhcp-2')
 
@@ -69,6 +75,14 @@ class DHCPConfig:
       if hw_addr == host.hw_addr:
         return host
 
+  def get_reserved_hosts(self):
+    return self._reserved_hosts
+
+  def requires_restart(self, config):
+    """Whether the server must be restarted to change to the config.
+    Reserved hosts are changed on the running server through OMAPI."""
+    return self._encode(hosts=False) != config._encode(hosts=False)  # pylint: disable=W0212
+
   def write_config(self, config=None):
     if config is None:
       conf = str(self)
@@ -89,6 +103,7 @@ class DHCPConfig:
       self._subnets = self.resolve_subnets(conf)
       self._peer = DHCPFailoverPeer(conf)
       self._reserved_hosts = self.resolve_reserved_hosts(conf)
+      self.resolve_omapi(conf)
     except Exception as e:  # pylint: disable=W0718
       print('Failed to make DHCPConfig: ' + str(e))
 
@@ -98,9 +113,20 @@ class DHCPConfig:
       self._subnets = self.resolve_subnets(conf)
       self._peer = DHCPFailoverPeer(conf)
       self._reserved_hosts = self.resolve_reserved_hosts(conf)
+      self.resolve_omapi(conf)
     except Exception as e:  # pylint: disable=W0718
       print('Failed to resolve config: ' + str(e))
 
+  def resolve_omapi(self, conf):
+    self._include = self._resolve_statement(conf, INCLUDE_KEY)
+    self._omapi_port = self._resolve_statement(conf, OMAPI_PORT_KEY)
+    self._omapi_key = self._resolve_statement(conf, OMAPI_KEY_KEY)
+
+  def _resolve_statement(self, conf, key):
+    # Only top level statements start at the beginning of a line
+    match = re.search(r'^' + key + r'\s+"?([^";]+)"?;', conf, re.MULTILINE)
+    return match.group(1) if match is not None else None
+
   def resolve_subnets(self, conf):
     subnets = []
     regex = r'(subnet.*)'
@@ -161,6 +187,9 @@ class DHCPConfig:
     return '.'.join(str(octet) for octet in netmask_octets)
 
   def __str__(self):
+    return self._encode()
+
+  def _encode(self, hosts=True):
 
     config = ('{DEFAULT_LEASE_TIME_KEY} {DEFAULT_LEASE_TIME};'
               if self._default_lease_time is not None else '')
@@ -175,6 +204,14 @@ class DHCPConfig:
                            MAX_LEASE_TIME_KEY=MAX_LEASE_TIME_KEY,
                            MAX_LEASE_TIME=self._max_lease_time)
 
+    # Encode the OMAPI control channel
+    if self._include is not None:
+      config += '\n\r' + INCLUDE_KEY + ' "' + self._include + '";'
+    if self._omapi_port is not None:
+      config += '\n\r' + OMAPI_PORT_KEY + ' ' + self._omapi_port + ';'
+    if self._omapi_key is not None:
+      config += '\n\r' + OMAPI_KEY_KEY + ' ' + self._omapi_key + ';'
+
     # Encode the failover peer
     config += '\n\n' + str(self._peer)
 
@@ -183,7 +220,7 @@ class DHCPConfig:
       config += '\n\n' + str(subnet)
 
     # Encode the reserved hosts
-    for host in self._reserved_hosts:
+    for host in self._reserved_hosts if hosts else []:
       config += '\n' + str(host)
 
     return str(config)
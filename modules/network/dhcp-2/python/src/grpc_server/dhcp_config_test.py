@@ -99,6 +99,18 @@ class DHCPConfigTest(unittest.TestCase):
                     and pool.range_end == range_end)
     print('SetSubnetRange:\n' + str(DHCP_CONFIG))
 
+  def test_requires_restart(self):
+    # Reserved hosts are changed without a restart
+    config_with_host = get_config()
+    config_with_host.add_reserved_host('test', '00:11:22:33:44:66',
+                                       '192.168.10.6')
+    self.assertFalse(get_config().requires_restart(config_with_host))
+
+    # Any other change requires a restart
+    config_with_range = get_config()
+    config_with_range.set_range('10.0.0.100', '10.0.0.200')
+    self.assertTrue(get_config().requires_restart(config_with_range))
+
 if __name__ == '__main__':
   suite = unittest.TestSuite()
   suite.addTest(DHCPConfigTest('test_resolve_config'))
@@ -108,5 +120,6 @@ if __name__ == '__main__':
   suite.addTest(DHCPConfigTest('test_delete_reserved_host'))
   suite.addTest(DHCPConfigTest('test_resolve_config_with_hosts'))
   suite.addTest(DHCPConfigTest('test_set_subnet_range'))
+  suite.addTest(DHCPConfigTest('test_requires_restart'))
   runner = unittest.TextTestRunner()
   runner.run(suite)
@@ -25,8 +25,9 @@ class DHCPLease(object):
   ip = None
   hostname = None
   expires = None
+  manufacturer = None
 
-  def __init__(self, lease):
+  def __init__(self, lease=None):
     self._make_lease(lease)
 
   def _make_lease(self, lease):
@@ -51,6 +52,8 @@ class DHCPLease(object):
     return self.get_millis(self.expires)
 
   def is_expired(self):
+    if self.expires is None:
+      return False
     expires_millis = self.get_expires_millis()
     cur_time = int(round(time.time()) * 1000)
     return cur_time >= expires_millis
@@ -13,9 +13,10 @@
 # limitations under the License.
 """Used to resolve the DHCP servers lease information"""
 import os
-from dhcp_lease import DHCPLease
+import re
+import threading
+from lease_file import LeaseFile, parse_record, split_records
 import logger
-from common import util
 
 LOG_NAME = 'dhcp_lease'
 LOGGER = None
@@ -24,15 +25,35 @@ DHCP_LEASE_FILES = [
     '/var/lib/dhcp/dhcpd.leases', '/var/lib/dhcp/dhcpd.leases~',
     '/var/lib/dhcp/dhcpd6.leases', '/var/lib/dhcp/dhcpd6.leases~'
 ]
+
+# Lease files of the running servers, the IPv4 leases are resolved first
+ACTIVE_LEASE_FILES = [
+    '/var/lib/dhcp/dhcpd.leases', '/var/lib/dhcp/dhcpd6.leases'
+]
 DHCP_CONFIG_FILE = '/etc/dhcp/dhcpd.conf'
 
+# Manufacturer databases in the order used by dhcp-lease-list
+OUI_FILES = [
+    '/usr/local/etc/oui.txt', '/usr/share/misc/oui.txt',
+    '/usr/lib/ieee-data/oui.txt'
+]
+OUI_PATTERN = re.compile(r'^([0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2})\s+\(hex\)'
+                         r'\s+(.*\S)', re.MULTILINE)
+NO_MANUFACTURER = '-NA-'
+
 
 class DHCPLeases:
   """Leases for the DHCP server"""
 
-  def __init__(self):
+  def __init__(self, lease_files=None):
     global LOGGER
     LOGGER = logger.get_logger(LOG_NAME, 'dhcp-2')
+    self._manufacturers = None
+    self._oui_lock = threading.Lock()
+    self._lease_files = [
+        LeaseFile(lease_file, self._get_manufacturer)
+        for lease_file in (lease_files or ACTIVE_LEASE_FILES)
+    ]
 
   def delete_all_hosts(self):
     LOGGER.info('Deleting hosts')
@@ -48,28 +69,24 @@ class DHCPLeases:
         # Create an empty lease file
         with open(lease, 'w', encoding='UTF-8'):
           pass
+    self._reset()
 
   def get_lease(self, hw_addr):
-    for lease in self.get_leases():
-      if lease.hw_addr == hw_addr:
+    for lease_file in self._lease_files:
+      lease = lease_file.get_lease(hw_addr)
+      if lease is not None:
+        return lease
+
+  def get_lease_by_ip(self, ip_addr):
+    for lease_file in self._lease_files:
+      lease = lease_file.get_lease_by_ip(ip_addr)
+      if lease is not None:
         return lease
 
   def get_leases(self):
     leases = []
-    lease_list_raw = self._get_lease_list()
-    LOGGER.info('Raw Leases:\n' + str(lease_list_raw) + '\n')
-    lease_list_start = lease_list_raw.find('=========',0)
-    lease_list_start = lease_list_raw.find('\n',lease_list_start)
-    lease_list = lease_list_raw[lease_list_start+1:]
-    lines = lease_list.split('\n')
-    for line in lines:
-      try:
-        lease = DHCPLease(line)
-        leases.append(lease)
-      except Exception as e:  # pylint: disable=W0718
-        # Let non lease lines file without extra checks
-        LOGGER.error('Making Lease Error: ' + str(e))
-        LOGGER.error('Not a valid lease line: ' + line)
+    for lease_file in self._lease_files:
+      leases += lease_file.get_leases()
     return leases
 
   def delete_lease(self, ip_addr):
@@ -79,28 +96,49 @@ class DHCPLeases:
       if os.path.exists(lease):
         LOGGER.info('File Exists: ' + lease)
         try:
-          # Delete existing lease file
           with (open(lease, 'r', encoding='UTF-8')) as f:
             contents = f.read()
 
-          while ip_addr in contents:
-            ix_ip = contents.find(ip_addr)
-            lease_start = contents.rindex('lease', 0, ix_ip)
-            lease_end = contents.find('}', lease_start)
-            LOGGER.info('Lease Location: ' + str(lease_start) + ':' +
-                        str(lease_end))
-            contents = contents[0:lease_start] + contents[lease_end + 1:]
+          # Keep every record which does not hold a lease for the address
+          kept = []
+          end = 0
+          for start, record_end, record in split_records(contents):
+            if any(r.ip == ip_addr for r in parse_record(record)):
+              LOGGER.info('Lease Location: ' + str(start) + ':' +
+                          str(record_end))
+              kept.append(contents[end:start])
+              # Drop the line break after the lease as well
+              end = record_end + (contents[record_end:record_end + 1] == '\n')
+          kept.append(contents[end:])
+          updated = ''.join(kept)
 
+          if updated != contents:
+            with (open(lease, 'w', encoding='UTF-8')) as f:
+              f.write(updated)
         except OSError as e:
           LOGGER.info(f'Error occurred while deleting the lease: {e}')
+    self._reset()
+
+  def _reset(self):
+    for lease_file in self._lease_files:
+      lease_file.reset()
+
+  def _get_manufacturer(self, hw_addr):
+    with self._oui_lock:
+      if self._manufacturers is None:
+        self._manufacturers = self._load_manufacturers()
+    prefix = hw_addr[:8].replace(':', '-').upper()
+    return self._manufacturers.get(prefix, NO_MANUFACTURER)
 
-  def _get_lease_list(self):
-    LOGGER.info('Running lease list command')
-    try:
-      result = util.run_command('dhcp-lease-list')
-      return result[0]
-    except Exception as e:  # pylint: disable=W0718
-      LOGGER.error('Error lease list: ' + str(e))
+  def _load_manufacturers(self):
+    for oui_file in OUI_FILES:
+      if os.path.exists(oui_file):
+        try:
+          with open(oui_file, 'r', encoding='UTF-8', errors='replace') as f:
+            return dict(OUI_PATTERN.findall(f.read()))
+        except OSError as e:
+          LOGGER.error('Failed to read manufacturers: ' + str(e))
+    return {}
 
   def _write_config(self, config):
     with open(DHCP_CONFIG_FILE, 'w', encoding='UTF-8') as f:
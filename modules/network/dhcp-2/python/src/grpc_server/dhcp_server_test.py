@@ -0,0 +1,75 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit Testing for reloading the DHCP Server config"""
+import unittest
+from unittest import mock
+from dhcp_config_test import get_config
+from dhcp_server import DHCPServer
+from omapi_hosts import LocalOMAPIHosts
+
+HW_ADDR = '00:11:22:33:44:55'
+
+
+class DHCPServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._hosts = LocalOMAPIHosts()
+    self._server = DHCPServer(omapi_hosts=self._hosts)
+    self._server.dhcp_config = get_config()
+    self._restart = mock.patch.object(self._server,
+                                      'restart',
+                                      return_value=True).start()
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def _reload_with_host(self, ip_addr):
+    dhcp_config = get_config()
+    dhcp_config.add_reserved_host('test', HW_ADDR, ip_addr)
+    self.assertTrue(self._server.reload(dhcp_config))
+    self.assertIs(self._server.dhcp_config, dhcp_config)
+
+  def test_reload_add_host(self):
+    self._reload_with_host('10.10.10.5')
+    self.assertEqual(self._hosts.hosts, {HW_ADDR: '10.10.10.5'})
+    self._restart.assert_not_called()
+
+  def test_reload_change_host(self):
+    self._reload_with_host('10.10.10.5')
+    self._reload_with_host('10.10.10.6')
+    self.assertEqual(self._hosts.hosts, {HW_ADDR: '10.10.10.6'})
+    self._restart.assert_not_called()
+
+  def test_reload_delete_host(self):
+    self._reload_with_host('10.10.10.5')
+    self.assertTrue(self._server.reload(get_config()))
+    self.assertEqual(self._hosts.hosts, {})
+    self._restart.assert_not_called()
+
+  def test_reload_omapi_failure(self):
+    # The server already holds a host object the config does not know of
+    self._hosts.hosts[HW_ADDR] = '10.10.10.7'
+    self._reload_with_host('10.10.10.5')
+    self._restart.assert_called_once()
+
+
+if __name__ == '__main__':
+  suite = unittest.TestSuite()
+  suite.addTest(DHCPServerTest('test_reload_add_host'))
+  suite.addTest(DHCPServerTest('test_reload_change_host'))
+  suite.addTest(DHCPServerTest('test_reload_delete_host'))
+  suite.addTest(DHCPServerTest('test_reload_omapi_failure'))
+
+  runner = unittest.TextTestRunner()
+  runner.run(suite)
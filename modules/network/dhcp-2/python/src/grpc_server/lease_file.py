@@ -0,0 +1,261 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parses an isc-dhcp leases file as it is appended to and indexes the
+active leases by hardware and IP address"""
+import calendar
+import codecs
+import heapq
+import os
+import re
+import threading
+import time
+from dhcp_lease import DHCPLease, time_format
+
+# Tokens of the leases file. Comments and quoted strings must be
+# complete so a record is not split in the middle of one.
+TOKEN_PATTERN = re.compile(
+    r'\s+|#[^\n]*\n|"(?:[^"\\]|\\.)*"|[{};]|[^\s"#{};]+')
+
+LEASE_PATTERN = re.compile(r'^lease\s+([0-9.]+)\s*{(.*)}$', re.DOTALL)
+IA_PATTERN = re.compile(r'^ia-(?:na|ta)\s+"((?:[^"\\]|\\.)*)"\s*{(.*)}$',
+                        re.DOTALL)
+IAADDR_PATTERN = re.compile(r'iaaddr\s+([0-9a-fA-F:]+)\s*{([^}]*)}')
+BINDING_STATE_PATTERN = re.compile(r'(?:^|;)\s*binding\s+state\s+([\w-]+)')
+ENDS_PATTERN = re.compile(r'(?:^|;)\s*ends\s+(?:(never)|epoch\s+(\d+)|'
+                          r'\d\s+(\d+/\d+/\d+\s+\d+:\d+:\d+))')
+HARDWARE_PATTERN = re.compile(r'hardware\s+ethernet\s+([0-9a-fA-F:]+)')
+HOSTNAME_PATTERN = re.compile(r'client-hostname\s+"((?:[^"\\]|\\.)*)"')
+ESCAPE_PATTERN = re.compile(r'\\([0-7]{3}|.)', re.DOTALL)
+
+BINDING_STATE_ACTIVE = 'active'
+
+# Hostname reported for a lease without a client hostname
+NO_HOSTNAME = '-NA-'
+
+# DUID types which contain the link-layer address of the client
+DUID_LLT = 1
+DUID_LL = 3
+HW_TYPE_ETHERNET = 1
+
+
+def split_records(text, start=0):
+  """Yields the start, end and text without comments of each complete
+  top level statement, such as a lease, from the start position"""
+  pos = start
+  record_start = start
+  depth = 0
+  tokens = []
+  while pos < len(text):
+    match = TOKEN_PATTERN.match(text, pos)
+    if match is None:
+      # The rest of the text is an incomplete string or comment
+      return
+    token = match.group()
+    pos = match.end()
+    if token[0] == '#' or (not tokens and token.isspace()):
+      continue
+    if not tokens:
+      record_start = match.start()
+    tokens.append(token)
+    if token == '{':
+      depth += 1
+    elif token == '}':
+      depth -= 1
+    if depth <= 0 and token in (';', '}'):
+      yield record_start, pos, ''.join(tokens)
+      depth = 0
+      tokens = []
+
+
+def parse_record(record):
+  """Returns the leases of a record of the leases file, with None as
+  the hardware address of leases which are not active"""
+  match = LEASE_PATTERN.match(record)
+  if match is not None:
+    ip_addr, body = match.groups()
+    hw_addr = _get_hw_addr(body)
+    return [_make_lease(ip_addr, hw_addr, body)]
+  match = IA_PATTERN.match(record)
+  if match is not None:
+    hw_addr = _get_duid_hw_addr(match.group(1))
+    return [
+        _make_lease(ip_addr, hw_addr, body)
+        for ip_addr, body in IAADDR_PATTERN.findall(match.group(2))
+    ]
+  return []
+
+
+def _make_lease(ip_addr, hw_addr, body):
+  lease = DHCPLease()
+  lease.ip = ip_addr
+  state = BINDING_STATE_PATTERN.search(body)
+  if state is None or state.group(1) != BINDING_STATE_ACTIVE:
+    return lease
+  lease.hw_addr = hw_addr
+  hostname = HOSTNAME_PATTERN.search(body)
+  lease.hostname = (_unescape(hostname.group(1)).decode(errors='replace')
+                    if hostname is not None else NO_HOSTNAME)
+  ends = ENDS_PATTERN.search(body)
+  if ends is not None and ends.group(2) is not None:
+    lease.expires = time.strftime(time_format,
+                                  time.gmtime(int(ends.group(2))))
+  elif ends is not None and ends.group(3) is not None:
+    lease.expires = ends.group(3).replace('/', '-')
+  return lease
+
+
+def _get_hw_addr(body):
+  match = HARDWARE_PATTERN.search(body)
+  return match.group(1).lower() if match is not None else None
+
+
+def _get_duid_hw_addr(ia_id):
+  """Returns the hardware address held in the DUID of an IA, which
+  follows the 4 byte IAID"""
+  duid = _unescape(ia_id)[4:]
+  duid_type = int.from_bytes(duid[0:2], 'big')
+  if duid_type == DUID_LLT:
+    hw_type, ll_addr = int.from_bytes(duid[2:4], 'big'), duid[8:]
+  elif duid_type == DUID_LL:
+    hw_type, ll_addr = int.from_bytes(duid[2:4], 'big'), duid[4:]
+  else:
+    return None
+  if hw_type != HW_TYPE_ETHERNET or len(ll_addr) != 6:
+    return None
+  return ':'.join(f'{b:02x}' for b in ll_addr)
+
+
+def _unescape(value):
+  """Returns the bytes of a quoted string from the leases file"""
+
+  def replace(match):
+    escape = match.group(1)
+    return chr(int(escape, 8)) if len(escape) == 3 else escape
+
+  return ESCAPE_PATTERN.sub(replace, value).encode('latin-1', errors='replace')
+
+
+def get_expiry(lease):
+  """Returns the expiry of a lease in seconds since the epoch, or None
+  if the lease does not expire"""
+  try:
+    return calendar.timegm(time.strptime(lease.expires, time_format))
+  except (TypeError, ValueError):
+    return None
+
+
+class LeaseFile:
+  """Active leases of a leases file.
+
+  The server only appends to the leases file until it rewrites it as a
+  new file, so only the records appended since the last read are
+  parsed. The last record for an address replaces any earlier one."""
+
+  def __init__(self, path, get_manufacturer=None):
+    self._path = path
+    self._get_manufacturer = get_manufacturer
+    self._lock = threading.Lock()
+    self._reset(None)
+
+  def get_lease(self, hw_addr):
+    """Returns the most recent active lease of a hardware address"""
+    with self._lock:
+      self._update()
+      leases = self._by_hw_addr.get(hw_addr.lower())
+      return next(reversed(leases.values())) if leases else None
+
+  def get_lease_by_ip(self, ip_addr):
+    with self._lock:
+      self._update()
+      return self._by_ip.get(ip_addr)
+
+  def get_leases(self):
+    with self._lock:
+      self._update()
+      return list(self._by_ip.values())
+
+  def reset(self):
+    """Parse the whole file again on the next lookup"""
+    with self._lock:
+      self._reset(None)
+
+  def _reset(self, file_id):
+    self._file_id = file_id
+    self._offset = 0
+    self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    self._pending = ''
+    self._by_ip = {}
+    self._by_hw_addr = {}
+    self._expiries = []
+    self._sequence = 0
+
+  def _update(self):
+    try:
+      stat = os.stat(self._path)
+    except OSError:
+      self._reset(None)
+      return
+    file_id = (stat.st_dev, stat.st_ino)
+    if file_id != self._file_id or stat.st_size < self._offset:
+      # The file has been replaced or truncated
+      self._reset(file_id)
+    if stat.st_size > self._offset:
+      self._read()
+    self._expire(time.time())
+
+  def _read(self):
+    try:
+      with open(self._path, 'rb') as f:
+        f.seek(self._offset)
+        data = f.read()
+    except OSError:
+      return
+    self._offset += len(data)
+    text = self._pending + self._decoder.decode(data)
+    end = 0
+    for _, end, record in split_records(text):
+      for lease in parse_record(record):
+        self._add_lease(lease)
+    self._pending = text[end:]
+
+  def _add_lease(self, lease):
+    old_lease = self._by_ip.pop(lease.ip, None)
+    if old_lease is not None:
+      self._remove_hw_addr(old_lease)
+    if lease.hw_addr is None:
+      return
+    expiry = get_expiry(lease)
+    if expiry is not None and expiry <= time.time():
+      return
+    if self._get_manufacturer is not None:
+      lease.manufacturer = self._get_manufacturer(lease.hw_addr)
+    self._by_ip[lease.ip] = lease
+    self._by_hw_addr.setdefault(lease.hw_addr, {})[lease.ip] = lease
+    if expiry is not None:
+      self._sequence += 1
+      heapq.heappush(self._expiries, (expiry, self._sequence, lease))
+
+  def _remove_hw_addr(self, lease):
+    leases = self._by_hw_addr.get(lease.hw_addr)
+    if leases is not None and leases.get(lease.ip) is lease:
+      del leases[lease.ip]
+      if not leases:
+        del self._by_hw_addr[lease.hw_addr]
+
+  def _expire(self, now):
+    while self._expiries and self._expiries[0][0] <= now:
+      _, _, lease = heapq.heappop(self._expiries)
+      if self._by_ip.get(lease.ip) is lease:
+        del self._by_ip[lease.ip]
+        self._remove_hw_addr(lease)
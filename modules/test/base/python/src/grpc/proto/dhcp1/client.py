@@ -119,6 +119,17 @@ class Client():
 
     return response
 
+  def watch_leases(self, hw_addr, timeout=None):
+    # Create a request message
+    request = pb2.WatchLeasesRequest()
+    request.hw_addr = hw_addr
+
+    # Make the RPC call, lease events are streamed until the call is
+    # cancelled or the timeout is reached
+    response = self._stub.WatchLeases(request, timeout=timeout)
+
+    return response
+
   def set_dhcp_range(self,start,end):
     # Create a request message
     request = pb2.SetDHCPRangeRequest()
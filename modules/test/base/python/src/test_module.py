@@ -181,6 +181,9 @@ class TestModule:
           test['start'])
       test['duration'] = str(duration)
 
+      # Make the result available before the remaining tests have run
+      self._stream_result(test)
+
     json_results = json.dumps({'results': tests}, indent=2)
     self._write_results(json_results)
 
@@ -195,6 +198,15 @@ class TestModule:
     with open(results_file, 'w', encoding='utf-8') as f:
       f.write(results)
 
+  def _stream_result(self, result):
+    results_stream = RESULTS_DIR + self._module_name + '-result.jsonl'
+    try:
+      with open(results_stream, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    except OSError as e:
+      LOGGER.error(f'Failed to stream result for {result["name"]}')
+      LOGGER.error(e)
+
   def _get_device_ipv4(self):
     command = f"""/testrun/bin/get_ipv4_addr {self._ipv4_subnet}
     {self._device_mac.upper()}"""
@@ -16,8 +16,11 @@ import util
 import time
 import traceback
 import os
-from scapy.all import rdpcap, DHCP, ARP, Ether, ICMP, IPv6, ICMPv6ND_NS
+import numpy as np
 from test_module import TestModule
+from common.packet_index import (load_device_index, PacketIndex, FLAG_ARP,
+                                 FLAG_DHCP, FLAG_ICMP, FLAG_ND_NS,
+                                 PACKET_INDEX_FILE)
 from dhcp1.client import Client as DHCPClient1
 from dhcp2.client import Client as DHCPClient2
 from host.client import Client as HostClient
@@ -28,6 +31,7 @@ LOG_NAME = 'test_connection'
 OUI_FILE = '/usr/local/etc/oui.txt'
 STARTUP_CAPTURE_FILE = '/runtime/device/startup.pcap'
 MONITOR_CAPTURE_FILE = '/runtime/device/monitor.pcap'
+PACKET_INDEX = os.path.join('/runtime/device', PACKET_INDEX_FILE)
 DHCP_CAPTURE_FILE = '/runtime/network/dhcp-1.pcap'
 SLAAC_PREFIX = 'fd10:77be:4186'
 TR_CONTAINER_MAC_PREFIX = '9a:02:57:1e:8f:'
@@ -37,6 +41,12 @@ LOGGER = None
 # set in the DHCP server
 LEASE_WAIT_TIME_DEFAULT = 60
 
+# Address reserved for the device when testing an IP address change
+RESERVED_LEASE_IP = '10.10.10.30'
+
+# Maximum time in seconds for the reserved lease to expire once removed
+RESERVED_LEASE_EXPIRE_TIME = 30
+
 
 class ConnectionModule(TestModule):
   """Connection Test module"""
@@ -47,7 +57,8 @@ class ConnectionModule(TestModule):
                conf_file=None,
                results_dir=None,
                startup_capture_file=STARTUP_CAPTURE_FILE,
-               monitor_capture_file=MONITOR_CAPTURE_FILE):
+               monitor_capture_file=MONITOR_CAPTURE_FILE,
+               packet_index_file=PACKET_INDEX):
 
     super().__init__(module_name=module,
                      log_name=LOG_NAME,
@@ -58,6 +69,8 @@ class ConnectionModule(TestModule):
     LOGGER = self._get_logger()
     self.startup_capture_file = startup_capture_file
     self.monitor_capture_file = monitor_capture_file
+    self.packet_index_file = packet_index_file
+    self._packet_index = None
     self._port_stats = PortStatsUtil(logger=LOGGER)
     self.dhcp1_client = DHCPClient1()
     self.dhcp2_client = DHCPClient2()
@@ -115,35 +128,23 @@ class ConnectionModule(TestModule):
       LOGGER.error('No device IP could be resolved')
       return 'Error', 'Could not resolve device IP address'
 
-    no_arp = True
-
-    # Read all the pcap files
-    packets = rdpcap(self.startup_capture_file) + rdpcap(
-        self.monitor_capture_file)
-    for packet in packets:
-
-      # We are not interested in packets unless they are ARP packets
-      if not ARP in packet:
-        continue
-
-      # We are only interested in packets from the device
-      if packet.src != self._device_mac:
-        continue
-
-      # Get the ARP packet
-      arp_packet = packet[ARP]
-      no_arp = False
-
-      # Check MAC address matches IP address
-      if (arp_packet.hwsrc == self._device_mac
-          and (arp_packet.psrc not in (self._device_ipv4_addr, '0.0.0.0'))
-          and not arp_packet.psrc.startswith('169.254')):
+    # We are only interested in ARP packets from the device
+    index = self._get_packet_index()
+    arp_packets = index.has(FLAG_ARP) & index.equals('src_mac',
+                                                     self._device_mac)
+
+    # Check MAC address matches IP address
+    device_arp_packets = arp_packets & index.equals('arp_hwsrc',
+                                                    self._device_mac)
+    for psrc in index.strings('arp_psrc', device_arp_packets):
+      if (psrc not in (self._device_ipv4_addr, '0.0.0.0')
+          and not psrc.startswith('169.254')):
         LOGGER.info(f'Bad ARP packet detected for MAC: {self._device_mac}')
-        LOGGER.info(f'''ARP packet from IP {arp_packet.psrc}
+        LOGGER.info(f'''ARP packet from IP {psrc}
                     does not match {self._device_ipv4_addr}''')
         return False, 'Device is sending false ARP response'
 
-    if no_arp:
+    if not arp_packets.any():
       return None, 'No ARP packets from the device found'
 
     return True, 'Device uses ARP'
@@ -153,27 +154,17 @@ class ConnectionModule(TestModule):
 
     disallowed_dhcp_types = [2, 4, 5, 6, 9, 10, 12, 13, 15, 17]
 
-    # Read all the pcap files
-    packets = rdpcap(self.startup_capture_file) + rdpcap(
-        self.monitor_capture_file)
-    for packet in packets:
+    # We are only interested in DHCP packets from the device
+    index = self._get_packet_index()
+    disallowed_packets = (
+        index.has(FLAG_DHCP) & index.equals('src_mac', self._device_mac) &
+        np.isin(index['dhcp_type'], disallowed_dhcp_types))
 
-      # We are not interested in packets unless they are DHCP packets
-      if not DHCP in packet:
-        continue
+    # Ignore packets responding with port unreachable
+    disallowed_packets &= ~(index.has(FLAG_ICMP) & (index['icmp_type'] == 3))
 
-      # We are only interested in packets from the device
-      if packet.src != self._device_mac:
-        continue
-
-      dhcp_type = self._get_dhcp_type(packet)
-      if dhcp_type in disallowed_dhcp_types:
-
-        # Check if packet is responding with port unreachable
-        if ICMP in packet and packet[ICMP].type == 3:
-          continue
-
-        return False, 'Device has sent disallowed DHCP message'
+    if disallowed_packets.any():
+      return False, 'Device has sent disallowed DHCP message'
 
     return True, 'Device does not act as a DHCP server'
 
@@ -234,21 +225,17 @@ class ConnectionModule(TestModule):
       LOGGER.info('No MAC address found: ')
       return result, 'No MAC address found.'
 
-    # Read all the pcap files containing DHCP packet information
-    packets = rdpcap(self.startup_capture_file) + rdpcap(
-        self.monitor_capture_file)
+    index = self._get_packet_index()
 
     # Extract MAC addresses from DHCP packets
     mac_addresses = set()
-    LOGGER.info('Inspecting: ' + str(len(packets)) + ' packets')
-    for packet in packets:
-      if DHCP in packet:
-        if self._get_dhcp_type(packet) == 3:
-          mac_address = packet[Ether].src
-          LOGGER.info('DHCPREQUEST detected MAC address: ' + mac_address)
-          if (not mac_address.startswith(TR_CONTAINER_MAC_PREFIX)
-              and mac_address != self._dev_iface_mac):
-            mac_addresses.add(mac_address.upper())
+    LOGGER.info('Inspecting: ' + str(len(index)) + ' packets')
+    dhcp_requests = index.has(FLAG_DHCP) & (index['dhcp_type'] == 3)
+    for mac_address in index.strings('src_mac', dhcp_requests):
+      LOGGER.info('DHCPREQUEST detected MAC address: ' + mac_address)
+      if (not mac_address.startswith(TR_CONTAINER_MAC_PREFIX)
+          and mac_address != self._dev_iface_mac):
+        mac_addresses.add(mac_address.upper())
 
     # Check if the device mac address is in the list of DHCPREQUESTs
     result = self._device_mac.upper() in mac_addresses
@@ -266,11 +253,6 @@ class ConnectionModule(TestModule):
     else:
       return result, 'Device is using multiple IP addresses'
 
-  def _get_dhcp_type(self, packet):
-    for option in packet[DHCP].options:
-      if 'message-type' in option:
-        return option[1]
-
   def _connection_target_ping(self):
     LOGGER.info('Running connection.target_ping')
 
@@ -301,7 +283,7 @@ class ConnectionModule(TestModule):
         LOGGER.info('Current device lease resolved')
         LOGGER.debug(str(lease))
         # Figure out how to calculate a valid IP address
-        ip_address = '10.10.10.30'
+        ip_address = RESERVED_LEASE_IP
         if self._dhcp_util.add_reserved_lease(lease['hostname'],
                                               lease['hw_addr'], ip_address):
           self._dhcp_util.wait_for_lease_expire(lease,
@@ -327,10 +309,7 @@ class ConnectionModule(TestModule):
         result = None, 'Device has no current DHCP lease'
       # Restore the network
       self._dhcp_util.restore_failover_dhcp_server()
-      LOGGER.info('Waiting 30 seconds for reserved lease to expire')
-      time.sleep(30)
-      self._dhcp_util.get_cur_lease(mac_address=self._device_mac,
-                                    timeout=self._lease_wait_time_sec)
+      self._wait_for_reserved_lease_expire()
     else:
       result = None, 'Failed to configure network for test'
     return result
@@ -468,7 +447,7 @@ class ConnectionModule(TestModule):
             if self._dhcp_util.is_lease_active(lease):
 
               # Add a reserved lease with a different IP
-              ip_address = '10.10.10.30'
+              ip_address = RESERVED_LEASE_IP
               reserved_lease = self._dhcp_util.add_reserved_lease(
                   lease['hostname'], self._device_mac, ip_address)
 
@@ -542,12 +521,17 @@ class ConnectionModule(TestModule):
 
     # Restore the network
     self._dhcp_util.restore_failover_dhcp_server()
-    LOGGER.info('Waiting 30 seconds for reserved lease to expire')
-    time.sleep(30)
-    self._dhcp_util.get_cur_lease(mac_address=self._device_mac,
-                                  timeout=self._lease_wait_time_sec)
+    self._wait_for_reserved_lease_expire()
     return result, description
 
+  def _wait_for_reserved_lease_expire(self):
+    # Returns as soon as the device holds a lease outside of the
+    # reserved address rather than always waiting for the lease to expire
+    self._dhcp_util.wait_for_lease_change(
+        mac_address=self._device_mac,
+        ip_address=RESERVED_LEASE_IP,
+        timeout=RESERVED_LEASE_EXPIRE_TIME + self._lease_wait_time_sec)
+
   def _get_oui_manufacturer(self, mac_address):
     # Do some quick fixes on the format of the mac_address
     # to match the oui file pattern
@@ -576,27 +560,36 @@ class ConnectionModule(TestModule):
     return result
 
   def _has_slaac_addres(self):
-    packet_capture = (rdpcap(self.startup_capture_file) +
-                      rdpcap(self.monitor_capture_file))
+    indexes = [self._get_packet_index()]
 
+    # The DHCP server capture is not part of the device packet index
     try:
-      packet_capture += rdpcap(DHCP_CAPTURE_FILE)
+      indexes.append(PacketIndex.from_pcaps([DHCP_CAPTURE_FILE]))
     except FileNotFoundError:
       LOGGER.error('dhcp-1.pcap not found, ignoring')
-
-    sends_ipv6 = False
-    for packet_number, packet in enumerate(packet_capture, start=1):
-      if IPv6 in packet and packet.src == self._device_mac:
-        sends_ipv6 = True
-        if ICMPv6ND_NS in packet:
-          ipv6_addr = str(packet[ICMPv6ND_NS].tgt)
-          if ipv6_addr.startswith(SLAAC_PREFIX):
-            self._device_ipv6_addr = ipv6_addr
-            LOGGER.info('SLAAC address detected at packet number' +
-                        f'{packet_number}')
-            LOGGER.info(f'Device has formed SLAAC address {ipv6_addr}')
-            return True, sends_ipv6
-    return False, sends_ipv6
+    index = PacketIndex.concat(indexes)
+
+    ipv6_packets = ((index['ip_version'] == 6) &
+                    index.equals('src_mac', self._device_mac))
+    ns_packets = np.flatnonzero(ipv6_packets & index.has(FLAG_ND_NS))
+    for packet_number, ipv6_addr in zip(
+        ns_packets.tolist(), index.strings('nd_target', ns_packets)):
+      if ipv6_addr.startswith(SLAAC_PREFIX):
+        self._device_ipv6_addr = ipv6_addr
+        LOGGER.info('SLAAC address detected at packet number' +
+                    f'{packet_number + 1}')
+        LOGGER.info(f'Device has formed SLAAC address {ipv6_addr}')
+        return True, True
+    return False, bool(ipv6_packets.any())
+
+  def _get_packet_index(self):
+    """Returns the index of the packets captured from the device,
+    which is loaded once as the captures do not change during tests"""
+    if self._packet_index is None:
+      self._packet_index = load_device_index(
+          self.packet_index_file,
+          [self.startup_capture_file, self.monitor_capture_file])
+    return self._packet_index
 
   def _connection_ipv6_ping(self):
     LOGGER.info('Running connection.ipv6_ping')
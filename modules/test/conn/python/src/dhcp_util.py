@@ -14,14 +14,30 @@
 """Module that contains various methods for validating the DHCP 
 device behaviors"""
 
+import queue
+import threading
 import time
 from datetime import datetime
+import grpc
 import util
 from dateutil import tz
 
 LOG_NAME = 'dhcp_util'
 LOGGER = None
 
+# Lease event types streamed by the DHCP servers
+LEASE_EVENT_ACTIVE = 'active'
+LEASE_EVENT_SYNCED = 'synced'
+LEASE_EVENT_GRANTED = 'granted'
+LEASE_EVENT_RENEWED = 'renewed'
+LEASE_EVENT_EXPIRED = 'expired'
+
+# Events of a lease held by the device
+LEASE_EVENTS = (LEASE_EVENT_ACTIVE, LEASE_EVENT_GRANTED, LEASE_EVENT_RENEWED)
+
+# Time in seconds between checks for an online DHCP server
+SERVER_STATUS_INTERVAL = 1
+
 
 class DHCPUtil():
   """Helper class for various tests concerning DHCP behavior"""
@@ -123,7 +139,8 @@ class DHCPUtil():
 
   def get_cur_lease(self, mac_address, timeout):
     """
-      Retrieve the current lease for a given MAC address with retries.
+      Retrieve the current lease for a given MAC address, waiting for
+      one to be granted if the device has no lease yet.
 
       Args:
           mac_address (str): The MAC address of the client whose 
@@ -132,47 +149,19 @@ class DHCPUtil():
                          for a lease to be found.
 
       Returns:
-          str or None: The lease information as a string if found, 
-                       or None if no lease is found within the timeout.
+          dict or None: The lease information if found, or None if no
+                        lease is found within the timeout.
 
       Note:
-          This method will attempt to query both primary and secondary 
-          DHCP servers for the lease, with a 5-second pause between 
-          retries until the `timeout` is reached.
+          Lease events are watched on both primary and secondary DHCP
+          servers. A lease held on both servers is taken from the
+          primary server.
       """
     LOGGER.info('Resolving current lease with max wait time of ' +
                 str(timeout) + ' seconds')
-    start_time = time.time()
-
-    while True:
-      lease = self._get_cur_lease(mac_address)
-      if lease is not None or (time.time() - start_time) >= timeout:
-        return lease
-      time.sleep(5)
-
-  def _get_cur_lease(self, mac_address):
-    """
-    Retrieve the current lease for a given MAC address from both
-    primary and secondary DHCP servers.
-
-    Args:
-        mac_address (str): The MAC address of the client whose
-                           lease is being queried.
-
-    Returns:
-        str or None: The lease information as a string if found,
-                     or None if no lease is found.
-    """
-    primary = False
-    lease = self._get_cur_lease_from_server(mac_address=mac_address,
-                                            dhcp_server_primary=True)
-    if lease is not None:
-      primary = True
-    else:
-      lease = self._get_cur_lease_from_server(mac_address=mac_address,
-                                              dhcp_server_primary=False)
+    lease = self._wait_for_lease(mac_address, timeout,
+                                 lambda event: event.type in LEASE_EVENTS)
     if lease is not None:
-      lease['primary'] = primary
       log_msg = 'DHCP lease resolved from '
       log_msg += 'primary' if lease['primary'] else 'secondary'
       log_msg += ' server'
@@ -180,17 +169,108 @@ class DHCPUtil():
       LOGGER.info('DHCP Lease resolved:\n' + str(lease))
     return lease
 
-  def _get_cur_lease_from_server(self, mac_address, dhcp_server_primary=True):
+  def wait_for_lease_change(self, mac_address, ip_address, timeout):
+    """
+      Wait for the device to hold a lease for a different IP address,
+      such as after a reserved lease is deleted.
+
+      Returns:
+          dict or None: The new lease information, or None if the lease
+                        has not changed within the timeout.
+    """
+    LOGGER.info('Waiting for a lease other than ' + ip_address +
+                ' with max wait time of ' + str(timeout) + ' seconds')
+    lease = self._wait_for_lease(
+        mac_address, timeout,
+        lambda event: event.type in LEASE_EVENTS and event.ip != ip_address)
+    if lease is not None:
+      LOGGER.info('DHCP Lease changed:\n' + str(lease))
+    else:
+      LOGGER.info('DHCP lease did not change')
+    return lease
+
+  def _wait_for_lease(self, mac_address, timeout, accept):
+    """
+    Watch the lease events of both primary and secondary DHCP servers
+    and return the first lease accepted by the filter, or None if no
+    lease is accepted within the timeout.
+    """
+    deadline = time.time() + timeout
+    events = queue.Queue()
+    streams = self._watch_leases(mac_address, deadline, events)
+    unsynced = set(streams)
+    active = {}
     lease = None
-    # Check if the server is online first, old lease files can still return
-    # lease information that is no longer valid when a dhcp server is shutdown
-    if self.get_dhcp_server_status(dhcp_server_primary):
-      response = self.get_dhcp_client(dhcp_server_primary).get_lease(
-          mac_address)
-      if response.code == 200:
-        lease_resp = eval(response.message)  # pylint: disable=W0123
-        if lease_resp:  # Check if non-empty lease
-          lease = lease_resp
+    try:
+      while lease is None and streams:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        try:
+          primary, event = events.get(timeout=remaining)
+        except queue.Empty:
+          break
+        if event is None:
+          # The stream has ended
+          del streams[primary]
+          unsynced.discard(primary)
+        elif event.type == LEASE_EVENT_SYNCED:
+          unsynced.discard(primary)
+        elif accept(event):
+          if event.type == LEASE_EVENT_ACTIVE:
+            active[primary] = event
+          else:
+            lease = self._make_lease(event, primary)
+        # Leases held when watching started are only resolved once both
+        # servers have sent them so that the primary server is preferred
+        if lease is None and active and not unsynced:
+          primary = True in active
+          lease = self._make_lease(active[primary], primary)
+    finally:
+      for stream in streams.values():
+        stream.cancel()
+    return lease
+
+  def _watch_leases(self, mac_address, deadline, events):
+    """
+    Start watching the lease events of each DHCP server which is online,
+    waiting for a server to come online if neither is.
+    """
+    streams = {}
+    while not streams and time.time() < deadline:
+      for primary in (True, False):
+        # Check if the server is online first, old lease files can still
+        # hold lease information that is no longer valid when a dhcp server
+        # is shutdown
+        if self.get_dhcp_server_status(primary):
+          stream = self.get_dhcp_client(primary).watch_leases(
+              mac_address, timeout=max(0, deadline - time.time()))
+          streams[primary] = stream
+          threading.Thread(target=self._read_lease_events,
+                           args=(stream, primary, events),
+                           daemon=True).start()
+      if not streams:
+        time.sleep(SERVER_STATUS_INTERVAL)
+    return streams
+
+  def _read_lease_events(self, stream, primary, events):
+    try:
+      for event in stream:
+        events.put((primary, event))
+    except grpc.RpcError:
+      # The stream was cancelled or timed out
+      pass
+    events.put((primary, None))
+
+  def _make_lease(self, event, primary):
+    lease = {
+        'hw_addr': event.hw_addr,
+        'ip': event.ip,
+        'hostname': event.hostname,
+        'expires': event.expires,
+        'manufacturer': event.manufacturer,
+        'primary': primary
+    }
     return lease
 
   def is_lease_active(self, lease):
@@ -269,7 +349,13 @@ class DHCPUtil():
     LOGGER.info('Time until lease expiration: ' + str(wait_time))
     LOGGER.info('Waiting for current lease to expire: ' + str(expiration))
     if wait_time > 0:
-      time.sleep(wait_time)
+      # Stop waiting as soon as the server reports that the lease has
+      # expired or has been replaced by a lease for another address
+      self._wait_for_lease(
+          lease['hw_addr'], wait_time,
+          lambda event: (event.type == LEASE_EVENT_EXPIRED and event.ip ==
+                         lease['ip']) or (event.type == LEASE_EVENT_GRANTED and
+                                          event.ip != lease['ip']))
     LOGGER.info('Current lease expired.')
 
   # Convert from a UTC datetime to the local time zone
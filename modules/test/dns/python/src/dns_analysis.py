@@ -0,0 +1,98 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Aggregates the DNS traffic of a device in a single pass"""
+from collections import Counter
+from common.packet_index import FLAG_DNS
+
+DNS_PORT = 53
+MDNS_PORT = 5353
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+
+class DNSAnalysis:
+  """DNS traffic of a device read from a packet index.
+
+  The index is read once and every packet is counted once, keeping the
+  first capture a packet is seen in, so that the tests and the module
+  report are all served from the same aggregates:
+
+      records: DNS packets to or from the device for the module report
+      queries: packets sent by the device to DNS port 53, counted by
+          destination address and query name
+      mdns: mDNS packets sent by the device, counted by query name
+  """
+
+  def __init__(self, device_mac, index):
+    self.records = []
+    self.queries = Counter()
+    self.mdns = Counter()
+    self._analyse(device_mac, index)
+
+  def count_queries(self, server=None, exclude_server=None):
+    """Returns the number of queries sent by the device, optionally
+    only to or only not to a server"""
+    return sum(count for (destination, _), count in self.queries.items()
+               if (server is None or destination == server) and
+               (exclude_server is None or destination != exclude_server))
+
+  def count_mdns(self):
+    return sum(self.mdns.values())
+
+  def _analyse(self, device_mac, index):
+    from_device = index.equals('src_mac', device_mac)
+    to_device = index.equals('dst_mac', device_mac)
+    is_dns = index.has(FLAG_DNS)
+    l4_packets = ((index['proto'] == PROTO_TCP) |
+                  (index['proto'] == PROTO_UDP))
+
+    # Only the packets relevant to any aggregate are read
+    report_rows = is_dns & (index['ip_version'] == 4) & (from_device |
+                                                         to_device)
+    query_rows = from_device & l4_packets & (index['dst_port'] == DNS_PORT)
+    mdns_rows = from_device & (index['proto'] == PROTO_UDP) & (
+        (index['src_port'] == MDNS_PORT) | (index['dst_port'] == MDNS_PORT))
+    rows = (report_rows | query_rows | mdns_rows).nonzero()[0].tolist()
+
+    # Packets seen by more than one capture have the same timestamp
+    seen_queries = set()
+    seen_mdns = set()
+    seen_records = set()
+    for row in rows:
+      timestamp = float(index['time'][row])
+      qname = index.string(index['dns_qname'][row])
+
+      if query_rows[row] and timestamp not in seen_queries:
+        seen_queries.add(timestamp)
+        destination = index.string(index['dst_ip'][row])
+        self.queries[(destination, qname)] += 1
+
+      if mdns_rows[row] and timestamp not in seen_mdns:
+        seen_mdns.add(timestamp)
+        self.mdns[qname] += 1
+
+      if report_rows[row] and timestamp not in seen_records:
+        seen_records.add(timestamp)
+        # 'qr' field indicates query (0) or response (1)
+        dns_type = 'Query' if index['dns_qr'][row] == 0 else 'Response'
+        resolved_ip = index.string(index['dns_answer'][row])
+        self.records.append({
+            'Timestamp': timestamp,
+            'Source': index.string(index['src_ip'][row]),
+            'Destination': index.string(index['dst_ip'][row]),
+            'ResolvedIP': resolved_ip if resolved_ip is not None else 'N/A',
+            'Type': dns_type,
+            'Data': (qname if qname is not None else 'N/A')[:-1]
+        })
@@ -12,9 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """DNS test module"""
-import subprocess
-from scapy.all import rdpcap, DNS, IP, Ether
 from test_module import TestModule
+from dns_analysis import DNSAnalysis
+from common.packet_index import (load_device_index, PacketIndex,
+                                 PACKET_INDEX_FILE)
 import os
 from collections import Counter
 
@@ -23,6 +24,7 @@ MODULE_REPORT_FILE_NAME = 'dns_report.html'
 DNS_SERVER_CAPTURE_FILE = '/runtime/network/dns.pcap'
 STARTUP_CAPTURE_FILE = '/runtime/device/startup.pcap'
 MONITOR_CAPTURE_FILE = '/runtime/device/monitor.pcap'
+PACKET_INDEX = os.path.join('/runtime/device', PACKET_INDEX_FILE)
 LOGGER = None
 
 
@@ -36,7 +38,8 @@ class DNSModule(TestModule):
                results_dir=None,
                dns_server_capture_file=DNS_SERVER_CAPTURE_FILE,
                startup_capture_file=STARTUP_CAPTURE_FILE,
-               monitor_capture_file=MONITOR_CAPTURE_FILE):
+               monitor_capture_file=MONITOR_CAPTURE_FILE,
+               packet_index_file=PACKET_INDEX):
     super().__init__(module_name=module,
                      log_name=LOG_NAME,
                      log_dir=log_dir,
@@ -45,6 +48,8 @@ class DNSModule(TestModule):
     self.dns_server_capture_file = dns_server_capture_file
     self.startup_capture_file = startup_capture_file
     self.monitor_capture_file = monitor_capture_file
+    self.packet_index_file = packet_index_file
+    self._dns_analysis = None
     self._dns_server = '10.10.10.4'
     global LOGGER
     LOGGER = self._get_logger()
@@ -148,85 +153,13 @@ class DNSModule(TestModule):
     return report_path
 
   def extract_dns_data(self):
-    dns_data = []
-
-    # Read the pcap file
-    packets = rdpcap(self.dns_server_capture_file) + rdpcap(
-        self.startup_capture_file) + rdpcap(self.monitor_capture_file)
-
-    # Iterate through DNS packets
-    for packet in packets:
-      if DNS in packet and packet.haslayer(IP):
-
-        # Check if either source or destination MAC matches the device
-        if self._device_mac in (packet[Ether].src, packet[Ether].dst):
-          source_ip = packet[IP].src
-          destination_ip = packet[IP].dst
-          dns_layer = packet[DNS]
-          # 'qr' field indicates query (0) or response (1)
-          dns_type = 'Query' if dns_layer.qr == 0 else 'Response'
-
-          # Check if 'qd' (query data) exists and has at least one entry
-          if hasattr(dns_layer, 'qd') and dns_layer.qdcount > 0:
-            qname = dns_layer.qd.qname.decode() if dns_layer.qd.qname else 'N/A'
-          else:
-            qname = 'N/A'
-
-          resolved_ip = 'N/A'
-          # If it's a response packet, extract the resolved IP address
-          # from the answer section
-          if dns_layer.qr == 1 and hasattr(dns_layer,
-                                           'an') and dns_layer.ancount > 0:
-            # Loop through all answers in the DNS response
-            for i in range(dns_layer.ancount):
-              answer = dns_layer.an[i]
-              # Check for IPv4 (A record) or IPv6 (AAAA record)
-              if answer.type == 1:  # Indicates an A record (IPv4 address)
-                resolved_ip = answer.rdata  # Extract IPv4 address
-                break  # Stop after finding the first valid resolved IP
-              elif answer.type == 28:  # Indicates an AAAA record (IPv6 address)
-                resolved_ip = answer.rdata  # Extract IPv6 address
-                break  # Stop after finding the first valid resolved IP
-
-          dns_data.append({
-              'Timestamp': float(packet.time),  # Timestamp of the DNS packet
-              'Source': source_ip,
-              'Destination': destination_ip,
-              'ResolvedIP': resolved_ip,  # Adding the resolved IP address
-              'Type': dns_type,
-              'Data': qname[:-1]
-          })
-
-    # Filter unique entries based on 'Timestamp'
-    filtered_unique_dns_data = []
-    seen_timestamps = set()
-
-    for entry in dns_data:
-      timestamp = entry.get('Timestamp')
-      if timestamp not in seen_timestamps:
-        seen_timestamps.add(timestamp)
-        filtered_unique_dns_data.append(entry)
-
-    return filtered_unique_dns_data
-
-  def _has_dns_traffic(self, tcpdump_filter):
-    dns_server_queries = self._exec_tcpdump(tcpdump_filter,
-                                            DNS_SERVER_CAPTURE_FILE)
-    LOGGER.info('DNS Server queries found: ' + str(len(dns_server_queries)))
-
-    dns_startup_queries = self._exec_tcpdump(tcpdump_filter,
-                                             STARTUP_CAPTURE_FILE)
-    LOGGER.info('Startup DNS queries found: ' + str(len(dns_startup_queries)))
-
-    dns_monitor_queries = self._exec_tcpdump(tcpdump_filter,
-                                             MONITOR_CAPTURE_FILE)
-    LOGGER.info('Monitor DNS queries found: ' + str(len(dns_monitor_queries)))
-
-    num_query_dns = len(dns_server_queries) + len(dns_startup_queries) + len(
-        dns_monitor_queries)
-    LOGGER.info('DNS queries found: ' + str(num_query_dns))
-
-    return num_query_dns > 0
+    return self._get_dns_analysis().records
+
+  def _has_dns_traffic(self, server=None, exclude_server=None):
+    dns_queries = self._get_dns_analysis().count_queries(
+        server=server, exclude_server=exclude_server)
+    LOGGER.info('DNS queries found: ' + str(dns_queries))
+    return dns_queries > 0
 
   def _dns_network_from_dhcp(self):
     LOGGER.info('Running dns.network.from_dhcp')
@@ -235,14 +168,11 @@ class DNSModule(TestModule):
 
     # Check if the device DNS traffic is to appropriate local
     # DHCP provided server
-    tcpdump_filter = (f'dst port 53 and dst host {self._dns_server} ' +
-                      f'and ether src {self._device_mac}')
-    dns_packets_local = self._has_dns_traffic(tcpdump_filter=tcpdump_filter)
+    dns_packets_local = self._has_dns_traffic(server=self._dns_server)
 
     # Check if the device sends any DNS traffic to non-DHCP provided server
-    tcpdump_filter = (f'dst port 53 and dst not host {self._dns_server} ' +
-                      'ether src {self._device_mac}')
-    dns_packets_not_local = self._has_dns_traffic(tcpdump_filter=tcpdump_filter)
+    dns_packets_not_local = self._has_dns_traffic(
+        exclude_server=self._dns_server)
 
     if dns_packets_local or dns_packets_not_local:
       if dns_packets_not_local:
@@ -260,8 +190,7 @@ class DNSModule(TestModule):
     LOGGER.info('Checking DNS traffic from device: ' + self._device_mac)
 
     # Check if the device DNS traffic
-    tcpdump_filter = f'dst port 53 and ether src {self._device_mac}'
-    dns_packets = self._has_dns_traffic(tcpdump_filter=tcpdump_filter)
+    dns_packets = self._has_dns_traffic()
 
     if dns_packets:
       LOGGER.info('DNS traffic detected from device')
@@ -274,10 +203,10 @@ class DNSModule(TestModule):
   def _dns_mdns(self):
     LOGGER.info('Running dns.mdns')
     # Check if the device sends any MDNS traffic
-    tcpdump_filter = f'udp port 5353 and ether src {self._device_mac}'
-    dns_packets = self._has_dns_traffic(tcpdump_filter=tcpdump_filter)
+    mdns_packets = self._get_dns_analysis().count_mdns()
+    LOGGER.info('MDNS packets found: ' + str(mdns_packets))
 
-    if dns_packets:
+    if mdns_packets > 0:
       LOGGER.info('MDNS traffic detected from device')
       result = 'Informational', 'MDNS traffic detected from device'
     else:
@@ -285,28 +214,16 @@ class DNSModule(TestModule):
       result = 'Informational', 'No MDNS traffic detected from the device'
     return result
 
-  def _exec_tcpdump(self, tcpdump_filter, capture_file):
-    """
-    Args
-        tcpdump_filter: Filter to pass onto tcpdump file
-        capture_file: Optional capture file to look
-    Returns
-        List of packets matching the filter
-    """
-    command = f'tcpdump -tttt -n -r {capture_file} {tcpdump_filter}'
-
-    LOGGER.debug('tcpdump command: ' + command)
-
-    with subprocess.Popen(command,
-                          universal_newlines=True,
-                          shell=True,
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE) as process:
-      text = str(process.stdout.read()).rstrip()
-
-      LOGGER.debug('tcpdump response: ' + text)
-
-      if text:
-        return text.split('\n')
-
-    return []
+  def _get_dns_analysis(self):
+    """Analyse the DNS server capture and the device captures once for
+    all tests and the module report"""
+    if self._dns_analysis is None:
+      indexes = [
+          PacketIndex.from_pcaps([self.dns_server_capture_file]),
+          load_device_index(
+              self.packet_index_file,
+              [self.startup_capture_file, self.monitor_capture_file])
+      ]
+      self._dns_analysis = DNSAnalysis(self._device_mac,
+                                       PacketIndex.concat(indexes))
+    return self._dns_analysis
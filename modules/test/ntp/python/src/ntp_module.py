@@ -13,7 +13,8 @@
 # limitations under the License.
 """NTP test module"""
 from test_module import TestModule
-from scapy.all import rdpcap, IP, IPv6, NTP, UDP, Ether
+from common.packet_index import (load_device_index, PacketIndex, FLAG_NTP,
+                                 PACKET_INDEX_FILE)
 import os
 from collections import defaultdict
 
@@ -22,6 +23,7 @@ MODULE_REPORT_FILE_NAME = 'ntp_report.html'
 NTP_SERVER_CAPTURE_FILE = '/runtime/network/ntp.pcap'
 STARTUP_CAPTURE_FILE = '/runtime/device/startup.pcap'
 MONITOR_CAPTURE_FILE = '/runtime/device/monitor.pcap'
+PACKET_INDEX = os.path.join('/runtime/device', PACKET_INDEX_FILE)
 LOGGER = None
 
 
@@ -35,7 +37,8 @@ class NTPModule(TestModule):
                results_dir=None,
                ntp_server_capture_file=NTP_SERVER_CAPTURE_FILE,
                startup_capture_file=STARTUP_CAPTURE_FILE,
-               monitor_capture_file=MONITOR_CAPTURE_FILE):
+               monitor_capture_file=MONITOR_CAPTURE_FILE,
+               packet_index_file=PACKET_INDEX):
     super().__init__(module_name=module,
                      log_name=LOG_NAME,
                      log_dir=log_dir,
@@ -44,6 +47,8 @@ class NTPModule(TestModule):
     self.ntp_server_capture_file = ntp_server_capture_file
     self.startup_capture_file = startup_capture_file
     self.monitor_capture_file = monitor_capture_file
+    self.packet_index_file = packet_index_file
+    self._packet_index = None
     # TODO: This should be fetched dynamically
     self._ntp_server = '10.10.10.5'
 
@@ -185,44 +190,28 @@ class NTPModule(TestModule):
   def extract_ntp_data(self):
     ntp_data = []
 
-    # Read the pcap files
-    packets = (rdpcap(self.startup_capture_file) +
-               rdpcap(self.monitor_capture_file) +
-               rdpcap(self.ntp_server_capture_file))
-
-    # Iterate through NTP packets
-    for packet in packets:
-      if packet.haslayer(UDP) and packet.haslayer(NTP) and packet.haslayer(IP):
-        source_mac = packet[Ether].src
-        destination_mac = packet[Ether].dst
-
-        # Local NTP server syncs to external servers so we need to filter only
-        # for traffic to/from the device
-        if self._device_mac in (source_mac, destination_mac):
-
-          source_ip = None
-          dest_ip = None
-
-          if IP in packet:
-            source_ip = packet[IP].src
-            dest_ip = packet[IP].dst
-          elif IPv6 in packet:
-            source_ip = packet[IPv6].src
-            dest_ip = packet[IPv6].dst
-
+    index = self._get_ntp_packet_index()
+
+    # Local NTP server syncs to external servers so we need to filter only
+    # for IPv4 NTP traffic to/from the device
+    rows = (index.has(FLAG_NTP) & (index['proto'] == 17) &
+            (index['ip_version'] == 4) &
+            (index.equals('src_mac', self._device_mac) |
+             index.equals('dst_mac', self._device_mac)))
+
+    for source_ip, dest_ip, mode, version, timestamp in zip(
+        index.strings('src_ip', rows), index.strings('dst_ip', rows),
+        index['ntp_mode'][rows].tolist(), index['ntp_version'][rows].tolist(),
+        index['time'][rows].tolist()):
+      ntp_data.append({
+          'Source': source_ip,
+          'Destination': dest_ip,
           # 'Mode' field indicates client (3) or server (4)
-          ntp_mode = 'Client' if packet[NTP].mode == 3 else 'Server'
-
+          'Type': 'Client' if mode == 3 else 'Server',
           # 'VN' field indicates NTP version
-          ntp_version = packet[NTP].version
-
-          ntp_data.append({
-              'Source': source_ip,
-              'Destination': dest_ip,
-              'Type': ntp_mode,
-              'Version': str(ntp_version),
-              'Timestamp': float(packet.time),
-          })
+          'Version': str(version),
+          'Timestamp': timestamp,
+      })
 
     # Filter unique entries based on 'Timestamp'
     # NTP Server will duplicate messages caught by
@@ -240,29 +229,20 @@ class NTPModule(TestModule):
 
   def _ntp_network_ntp_support(self):
     LOGGER.info('Running ntp.network.ntp_support')
-    packet_capture = (rdpcap(STARTUP_CAPTURE_FILE) +
-                      rdpcap(MONITOR_CAPTURE_FILE) +
-                      rdpcap(NTP_SERVER_CAPTURE_FILE))
+    index = self._get_ntp_packet_index()
+    rows = index.has(FLAG_NTP) & index.equals('src_mac', self._device_mac)
 
     device_sends_ntp4 = False
     device_sends_ntp3 = False
 
-    for packet in packet_capture:
-
-      if NTP in packet and packet.src == self._device_mac:
-
-        dest_ip = None
-
-        if IP in packet:
-          dest_ip = packet[IP].dst
-        elif IPv6 in packet:
-          dest_ip = packet[IPv6].dst
-        if packet[NTP].version == 4:
-          device_sends_ntp4 = True
-          LOGGER.info(f'Device sent NTPv4 request to {dest_ip}')
-        elif packet[NTP].version == 3:
-          device_sends_ntp3 = True
-          LOGGER.info(f'Device sent NTPv3 request to {dest_ip}')
+    for version, dest_ip in zip(index['ntp_version'][rows].tolist(),
+                                index.strings('dst_ip', rows)):
+      if version == 4:
+        device_sends_ntp4 = True
+        LOGGER.info(f'Device sent NTPv4 request to {dest_ip}')
+      elif version == 3:
+        device_sends_ntp3 = True
+        LOGGER.info(f'Device sent NTPv3 request to {dest_ip}')
 
     result = False, 'Device has not sent any NTP requests'
 
@@ -278,28 +258,21 @@ class NTPModule(TestModule):
 
   def _ntp_network_ntp_dhcp(self):
     LOGGER.info('Running ntp.network.ntp_dhcp')
-    packet_capture = (rdpcap(STARTUP_CAPTURE_FILE) +
-                      rdpcap(MONITOR_CAPTURE_FILE) +
-                      rdpcap(NTP_SERVER_CAPTURE_FILE))
+    index = self._get_ntp_packet_index()
+    rows = index.has(FLAG_NTP) & index.equals('src_mac', self._device_mac)
 
     device_sends_ntp = False
     ntp_to_local = False
     ntp_to_remote = False
 
-    for packet in packet_capture:
-      if NTP in packet and packet.src == self._device_mac:
-        device_sends_ntp = True
-        dest_ip = None
-        if IP in packet:
-          dest_ip = packet[IP].dst
-        elif IPv6 in packet:
-          dest_ip = packet[IPv6].dst
-        if dest_ip == self._ntp_server:
-          LOGGER.info('Device sent NTP request to DHCP provided NTP server')
-          ntp_to_local = True
-        else:
-          LOGGER.info('Device sent NTP request to non-DHCP provided NTP server')
-          ntp_to_remote = True
+    for dest_ip in index.strings('dst_ip', rows):
+      device_sends_ntp = True
+      if dest_ip == self._ntp_server:
+        LOGGER.info('Device sent NTP request to DHCP provided NTP server')
+        ntp_to_local = True
+      else:
+        LOGGER.info('Device sent NTP request to non-DHCP provided NTP server')
+        ntp_to_remote = True
 
     result = 'Feature Not Detected', 'Device has not sent any NTP requests'
 
@@ -315,3 +288,16 @@ class NTPModule(TestModule):
 
     LOGGER.info(result[1])
     return result
+
+  def _get_ntp_packet_index(self):
+    """Returns the index of the packets captured from the device joined
+    with an index of the NTP server capture, which is read each time as
+    it is still being captured"""
+    if self._packet_index is None:
+      self._packet_index = load_device_index(
+          self.packet_index_file,
+          [self.startup_capture_file, self.monitor_capture_file])
+    return PacketIndex.concat([
+        self._packet_index,
+        PacketIndex.from_pcaps([self.ntp_server_capture_file])
+    ])
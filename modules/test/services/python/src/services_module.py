@@ -12,11 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Services test module"""
-import time
 import util
 import json
 import threading
 import xmltodict
+from concurrent.futures import ThreadPoolExecutor
 from test_module import TestModule
 import os
 
@@ -25,6 +25,22 @@ MODULE_REPORT_FILE_NAME = 'services_report.html'
 NMAP_SCAN_RESULTS_SCAN_FILE = 'services_scan_results.json'
 LOGGER = None
 
+# Range of TCP ports swept for open ports
+TCP_SCAN_PORTS = '1-1000'
+
+# Number of open ports given to each service and version detection scan
+# and the number of those scans run in parallel
+VERSION_SCAN_BATCH_SIZE = 8
+VERSION_SCAN_WORKERS = 4
+
+# Bounds in milliseconds of the round trip timeouts tuned from the
+# host discovery of the device
+MIN_RTT_TIMEOUT = 100
+MAX_RTT_TIMEOUT = 1000
+
+# UDP ports in these states may be open and are probed for services
+UDP_PROBE_STATES = ('open', 'open|filtered')
+
 
 class ServicesModule(TestModule):
   """Services Test module"""
@@ -41,9 +57,9 @@ class ServicesModule(TestModule):
                      log_dir=log_dir,
                      conf_file=conf_file,
                      results_dir=results_dir)
-    self._scan_tcp_results = None
-    self._udp_tcp_results = None
     self._scan_results = {}
+    self._scan_results_lock = threading.Lock()
+    self._scan_timing = ''
 
     self._nmap_scan_results_path = (self._results_dir if nmap_scan_results_path
                                     is None else nmap_scan_results_path)
@@ -159,7 +175,11 @@ class ServicesModule(TestModule):
   def _run_nmap(self):
     LOGGER.info('Running nmap')
 
-    # Run the monitor method asynchronously to keep this method non-blocking
+    # Tune the port scans to how quickly the device responds
+    self._scan_timing = self._discover_host()
+
+    # Sweep for open ports first and only detect the services running on
+    # the open ports, TCP and UDP ports are scanned at the same time
     self._tcp_scan_thread = threading.Thread(target=self._scan_tcp_ports)
     self._udp_scan_thread = threading.Thread(target=self._scan_udp_ports)
 
@@ -169,45 +189,81 @@ class ServicesModule(TestModule):
     self._tcp_scan_thread.start()
     self._udp_scan_thread.start()
 
-    while (self._tcp_scan_thread.is_alive()
-           or self._udp_scan_thread.is_alive()):
-      time.sleep(1)
-
-    LOGGER.debug('TCP scan results: ' + str(self._scan_tcp_results))
-    LOGGER.debug('UDP scan results: ' + str(self._scan_udp_results))
+    self._tcp_scan_thread.join()
+    self._udp_scan_thread.join()
 
-    self._process_port_results()
+    LOGGER.debug('Port scan results: ' + str(self._scan_results))
 
     self._write_nmap_results_to_file()
 
   def _write_nmap_results_to_file(self):
     scan_file = os.path.join(self._results_dir, NMAP_SCAN_RESULTS_SCAN_FILE)
 
-    # Convert nmap scan results to JSON format
-    json_data = json.dumps(self._scan_results, indent=2)
-
-    # Write JSON data to a file
-    with open(scan_file, 'w', encoding='utf-8') as file:
-      file.write(json_data)
-
-  def _process_port_results(self):
+    with self._scan_results_lock:
+      # Order the ports as nmap reports them, TCP ports first
+      scan_results = dict(
+          sorted(self._scan_results.items(),
+                 key=lambda item:
+                 (item[1]['tcp_udp'] != 'tcp', int(item[1]['number']))))
+
+      # Convert nmap scan results to JSON format
+      json_data = json.dumps(scan_results, indent=2)
+
+      # Write JSON data to a file, replacing it in one step so that
+      # partial results are never read half written
+      temp_file = scan_file + '.tmp'
+      with open(temp_file, 'w', encoding='utf-8') as file:
+        file.write(json_data)
+      os.replace(temp_file, scan_file)
+
+  def _add_scan_results(self, results):
+    """Add the results of a scan and write the results so far"""
+    with self._scan_results_lock:
+      self._scan_results.update(results)
+    self._write_nmap_results_to_file()
 
-    if self._scan_tcp_results is not None:
-      self._scan_results.update(self._scan_tcp_results)
-    if self._scan_udp_results is not None:
-      self._scan_results.update(self._scan_udp_results)
+  def _discover_host(self):
+    """Returns the nmap timing options for the round trip time of the
+    device, or no options if the device does not respond to discovery"""
+    LOGGER.info('Running nmap host discovery')
+    nmap_results = util.run_command( # pylint: disable=E1120
+        f'nmap -sn -n -PE -PS22,80,443 -PA80 -oX - {self._ipv4_addr}')[0]
+    nmap_results_json = self._nmap_results_to_json(nmap_results)
+    host = None
+    if nmap_results_json is not None:
+      host = nmap_results_json['nmaprun'].get('host')
+    if isinstance(host, list):
+      host = host[0]
+    if host is None or host['status']['@state'] != 'up':
+      LOGGER.info('Device did not respond to host discovery')
+      return ''
+    if 'times' not in host:
+      return ''
+
+    # nmap reports the round trip timeout in microseconds
+    timeout = int(host['times']['@to']) // 1000
+    max_rtt_timeout = min(MAX_RTT_TIMEOUT, max(MIN_RTT_TIMEOUT, timeout * 2))
+    initial_rtt_timeout = min(max_rtt_timeout, max(MIN_RTT_TIMEOUT, timeout))
+    LOGGER.info('Device round trip timeout: ' + str(timeout) + 'ms')
+    return (f'--initial-rtt-timeout {initial_rtt_timeout}ms '
+            f'--max-rtt-timeout {max_rtt_timeout}ms --max-retries 2')
 
   def _scan_tcp_ports(self):
-    max_port = 1000
-    LOGGER.info('Running nmap TCP port scan')
+    LOGGER.info('Running nmap TCP port sweep')
     nmap_results = util.run_command( # pylint: disable=E1120
-        f'''nmap --open -sT -sV -Pn -v -p 1-{max_port}
-      --version-intensity 7 -T4 -oX - {self._ipv4_addr}''')[0]
+        f'''nmap --open -sT -Pn -n -v -p {TCP_SCAN_PORTS} -T4
+      {self._scan_timing} -oX - {self._ipv4_addr}''')[0]
 
-    LOGGER.info('TCP port scan complete')
+    LOGGER.info('TCP port sweep complete')
     nmap_results_json = self._nmap_results_to_json(nmap_results)
-    self._scan_tcp_results = self._process_nmap_json_results(
+    results = self._process_nmap_json_results(
         nmap_results_json=nmap_results_json)
+    self._add_scan_results(results)
+
+    open_ports = [
+        port['number'] for port in results.values() if port['state'] == 'open'
+    ]
+    self._scan_services('tcp', open_ports)
 
   def _scan_udp_ports(self):
 
@@ -221,19 +277,57 @@ class ServicesModule(TestModule):
         continue
 
       for port in test_config['ports']:
-        if port['type'] == 'udp':
+        if port['type'] == 'udp' and str(port['number']) not in ports:
           ports.append(str(port['number']))
 
     if len(ports) > 0:
       port_list = ','.join(ports)
-      LOGGER.info('Running nmap UDP port scan')
+      LOGGER.info('Running nmap UDP port sweep')
       LOGGER.debug('UDP ports: ' + str(port_list))
       nmap_results = util.run_command( # pylint: disable=E1120
-          f'nmap -sU -sV -p {port_list} -oX - {self._ipv4_addr}')[0]
-      LOGGER.info('UDP port scan complete')
+          f'''nmap -sU -Pn -n -p {port_list} {self._scan_timing}
+        -oX - {self._ipv4_addr}''')[0]
+      LOGGER.info('UDP port sweep complete')
       nmap_results_json = self._nmap_results_to_json(nmap_results)
-      self._scan_udp_results = self._process_nmap_json_results(
+      results = self._process_nmap_json_results(
           nmap_results_json=nmap_results_json)
+      self._add_scan_results(results)
+
+      open_ports = [
+          port['number']
+          for port in results.values()
+          if port['state'] in UDP_PROBE_STATES
+      ]
+      self._scan_services('udp', open_ports)
+
+  def _scan_services(self, protocol, ports):
+    """Run service and version detection on the open ports in parallel
+    batches"""
+    if len(ports) == 0:
+      return
+    LOGGER.info('Running nmap ' + protocol.upper() + ' service scan on ' +
+                str(len(ports)) + ' ports')
+    batches = [
+        ports[i:i + VERSION_SCAN_BATCH_SIZE]
+        for i in range(0, len(ports), VERSION_SCAN_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=VERSION_SCAN_WORKERS) as executor:
+      for batch in batches:
+        executor.submit(self._scan_services_batch, protocol, batch)
+    LOGGER.info(protocol.upper() + ' service scan complete')
+
+  def _scan_services_batch(self, protocol, ports):
+    scan_type = '-sT' if protocol == 'tcp' else '-sU'
+    port_list = ','.join(ports)
+    try:
+      nmap_results = util.run_command( # pylint: disable=E1120
+          f'''nmap {scan_type} -sV -Pn -n -p {port_list} --version-intensity 7
+        -T4 {self._scan_timing} -oX - {self._ipv4_addr}''')[0]
+      nmap_results_json = self._nmap_results_to_json(nmap_results)
+      self._add_scan_results(
+          self._process_nmap_json_results(nmap_results_json=nmap_results_json))
+    except Exception as e:  # pylint: disable=W0718
+      LOGGER.error(f'Error scanning {protocol} ports {port_list}: {e}')
 
   def _nmap_results_to_json(self, nmap_results):
     try:
@@ -246,7 +340,8 @@ class ServicesModule(TestModule):
 
   def _process_nmap_json_results(self, nmap_results_json):
     results = {}
-    if 'host' not in nmap_results_json['nmaprun']:
+    if (nmap_results_json is None
+        or 'host' not in nmap_results_json['nmaprun']):
       return results
     if 'ports' in nmap_results_json['nmaprun']['host']:
       ports = nmap_results_json['nmaprun']['host']['ports']
@@ -265,12 +360,14 @@ class ServicesModule(TestModule):
     port['number'] = port_json['@portid']
     port['tcp_udp'] = port_json['@protocol']
     port['state'] = port_json['state']['@state']
-    port['service'] = port_json['service']['@name']
+    # Ports which are not in the nmap services list have no service
+    service = port_json.get('service', {})
+    port['service'] = service.get('@name', 'unknown')
     port['version'] = ''
-    if '@version' in port_json['service']:
-      port['version'] += port_json['service']['@version']
-    if '@extrainfo' in port_json['service']:
-      port['version'] += ' ' + port_json['service']['@extrainfo']
+    if '@version' in service:
+      port['version'] += service['@version']
+    if '@extrainfo' in service:
+      port['version'] += ' ' + service['@extrainfo']
     port_result = {port_json['@portid'] + port['tcp_udp']: port}
     return port_result
 
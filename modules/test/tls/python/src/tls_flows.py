@@ -0,0 +1,484 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads the TLS handshakes of every connection in a capture file in a
+single pass"""
+import ipaddress
+import struct
+from cipher_suites import CIPHER_SUITES
+
+# Link types of the supported capture files
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# TLS record content types
+TLS_CHANGE_CIPHER_SPEC = 20
+TLS_ALERT = 21
+TLS_HANDSHAKE = 22
+TLS_APPLICATION_DATA = 23
+TLS_HEARTBEAT = 24
+
+# TLS handshake message types
+TLS_CLIENT_HELLO = 1
+TLS_SERVER_HELLO = 2
+TLS_SERVER_HELLO_DONE = 14
+
+# TLS extension types
+TLS_EXT_SERVER_NAME = 0
+TLS_EXT_SUPPORTED_VERSIONS = 43
+
+TLS_VERSIONS = {'1.0': 0x0301, '1.1': 0x0302, '1.2': 0x0303, '1.3': 0x0304}
+
+QUIC_VERSION_1 = 0x00000001
+QUIC_VERSION_2 = 0x6b3343cf
+
+# Connections are only reassembled up to this many bytes in each
+# direction as the handshake is at the start of the connection
+MAX_STREAM_BYTES = 65536
+
+# Ports of protocols which are not expected to use TLS
+NON_TLS_PORTS = (53, 123)
+
+
+def cipher_name(value):
+  return CIPHER_SUITES.get(value, f'0x{value:04x}')
+
+
+class ClientHello:
+  """Fields of a TLS Client Hello message"""
+
+  def __init__(self, version, supported_versions=None, ciphers=None,
+               sni=None):
+    self.version = version
+    self.supported_versions = supported_versions or []
+    self.ciphers = ciphers or []
+    self.sni = sni
+
+  def matches_version(self, tls_version):
+    """Whether the hello offers the TLS version, e.g '1.2'"""
+    if tls_version == '1.3':
+      return (self.version == TLS_VERSIONS['1.3'] or
+              TLS_VERSIONS['1.3'] in self.supported_versions)
+    return self.version == TLS_VERSIONS.get(tls_version or '1.2')
+
+
+class TLSFlow:
+  """A TCP connection or QUIC flow between a client and a server"""
+
+  def __init__(self, client_ip, client_port, server_ip, server_port, proto):
+    self.client_ip = client_ip
+    self.client_port = client_port
+    self.server_ip = server_ip
+    self.server_port = server_port
+    self.proto = proto
+
+    # 'tls' or 'quic' if the client used TLS
+    self.protocol = None
+
+    self.client_hellos = []
+
+    # Record versions of the client records which are not a Client Hello
+    self.record_versions = set()
+
+    # Version selected by the server, None without a Server Hello
+    self.server_version = None
+    self.server_cipher = None
+    self.server_hello_done = False
+    self.server_change_cipher_spec = False
+    self.server_responded = False
+
+    # Packets from the client with neither the ACK nor the SYN flag set
+    self.bare_packets = 0
+    self.bare_payload_packets = 0
+
+    # Reassembly state of each direction
+    self._segments = {True: [], False: []}
+    self._stream_bytes = {True: 0, False: 0}
+
+  @property
+  def ciphers(self):
+    """All cipher suites offered by the client"""
+    ciphers = []
+    for hello in self.client_hellos:
+      ciphers += [c for c in hello.ciphers if c not in ciphers]
+    return ciphers
+
+  @property
+  def sni(self):
+    for hello in self.client_hellos:
+      if hello.sni is not None:
+        return hello.sni
+    return None
+
+  def handshake_complete(self, tls_version):
+    """Whether the server completed a handshake for the TLS version.
+    A handshake for TLS 1.2 is complete with TLS 1.2 or later.
+
+    The QUIC handshake is encrypted past the Initial packets and cannot
+    be inspected, so a QUIC flow is treated as complete as it is only
+    allowed through the allowed protocols."""
+    if self.protocol == 'quic':
+      return True
+    if self.server_version is None:
+      return False
+    version = TLS_VERSIONS.get(tls_version or '1.2')
+    if version == TLS_VERSIONS['1.2']:
+      if self.server_version < version:
+        return False
+    elif self.server_version != version:
+      return False
+    if self.server_version == TLS_VERSIONS['1.3']:
+      return True
+    # A resumed session skips the Server Hello Done
+    return self.server_hello_done or self.server_change_cipher_spec
+
+  def non_tls_packets(self):
+    """Packets from the client with neither the ACK nor the SYN flag set
+    which do not carry TLS"""
+    if self.protocol is not None or self.server_port in NON_TLS_PORTS:
+      return self.bare_packets - self.bare_payload_packets
+    return self.bare_packets
+
+  def _add_segment(self, from_client, seq, payload):
+    if self._stream_bytes[from_client] >= MAX_STREAM_BYTES:
+      return
+    self._segments[from_client].append((seq, payload))
+    self._stream_bytes[from_client] += len(payload)
+
+  def _finish(self):
+    """Parse the reassembled streams once all packets are read"""
+    if self.proto == PROTO_TCP:
+      client_records = _parse_records(_reassemble(self._segments[True]))
+      server_records = _parse_records(_reassemble(self._segments[False]))
+
+      # The client is the side sending the Client Hello
+      if (_first_handshake_type(server_records) == TLS_CLIENT_HELLO and
+          _first_handshake_type(client_records) != TLS_CLIENT_HELLO):
+        self._swap()
+        client_records, server_records = server_records, client_records
+
+      if client_records:
+        self.protocol = 'tls'
+      self._read_client_records(client_records)
+      self._read_server_records(server_records)
+    self._segments = None
+
+  def _swap(self):
+    self.client_ip, self.server_ip = self.server_ip, self.client_ip
+    self.client_port, self.server_port = self.server_port, self.client_port
+
+  def _read_client_records(self, records):
+    for _, version, message_types, messages in records:
+      if TLS_CLIENT_HELLO in message_types:
+        for message_type, body in messages:
+          if message_type == TLS_CLIENT_HELLO:
+            hello = _parse_client_hello(body)
+            if hello is not None:
+              self.client_hellos.append(hello)
+      else:
+        self.record_versions.add(version)
+
+  def _read_server_records(self, records):
+    for content_type, _, _, messages in records:
+      if content_type == TLS_CHANGE_CIPHER_SPEC:
+        self.server_change_cipher_spec = True
+        # Any further handshake messages are encrypted
+        break
+      for message_type, body in messages:
+        if message_type == TLS_SERVER_HELLO:
+          server_hello = _parse_server_hello(body)
+          if server_hello is not None:
+            self.server_version, self.server_cipher = server_hello
+        elif message_type == TLS_SERVER_HELLO_DONE:
+          self.server_hello_done = True
+
+
+def read_tls_flows(capture_file):
+  """Returns the TLS flows of every IPv4 TCP connection and QUIC flow in
+  a pcap file"""
+  flows = {}
+  for linktype, frame in _read_pcap(capture_file):
+    packet = _parse_frame(linktype, frame)
+    if packet is not None:
+      _add_packet(flows, *packet)
+  for flow in flows.values():
+    flow._finish()  # pylint: disable=W0212
+  return list(flows.values())
+
+
+def _read_pcap(capture_file):
+  """Yields the link type and data of each packet. A partly written
+  last packet is ignored since captures are read whilst running."""
+  with open(capture_file, 'rb') as f:
+    header = f.read(24)
+    if len(header) < 24:
+      return
+    magic = header[:4]
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+      endian = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+      endian = '>'
+    else:
+      raise ValueError(f'{capture_file} is not a pcap file')
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+    record_header = struct.Struct(endian + 'IIII')
+    while True:
+      data = f.read(16)
+      if len(data) < 16:
+        return
+      _, _, caplen, _ = record_header.unpack(data)
+      frame = f.read(caplen)
+      if len(frame) < caplen:
+        return
+      yield linktype, frame
+
+
+def _parse_frame(linktype, frame):
+  """Returns the addresses, ports, TCP fields and payload of an IPv4
+  TCP or UDP packet, or None for any other packet"""
+  if linktype == LINKTYPE_ETHERNET:
+    offset = 12
+  elif linktype == LINKTYPE_LINUX_SLL:
+    offset = 14
+  else:
+    return None
+  if len(frame) < offset + 2:
+    return None
+  ethertype = struct.unpack_from('!H', frame, offset)[0]
+  offset += 2
+  if ethertype == ETHERTYPE_VLAN and len(frame) >= offset + 4:
+    ethertype = struct.unpack_from('!H', frame, offset + 2)[0]
+    offset += 4
+  if ethertype != ETHERTYPE_IPV4 or len(frame) < offset + 20:
+    return None
+
+  ihl = (frame[offset] & 0x0f) * 4
+  total_length, fragment = struct.unpack_from('!H2xH', frame, offset + 2)
+  proto = frame[offset + 9]
+  if fragment & 0x1fff:
+    return None
+  src_ip = str(ipaddress.IPv4Address(frame[offset + 12:offset + 16]))
+  dst_ip = str(ipaddress.IPv4Address(frame[offset + 16:offset + 20]))
+
+  # Ethernet frames may be padded past the end of the IP packet
+  end = min(len(frame), offset + total_length)
+  offset += ihl
+  if proto == PROTO_TCP and end >= offset + 20:
+    src_port, dst_port, seq = struct.unpack_from('!HHI', frame, offset)
+    data_offset = (frame[offset + 12] >> 4) * 4
+    flags = frame[offset + 13]
+    payload = frame[offset + data_offset:end]
+    return proto, src_ip, src_port, dst_ip, dst_port, flags, seq, payload
+  if proto == PROTO_UDP and end >= offset + 8:
+    src_port, dst_port = struct.unpack_from('!HH', frame, offset)
+    payload = frame[offset + 8:end]
+    return proto, src_ip, src_port, dst_ip, dst_port, 0, 0, payload
+  return None
+
+
+def _add_packet(flows, proto, src_ip, src_port, dst_ip, dst_port, flags, seq,
+                payload):
+  key = (proto,) + tuple(sorted(((src_ip, src_port), (dst_ip, dst_port))))
+  flow = flows.get(key)
+  if flow is None:
+    if proto == PROTO_UDP and not _is_quic_initial(payload):
+      return
+    # The sender of the first packet is the client unless it is
+    # answering a SYN
+    if flags & TCP_SYN and flags & TCP_ACK:
+      flow = TLSFlow(dst_ip, dst_port, src_ip, src_port, proto)
+    else:
+      flow = TLSFlow(src_ip, src_port, dst_ip, dst_port, proto)
+    flows[key] = flow
+
+  from_client = (src_ip, src_port) == (flow.client_ip, flow.client_port)
+  if proto == PROTO_UDP:
+    if from_client:
+      if _is_quic_initial(payload) and flow.protocol is None:
+        # The Client Hello is encrypted, QUIC always uses TLS 1.3
+        flow.protocol = 'quic'
+        flow.client_hellos.append(
+            ClientHello(TLS_VERSIONS['1.2'],
+                        supported_versions=[TLS_VERSIONS['1.3']]))
+    elif _is_quic_long_header(payload):
+      flow.server_responded = True
+    return
+
+  if from_client and not flags & (TCP_ACK | TCP_SYN):
+    flow.bare_packets += 1
+    if payload:
+      flow.bare_payload_packets += 1
+  if payload:
+    flow._add_segment(from_client, seq, payload)  # pylint: disable=W0212
+
+
+def _is_quic_long_header(payload):
+  if len(payload) < 5 or payload[0] & 0xc0 != 0xc0:
+    return False
+  version = struct.unpack_from('!I', payload, 1)[0]
+  return version in (QUIC_VERSION_1, QUIC_VERSION_2) or (version >> 8
+                                                         == 0xff0000)
+
+
+def _is_quic_initial(payload):
+  if not _is_quic_long_header(payload):
+    return False
+  packet_type = (payload[0] >> 4) & 0x03
+  version = struct.unpack_from('!I', payload, 1)[0]
+  return packet_type == (1 if version == QUIC_VERSION_2 else 0)
+
+
+def _reassemble(segments):
+  """Join TCP segments in sequence order from the lowest sequence
+  number, ignoring retransmissions and stopping at the first gap"""
+  if not segments:
+    return b''
+  first = segments[0][0]
+
+  def offset_from_first(seq):
+    offset = (seq - first) % 2**32
+    return offset - 2**32 if offset >= 2**31 else offset
+
+  offsets = [(offset_from_first(seq), payload) for seq, payload in segments]
+  start = min(offset for offset, _ in offsets)
+  ordered = sorted((offset - start, payload) for offset, payload in offsets)
+  stream = bytearray()
+  for offset, payload in ordered:
+    if offset > len(stream):
+      break
+    stream += payload[len(stream) - offset:]
+    if len(stream) >= MAX_STREAM_BYTES:
+      break
+  return bytes(stream)
+
+
+def _parse_records(stream):
+  """Returns the content type, version, handshake message types and
+  handshake messages of each TLS record at the start of a stream.
+  Handshake messages after a Change Cipher Spec are encrypted and are
+  not returned."""
+  records = []
+  handshake = b''
+  encrypted = False
+  offset = 0
+  while offset + 5 <= len(stream):
+    content_type, version, length = struct.unpack_from('!BHH', stream, offset)
+    if (content_type not in (TLS_CHANGE_CIPHER_SPEC, TLS_ALERT, TLS_HANDSHAKE,
+                             TLS_APPLICATION_DATA, TLS_HEARTBEAT) or
+        version >> 8 != 3):
+      break
+    fragment = stream[offset + 5:offset + 5 + length]
+    offset += 5 + length
+
+    messages = []
+    if content_type == TLS_CHANGE_CIPHER_SPEC:
+      encrypted = True
+    elif content_type == TLS_HANDSHAKE and not encrypted:
+      # Handshake messages may be split across records
+      handshake += fragment
+      while len(handshake) >= 4:
+        message_length = int.from_bytes(handshake[1:4], 'big')
+        if len(handshake) < 4 + message_length:
+          break
+        messages.append((handshake[0], handshake[4:4 + message_length]))
+        handshake = handshake[4 + message_length:]
+    records.append((content_type, version, [m[0] for m in messages], messages))
+  return records
+
+
+def _first_handshake_type(records):
+  for _, _, message_types, _ in records:
+    if message_types:
+      return message_types[0]
+  return None
+
+
+def _read_vector(data, offset, length_size):
+  length = int.from_bytes(data[offset:offset + length_size], 'big')
+  start = offset + length_size
+  if start + length > len(data):
+    raise ValueError('Truncated vector')
+  return data[start:start + length], start + length
+
+
+def _read_extensions(data, offset):
+  extensions = {}
+  if offset + 2 > len(data):
+    return extensions
+  block, _ = _read_vector(data, offset, 2)
+  position = 0
+  while position + 4 <= len(block):
+    ext_type, ext_length = struct.unpack_from('!HH', block, position)
+    extensions[ext_type] = block[position + 4:position + 4 + ext_length]
+    position += 4 + ext_length
+  return extensions
+
+
+def _parse_client_hello(body):
+  try:
+    version = struct.unpack_from('!H', body, 0)[0]
+    _, offset = _read_vector(body, 34, 1)
+    cipher_data, offset = _read_vector(body, offset, 2)
+    _, offset = _read_vector(body, offset, 1)
+    extensions = _read_extensions(body, offset)
+  except (ValueError, struct.error):
+    return None
+
+  ciphers = [
+      cipher_name(value)
+      for (value,) in struct.iter_unpack('!H', cipher_data[:len(cipher_data) //
+                                                           2 * 2])
+  ]
+
+  supported_versions = []
+  if TLS_EXT_SUPPORTED_VERSIONS in extensions:
+    data = extensions[TLS_EXT_SUPPORTED_VERSIONS][1:]
+    supported_versions = [
+        value for (value,) in struct.iter_unpack('!H', data[:len(data) // 2 *
+                                                            2])
+    ]
+
+  sni = None
+  if TLS_EXT_SERVER_NAME in extensions:
+    data = extensions[TLS_EXT_SERVER_NAME]
+    if len(data) > 5 and data[2] == 0:
+      sni = data[5:5 + int.from_bytes(data[3:5], 'big')].decode(
+          errors='replace')
+
+  return ClientHello(version, supported_versions, ciphers, sni)
+
+
+def _parse_server_hello(body):
+  """Returns the version and cipher suite selected by the server"""
+  try:
+    version = struct.unpack_from('!H', body, 0)[0]
+    _, offset = _read_vector(body, 34, 1)
+    cipher = struct.unpack_from('!H', body, offset)[0]
+    extensions = _read_extensions(body, offset + 3)
+  except (ValueError, struct.error):
+    return None
+  selected = extensions.get(TLS_EXT_SUPPORTED_VERSIONS)
+  if selected is not None and len(selected) == 2:
+    version = struct.unpack('!H', selected)[0]
+  return version, cipher_name(cipher)
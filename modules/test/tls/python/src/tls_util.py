@@ -16,7 +16,6 @@ import ssl
 import socket
 from datetime import datetime
 from OpenSSL import crypto
-import json
 import os
 from common import util
 import ipaddress
@@ -25,19 +24,21 @@ from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from ipaddress import IPv4Address
+from tls_flows import read_tls_flows, TLS_VERSIONS
 
 LOG_NAME = 'tls_util'
 LOGGER = None
 DEFAULT_BIN_DIR = '/testrun/bin'
 DEFAULT_CERTS_OUT_DIR = '/runtime/output'
 DEFAULT_ROOT_CERTS_DIR = '/testrun/root_certs'
+BROADCAST_IP = ipaddress.ip_address('255.255.255.255')
 # Define private IP subnets
 PRIVATE_SUBNETS = [
     ipaddress.ip_network('10.0.0.0/8'),
     ipaddress.ip_network('172.16.0.0/12'),
     ipaddress.ip_network('192.168.0.0/16')
 ]
-#Define the allowed protocols as tshark filters
+#Define the allowed protocols which cannot be inspected directly
 DEFAULT_ALLOWED_PROTOCOLS = ['quic']
 
 
@@ -56,8 +57,11 @@ class TLSUtil():
     self._cert_out_dir = cert_out_dir
     self._dev_cert_file = 'device_cert.crt'
     self._root_certs_dir = root_certs_dir
-    if allowed_protocols is None:
-      self._allowed_protocols = DEFAULT_ALLOWED_PROTOCOLS
+    self._allowed_protocols = (DEFAULT_ALLOWED_PROTOCOLS
+                               if allowed_protocols is None else
+                               allowed_protocols)
+    # TLS flows read from each capture file, keyed by the file state
+    self._tls_flows = {}
 
   def get_public_certificate(self,
                              host,
@@ -412,109 +416,63 @@ class TLSUtil():
       LOGGER.error(f'Failed to write certificate to file: {e}')
     return None
 
-  def get_ciphers(self, capture_file, dst_ip, dst_port):
-    bin_file = self._bin_dir + '/get_ciphers.sh'
-    args = f'"{capture_file}" {dst_ip} {dst_port}'
-    command = f'{bin_file} {args}'
-    response = util.run_command(command)
-    ciphers = response[0].split('\n')
-    return ciphers
+  def get_tls_flows(self, capture_files):
+    """Returns the TLS flows of the capture files. Each file is read once
+    and reused by every client check until it changes."""
+    flows = []
+    for capture_file in capture_files:
+      if not os.path.exists(capture_file):
+        continue
+      stat = os.stat(capture_file)
+      key = (capture_file, stat.st_mtime_ns, stat.st_size)
+      if key not in self._tls_flows:
+        self._tls_flows[key] = read_tls_flows(capture_file)
+      flows.extend(self._tls_flows[key])
+    return flows
+
+  def get_client_flows(self, capture_files, client_ip):
+    return [
+        flow for flow in self.get_tls_flows(capture_files)
+        if flow.client_ip == client_ip
+    ]
 
   def get_hello_packets(self, capture_files, src_ip, tls_version):
-    combined_results = []
-    for capture_file in capture_files:
-      bin_file = self._bin_dir + '/get_client_hello_packets.sh'
-      args = f'"{capture_file}" {src_ip} {tls_version}'
-      command = f'{bin_file} {args}'
-      response = util.run_command(command)
-      packets = response[0].strip()
-      if len(packets) > 0:
-        # Parse each packet and append key-value pairs to combined_results
-        result = self.parse_packets(json.loads(packets), capture_file)
-        combined_results.extend(result)
-    return combined_results
+    hello_packets = []
+    for flow in self.get_client_flows(capture_files, src_ip):
+      # Resolve the ciphers offered to this server and validate expected
+      # ones exist
+      cipher_support = self.is_ecdh_and_ecdsa(flow.ciphers)
+      for hello in flow.client_hellos:
+        if hello.matches_version(tls_version):
+          hello_packet = {}
+          hello_packet['dst_ip'] = flow.server_ip
+          hello_packet['src_ip'] = flow.client_ip
+          hello_packet['dst_port'] = (str(flow.server_port)
+                                      if flow.protocol == 'tls' else '')
+          hello_packet['cipher_support'] = cipher_support
+          hello_packets.append(hello_packet)
+    return hello_packets
 
   def get_handshake_complete(self, capture_files, src_ip, dst_ip, tls_version):
-    combined_results = ''
-    for capture_file in capture_files:
-      bin_file = self._bin_dir + '/get_handshake_complete.sh'
-      args = f'"{capture_file}" {src_ip} {dst_ip} {tls_version}'
-      command = f'{bin_file} {args}'
-      response = util.run_command(command)
-      if len(response) > 0:
-        combined_results += response[0]
-    return combined_results
-
-  # Resolve all connections from the device that don't use TLS
-  def get_non_tls_packetes(self, client_ip, capture_files):
-    combined_packets = []
-    for capture_file in capture_files:
-      bin_file = self._bin_dir + '/get_non_tls_client_connections.sh'
-      args = f'"{capture_file}" {client_ip}'
-      command = f'{bin_file} {args}'
-      response = util.run_command(command)
-      if len(response) > 0:
-        packets = json.loads(response[0].strip())
-        combined_packets.extend(packets)
-    return combined_packets
-
-  # Resolve all connections from the device that use TLS
-  def get_tls_client_connection_packetes(self,
-                                         client_ip,
-                                         capture_files,
-                                         protocol=None):
-    combined_packets = []
-    for capture_file in capture_files:
-      bin_file = self._bin_dir + '/get_tls_client_connections.sh'
-      args = f'"{capture_file}" {client_ip}'
-      if protocol is not None:
-        args += f' {protocol}'
-      command = f'{bin_file} {args}'
-      response = util.run_command(command)
-      packets = json.loads(response[0].strip())
-      combined_packets.extend(packets)
-    return combined_packets
+    for flow in self.get_client_flows(capture_files, src_ip):
+      if flow.server_ip == dst_ip and flow.handshake_complete(tls_version):
+        return True
+    return False
 
   # Resolve any TLS packets for the specified version. Does not care if the
   # connections are established or any other validation only
   # that there is some level of connection attempt from the device
   # using the TLS version specified.
   def get_tls_packets(self, capture_files, src_ip, tls_version):
-    combined_results = []
-    for capture_file in capture_files:
-      bin_file = self._bin_dir + '/get_tls_packets.sh'
-      args = f'"{capture_file}" {src_ip} {tls_version}'
-      command = f'{bin_file} {args}'
-      response = util.run_command(command)
-      packets = response[0].strip()
-      # Parse each packet and append key-value pairs to combined_results
-      result = self.parse_packets(json.loads(packets), capture_file)
-      combined_results.extend(result)
-    return combined_results
-
-  def parse_packets(self, packets, capture_file):
-    hello_packets = []
-    for packet in packets:
-      # Extract all the basic IP information about the packet
-      packet_layers = packet['_source']['layers']
-      dst_ip = packet_layers['ip.dst'][0] if 'ip.dst' in packet_layers else ''
-      src_ip = packet_layers['ip.src'][0] if 'ip.src' in packet_layers else ''
-      dst_port = packet_layers['tcp.dstport'][
-          0] if 'tcp.dstport' in packet_layers else ''
-
-      # Resolve the ciphers used in this packet and validate expected ones exist
-      ciphers = self.get_ciphers(capture_file, dst_ip, dst_port)
-      cipher_support = self.is_ecdh_and_ecdsa(ciphers)
-
-      # Put result together
-      hello_packet = {}
-      hello_packet['dst_ip'] = dst_ip
-      hello_packet['src_ip'] = src_ip
-      hello_packet['dst_port'] = dst_port
-      hello_packet['cipher_support'] = cipher_support
-
-      hello_packets.append(hello_packet)
-    return hello_packets
+    tls_packets = []
+    for flow in self.get_client_flows(capture_files, src_ip):
+      if TLS_VERSIONS[tls_version] in flow.record_versions:
+        tls_packets.append({
+            'dst_ip': flow.server_ip,
+            'src_ip': flow.client_ip,
+            'dst_port': str(flow.server_port)
+        })
+    return tls_packets
 
   def process_hello_packets(self,
                             hello_packets,
@@ -562,9 +520,6 @@ class TLSUtil():
   # our network will be flagged.
   def get_non_tls_client_connection_ips(self, client_ip, capture_files):
     LOGGER.info('Checking client for non-TLS client connections')
-    packets = self.get_non_tls_packetes(client_ip=client_ip,
-                                        capture_files=capture_files)
-
     # Extract the subnet from the client IP address
     src_ip = ipaddress.ip_address(client_ip)
     src_subnet = ipaddress.ip_network(src_ip, strict=False)
@@ -572,16 +527,13 @@ class TLSUtil():
         src_subnet, strict=False).supernet(new_prefix=24)
 
     non_tls_dst_ips = set()  # Store unique destination IPs
-    for packet in packets:
-      # Check if packet contains TCP layer
-      if 'tcp' in packet['_source']['layers']:
-        tcp_flags = packet['_source']['layers']['tcp.flags']
-        if 'A' not in tcp_flags and 'S' not in tcp_flags:
-          # Packet is not ACK or SYN
-          dst_ip = ipaddress.ip_address(
-              packet['_source']['layers']['ip.dst'][0])
-          if not dst_ip in subnet_with_mask:
-            non_tls_dst_ips.add(str(dst_ip))
+    for flow in self.get_client_flows(capture_files, client_ip):
+      # Count the packets which are not ACK or SYN
+      if flow.non_tls_packets() > 0:
+        dst_ip = ipaddress.ip_address(flow.server_ip)
+        if (not dst_ip in subnet_with_mask and not dst_ip.is_multicast and
+            dst_ip != BROADCAST_IP):
+          non_tls_dst_ips.add(str(dst_ip))
     return non_tls_dst_ips
 
   # Check if the device has made any outbound connections that don't
@@ -597,36 +549,25 @@ class TLSUtil():
     unsupported_tls_dst_ips = {}
     if unsupported_versions is not None:
       for unsupported_version in unsupported_versions:
-        tls_packets = self.get_tls_packets(capture_files, client_ip, '1.0')
-        if len(tls_packets) > 0:
-          for packet in tls_packets:
-            dst_ip = packet['dst_ip']
-            tls_version = unsupported_version
-            if dst_ip not in unsupported_tls_dst_ips:
-              # If the IP is already present, append the new TLS version to the
-              # list
-              LOGGER.info(f'''Unsupported TLS {tls_version}
-                          connections detected to {dst_ip}''')
-              unsupported_tls_dst_ips[dst_ip] = [tls_version]
-            else:
-              # If the IP is not present, create a new list with the current
-              # TLS version
-              LOGGER.info(f'''Unsupported TLS {tls_version} connections detected
-                          to {dst_ip}''')
-              unsupported_tls_dst_ips[dst_ip] = [tls_version]
+        tls_packets = self.get_tls_packets(capture_files, client_ip,
+                                           unsupported_version)
+        for packet in tls_packets:
+          dst_ip = packet['dst_ip']
+          tls_versions = unsupported_tls_dst_ips.setdefault(dst_ip, [])
+          if unsupported_version not in tls_versions:
+            LOGGER.info(f'''Unsupported TLS {unsupported_version}
+                        connections detected to {dst_ip}''')
+            tls_versions.append(unsupported_version)
     return unsupported_tls_dst_ips
 
   # Check if the device has made any outbound connections that use any
   # version of TLS.
   def get_tls_client_connection_ips(self, client_ip, capture_files):
     LOGGER.info('Checking client for TLS client connections')
-    packets = self.get_tls_client_connection_packetes(
-        client_ip=client_ip, capture_files=capture_files)
-
     tls_dst_ips = set()  # Store unique destination IPs
-    for packet in packets:
-      dst_ip = ipaddress.ip_address(packet['_source']['layers']['ip.dst'][0])
-      tls_dst_ips.add(str(dst_ip))
+    for flow in self.get_client_flows(capture_files, client_ip):
+      if flow.protocol is not None:
+        tls_dst_ips.add(flow.server_ip)
     return tls_dst_ips
 
   # Check if the device has made any outbound connections that use any
@@ -635,13 +576,9 @@ class TLSUtil():
                                                  capture_files):
     LOGGER.info('Checking client for TLS Protocol client connections')
     tls_dst_ips = {}  # Store unique destination IPs with the protocol name
-    for protocol in self._allowed_protocols:
-      packets = self.get_tls_client_connection_packetes(
-          client_ip=client_ip, capture_files=capture_files, protocol=protocol)
-
-      for packet in packets:
-        dst_ip = ipaddress.ip_address(packet['_source']['layers']['ip.dst'][0])
-        tls_dst_ips[str(dst_ip)] = protocol
+    for flow in self.get_client_flows(capture_files, client_ip):
+      if flow.protocol in self._allowed_protocols:
+        tls_dst_ips[flow.server_ip] = flow.protocol
 
     return tls_dst_ips
 
@@ -681,9 +618,7 @@ class TLSUtil():
         handshake_complete = self.get_handshake_complete(
             capture_files, packet['src_ip'], packet['dst_ip'], tls_version)
 
-        # One of the responses will be a complaint about running as root so
-        # we have to have at least 2 entries to consider a completed handshake
-        if len(handshake_complete) > 1:
+        if handshake_complete:
           LOGGER.info('TLS handshake completed from: ' + packet['dst_ip'])
           handshakes['complete'].append(packet['dst_ip'])
         else:
@@ -712,9 +647,10 @@ class TLSUtil():
         for result in handshakes['incomplete']:
           tls_client_details += 'Incomplete handshake detected from server: '
           tls_client_details += result + '.'
-          hello_result = client_hello_results[result]
-          if 'protocol_details' in hello_result:
-            tls_client_details += hello_result['protocol_details']
+          for packet in client_hello_results['valid']:
+            if result == packet['dst_ip'] and 'protocol_details' in packet:
+              tls_client_details += packet['protocol_details']
+              break
           tls_client_details += '\n'
       if len(handshakes['complete']) > 0:
         # If we haven't already failed the test from previous checks
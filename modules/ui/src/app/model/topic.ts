@@ -2,8 +2,21 @@ export enum Topic {
   NetworkAdapters = 'events/adapter',
   InternetConnection = 'events/internet',
   Status = 'status',
+  StatusDelta = 'status/delta',
+  StatusRequest = 'status/request',
 }
 
 export interface InternetConnection {
   connection: boolean | null;
 }
+
+export interface PatchOperation {
+  op: 'add' | 'remove' | 'replace';
+  path: string;
+  value?: unknown;
+}
+
+export interface StatusDelta {
+  sequence: number;
+  patch: PatchOperation[];
+}
@@ -6,7 +6,8 @@ import { MQTT_SERVICE_OPTIONS } from '../app.module';
 import SpyObj = jasmine.SpyObj;
 import { of } from 'rxjs';
 import { MOCK_ADAPTERS } from '../mocks/settings.mock';
-import { Topic } from '../model/topic';
+import { StatusDelta, Topic } from '../model/topic';
+import { TestrunStatus } from '../model/testrun-status';
 import { MOCK_INTERNET } from '../mocks/topic.mock';
 import { MOCK_PROGRESS_DATA_IN_PROGRESS } from '../mocks/testrun.mock';
 
@@ -15,7 +16,7 @@ describe('TestRunMqttService', () => {
   let mockService: SpyObj<MqttService>;
 
   beforeEach(() => {
-    mockService = jasmine.createSpyObj(['observe']);
+    mockService = jasmine.createSpyObj(['observe', 'unsafePublish']);
 
     TestBed.configureTestingModule({
       imports: [MqttModule.forRoot(MQTT_SERVICE_OPTIONS)],
@@ -92,6 +93,49 @@ describe('TestRunMqttService', () => {
     });
   });
 
+  describe('getStatus with changes', () => {
+    function mockTopics(delta: StatusDelta) {
+      mockService.observe.and.callFake((topic: string) =>
+        topic === Topic.StatusDelta
+          ? of(getResponse(delta))
+          : of(getResponse({ ...MOCK_PROGRESS_DATA_IN_PROGRESS, sequence: 1 }))
+      );
+    }
+
+    it('should apply the next change to the status', () => {
+      mockTopics({
+        sequence: 2,
+        patch: [{ op: 'replace', path: '/status', value: 'Compliant' }],
+      });
+      const statuses: TestrunStatus[] = [];
+
+      service.getStatus().subscribe(res => statuses.push(res));
+
+      expect(statuses.length).toEqual(2);
+      expect(statuses[1].status).toEqual('Compliant');
+      expect(statuses[1].device).toEqual(
+        MOCK_PROGRESS_DATA_IN_PROGRESS.device
+      );
+      expect(mockService.unsafePublish).not.toHaveBeenCalled();
+    });
+
+    it('should request the status when a change is missed', () => {
+      mockTopics({
+        sequence: 3,
+        patch: [{ op: 'replace', path: '/status', value: 'Compliant' }],
+      });
+      const statuses: TestrunStatus[] = [];
+
+      service.getStatus().subscribe(res => statuses.push(res));
+
+      expect(statuses.length).toEqual(1);
+      expect(mockService.unsafePublish).toHaveBeenCalledWith(
+        Topic.StatusRequest,
+        ''
+      );
+    });
+  });
+
   function getResponse<Type>(response: Type): IMqttMessage {
     const enc = new TextEncoder();
     const message = enc.encode(JSON.stringify(response));
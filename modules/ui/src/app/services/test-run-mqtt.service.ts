@@ -1,10 +1,17 @@
 import { Injectable } from '@angular/core';
 import { IMqttMessage, MqttService } from 'ngx-mqtt';
-import { catchError, Observable, of } from 'rxjs';
-import { map } from 'rxjs/operators';
+import { catchError, merge, Observable, of } from 'rxjs';
+import { filter, map } from 'rxjs/operators';
 import { Adapters } from '../model/setting';
 import { TestrunStatus } from '../model/testrun-status';
-import { InternetConnection, Topic } from '../model/topic';
+import {
+  InternetConnection,
+  PatchOperation,
+  StatusDelta,
+  Topic,
+} from '../model/topic';
+
+type StatusSnapshot = TestrunStatus & { sequence?: number };
 
 @Injectable({
   providedIn: 'root',
@@ -20,8 +27,78 @@ export class TestRunMqttService {
     return this.topic<InternetConnection>(Topic.InternetConnection);
   }
 
+  /**
+   * Full statuses are published on start, on reconnect and on request;
+   * in between only the changes are published. A missed change causes
+   * a full status to be requested.
+   */
   getStatus(): Observable<TestrunStatus> {
-    return this.topic<TestrunStatus>(Topic.Status);
+    let status: TestrunStatus | null = null;
+    let sequence: number | undefined;
+
+    const snapshots = this.topic<StatusSnapshot>(Topic.Status).pipe(
+      map(snapshot => {
+        sequence = snapshot.sequence;
+        status = snapshot;
+        return status;
+      })
+    );
+
+    const deltas = this.topic<StatusDelta>(Topic.StatusDelta).pipe(
+      filter(delta => {
+        if (!Array.isArray(delta.patch)) {
+          return false;
+        }
+        if (
+          status === null ||
+          sequence === undefined ||
+          delta.sequence !== sequence + 1
+        ) {
+          this.requestStatus();
+          return false;
+        }
+        return true;
+      }),
+      map(delta => {
+        sequence = delta.sequence;
+        status = this.applyPatch(status!, delta.patch);
+        return status;
+      })
+    );
+
+    return merge(snapshots, deltas);
+  }
+
+  private requestStatus(): void {
+    this.mqttService.unsafePublish(Topic.StatusRequest, '');
+  }
+
+  private applyPatch<Type>(document: Type, patch: PatchOperation[]): Type {
+    // The current status may be held in the store so is never modified
+    const root = { value: JSON.parse(JSON.stringify(document)) };
+    patch.forEach(operation => {
+      const keys = ['value']
+        .concat(operation.path.split('/').slice(1))
+        .map(key => key.replace(/~1/g, '/').replace(/~0/g, '~'));
+      const key = keys.pop()!;
+      // eslint-disable-next-line @typescript-eslint/no-explicit-any
+      const parent = keys.reduce((node: any, name) => node[name], root);
+      if (Array.isArray(parent)) {
+        const index = Number(key);
+        if (operation.op === 'add') {
+          parent.splice(index, 0, operation.value);
+        } else if (operation.op === 'remove') {
+          parent.splice(index, 1);
+        } else {
+          parent[index] = operation.value;
+        }
+      } else if (operation.op === 'remove') {
+        delete parent[key];
+      } else {
+        parent[key] = operation.value;
+      }
+    });
+    return root.value;
   }
 
   private topic<Type>(topicName: string): Observable<Type> {
@@ -0,0 +1,67 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Internet probe tests"""
+
+import os
+from unittest import mock
+from net_orc import internet_probe
+from net_orc.internet_probe import InternetProbe
+
+
+def make_probe():
+  probe = InternetProbe("tr-ctns-gateway")
+  sockets = []
+
+  def open_socket():
+    sockets.append(mock.Mock())
+    return sockets[-1]
+
+  probe._open_socket = open_socket
+  probe._ping = mock.Mock(return_value=True)
+  return probe, sockets
+
+
+def test_probe_fixed_address(tmp_path):
+  (tmp_path / "tr-ctns-gateway").touch()
+  with mock.patch.object(internet_probe, "NETNS_DIR", str(tmp_path)):
+    probe, sockets = make_probe()
+    assert probe._probe()
+    assert probe._probe()
+
+  # The address is probed without resolving a host name
+  probe._ping.assert_called_with(internet_probe.PROBE_ADDRESS)
+  assert len(sockets) == 1
+
+
+def test_socket_reopened_for_new_namespace(tmp_path):
+  namespace = tmp_path / "tr-ctns-gateway"
+  namespace.touch()
+  with mock.patch.object(internet_probe, "NETNS_DIR", str(tmp_path)):
+    probe, sockets = make_probe()
+    assert probe._probe()
+
+    # The namespace is recreated when the gateway container restarts
+    replacement = tmp_path / "replacement"
+    replacement.touch()
+    os.replace(replacement, namespace)
+    assert probe._probe()
+    assert len(sockets) == 2
+    sockets[0].close.assert_called_once()
+
+    # No socket is opened whilst the namespace does not exist
+    namespace.unlink()
+    assert not probe._probe()
+    sockets[1].close.assert_called_once()
+    assert len(sockets) == 2
@@ -0,0 +1,83 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Listener callback tests"""
+
+import threading
+from unittest import mock
+from net_orc import listener
+from net_orc.listener import Listener
+from net_orc.network_event import NetworkEvent
+
+LIFECYCLE_EVENTS = [
+    NetworkEvent.DEVICE_DISCOVERED, NetworkEvent.DEVICE_MONITORING,
+    NetworkEvent.DEVICE_STABLE
+]
+
+
+def make_listener():
+  with mock.patch.object(listener, "get_if_hwaddr",
+                         return_value="00:00:00:00:00:01"):
+    return Listener(mock.Mock())
+
+
+def test_lifecycle_callbacks_not_limited():
+  test_listener = make_listener()
+  release = threading.Event()
+  started = threading.Semaphore(0)
+  acks = threading.Event()
+
+  def long_callback(*args):
+    started.release()
+    release.wait()
+
+  test_listener.register_callback(long_callback, LIFECYCLE_EVENTS)
+  test_listener.register_callback(lambda packet: acks.set(),
+                                  [NetworkEvent.DHCP_LEASE_ACK])
+
+  # More long running callbacks than the packet workers or the pending
+  # packet callback limit all start
+  count = listener.MAX_PENDING_CALLBACKS + 1
+  for i in range(count):
+    test_listener.call_callback(LIFECYCLE_EVENTS[i % 3], "00:11:22:33:44:55")
+  for _ in range(count):
+    assert started.acquire(timeout=5)
+
+  # Packet callbacks still run whilst they are running
+  test_listener.call_callback(NetworkEvent.DHCP_LEASE_ACK, None)
+  assert acks.wait(timeout=5)
+  release.set()
+  assert test_listener.get_stats()["callbacks_dropped"] == 0
+
+
+def test_packet_callbacks_dropped():
+  test_listener = make_listener()
+  release = threading.Event()
+  calls = []
+
+  def ack_callback(packet):
+    release.wait()
+    calls.append(packet)
+
+  test_listener.register_callback(ack_callback, [NetworkEvent.DHCP_LEASE_ACK])
+  count = listener.MAX_PENDING_CALLBACKS + listener.PACKET_CALLBACK_WORKERS
+  for i in range(count + 10):
+    test_listener.call_callback(NetworkEvent.DHCP_LEASE_ACK, i)
+  dropped = test_listener._counters["callbacks_dropped"]
+  release.set()
+  test_listener._executor.shutdown(wait=True)
+
+  # Callbacks already running on a worker are no longer pending
+  assert 10 <= dropped <= 10 + listener.PACKET_CALLBACK_WORKERS
+  assert len(calls) == count + 10 - dropped
@@ -0,0 +1,55 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test module log capture tests"""
+
+from test_orc.module_log import ModuleLog
+
+
+def read_file(path):
+  with open(path, "r", encoding="utf-8") as f:
+    return f.read()
+
+
+def test_capture_writes_incrementally(tmp_path):
+  log_file = tmp_path / "module.log"
+  module_log = ModuleLog(str(log_file))
+  written = []
+
+  def log_stream():
+    yield b"first line\nsecond "
+    # Complete lines are on disk before the next chunk is read
+    written.append(read_file(log_file))
+    yield b"line\nthird \xc3"
+    written.append(read_file(log_file))
+    yield b"\xa9"
+
+  module_log.capture(log_stream())
+
+  assert written == ["first line\n", "first line\nsecond line\n"]
+  assert read_file(log_file) == "first line\nsecond line\nthird é\n"
+  assert module_log.get_tail() == ["first line", "second line", "third é"]
+
+
+def test_tail_is_bounded(tmp_path):
+  log_file = tmp_path / "module.log"
+  module_log = ModuleLog(str(log_file), max_lines=3)
+
+  module_log.capture(f"line {i}\n".encode() for i in range(10))
+
+  # The file holds every line but only the latest are kept in memory
+  assert len(read_file(log_file).splitlines()) == 10
+  assert module_log.get_tail() == ["line 7", "line 8", "line 9"]
+  assert module_log.get_tail(2) == ["line 8", "line 9"]
+  assert not module_log.get_tail(0)
@@ -0,0 +1,123 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Listener packet filter tests"""
+
+import struct
+from net_orc import packet_filter
+
+DEVICE_MAC = "00:1a:2b:3c:4d:5e"
+UNKNOWN_MAC = "66:77:88:99:aa:bb"
+CONTAINER_MAC = "9a:02:57:1e:8f:01"
+CONTAINER_MAC_PREFIX = "9a:02:57:1e:8f"
+
+PROGRAM = packet_filter.build_listener_filter([DEVICE_MAC],
+                                              CONTAINER_MAC_PREFIX)
+
+
+def run_filter(program, frame):
+  """Run a classic BPF program over a frame as the kernel would and
+  return the number of bytes accepted"""
+  a = x = pc = 0
+  while True:
+    code, jt, jf, k = program[pc]
+    pc += 1
+    if code == packet_filter.LD_W_ABS:
+      a = struct.unpack_from("!I", frame, k)[0]
+    elif code == packet_filter.LD_H_ABS:
+      a = struct.unpack_from("!H", frame, k)[0]
+    elif code == packet_filter.LD_B_ABS:
+      a = frame[k]
+    elif code == packet_filter.LD_H_IND:
+      a = struct.unpack_from("!H", frame, x + k)[0]
+    elif code == packet_filter.LDX_B_MSH:
+      x = (frame[k] & 0x0f) * 4
+    elif code == packet_filter.JMP_JEQ_K:
+      pc += jt if a == k else jf
+    elif code == packet_filter.JMP_JSET_K:
+      pc += jt if a & k else jf
+    elif code == packet_filter.RET_K:
+      return k
+    else:
+      raise ValueError(f"Unsupported instruction {code:#x}")
+
+
+def make_frame(src_mac, ether_type, payload):
+  dst = bytes.fromhex("ffffffffffff")
+  src = bytes.fromhex(src_mac.replace(":", ""))
+  return dst + src + struct.pack("!H", ether_type) + payload
+
+
+def make_ipv4(protocol, payload, fragment=0):
+  return struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0,
+                     fragment, 64, protocol, 0, bytes(4),
+                     bytes([255] * 4)) + payload
+
+
+def make_udp(src_port, dst_port):
+  return struct.pack("!HHHH", src_port, dst_port, 8, 0)
+
+
+def make_tcp(src_port, dst_port):
+  return struct.pack("!HHIIBBHHH", src_port, dst_port, 0, 0, 0x50, 0x02, 0, 0,
+                     0)
+
+
+def dhcp_frame(src_mac):
+  return make_frame(src_mac, 0x0800, make_ipv4(17, make_udp(68, 67)))
+
+
+def arp_frame(src_mac):
+  return make_frame(src_mac, 0x0806, bytes(28))
+
+
+def tcp_frame(src_mac):
+  return make_frame(src_mac, 0x0800, make_ipv4(6, make_tcp(50000, 80)))
+
+
+def udp_frame(src_mac):
+  return make_frame(src_mac, 0x0800, make_ipv4(17, make_udp(47808, 47808)))
+
+
+def ipv6_frame(src_mac):
+  return make_frame(src_mac, 0x86dd, bytes(40))
+
+
+def fragment_frame(src_mac):
+  return make_frame(src_mac, 0x0800,
+                    make_ipv4(17, make_udp(68, 67), fragment=0x0010))
+
+
+def test_dhcp_accepted():
+  for mac in (DEVICE_MAC, UNKNOWN_MAC, CONTAINER_MAC):
+    assert run_filter(PROGRAM, dhcp_frame(mac)) == packet_filter.SNAP_LEN
+
+
+def test_known_macs_dropped():
+  for mac in (DEVICE_MAC, CONTAINER_MAC):
+    for make in (arp_frame, tcp_frame, udp_frame, ipv6_frame, fragment_frame):
+      assert run_filter(PROGRAM, make(mac)) == 0
+
+
+def test_unknown_macs_accepted():
+  for make in (arp_frame, tcp_frame, udp_frame, ipv6_frame, fragment_frame):
+    assert run_filter(PROGRAM, make(UNKNOWN_MAC)) == packet_filter.SNAP_LEN
+
+
+def test_many_macs_within_limit():
+  macs = [f"02:00:00:00:{i // 256:02x}:{i % 256:02x}" for i in range(1000)]
+  program = packet_filter.build_listener_filter(macs, CONTAINER_MAC_PREFIX)
+  assert len(program) <= packet_filter.MAX_INSTRUCTIONS
+  assert run_filter(program, arp_frame(macs[0])) == 0
+  assert run_filter(program, arp_frame(UNKNOWN_MAC)) == packet_filter.SNAP_LEN
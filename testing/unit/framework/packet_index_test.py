@@ -0,0 +1,57 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Packet index tests"""
+
+from unittest import mock
+from scapy.all import ARP, Ether
+from common.packet_index import PacketIndexBuilder, FLAG_ARP
+
+DEVICE_MAC = "00:1a:2b:3c:4d:5e"
+
+
+def arp_packet(op):
+  return Ether(src=DEVICE_MAC) / ARP(op=op, hwsrc=DEVICE_MAC,
+                                     psrc="10.10.10.14")
+
+
+def test_arp_op_above_255():
+  builder = PacketIndexBuilder()
+  builder.add(arp_packet(1))
+  builder.add(arp_packet(300))
+
+  index = builder.build()
+  assert len(index) == 2
+  assert index.has(FLAG_ARP).all()
+  assert index.strings("arp_psrc") == ["10.10.10.14", "10.10.10.14"]
+  assert index.equals("src_mac", DEVICE_MAC).all()
+
+
+def test_out_of_range_value_keeps_columns_aligned():
+  builder = PacketIndexBuilder()
+  builder.add(arp_packet(1))
+
+  def add_fields(packet, row):
+    row["src_mac"] = packet[Ether].src
+    row["proto"] = 256
+
+  # A field that does not fit its column is stored as not present
+  with mock.patch.object(builder, "_add_fields", side_effect=add_fields):
+    builder.add(arp_packet(2))
+  builder.add(arp_packet(2))
+
+  index = builder.build()
+  assert len(index) == 3
+  assert index.equals("src_mac", DEVICE_MAC).all()
+  assert index.has(FLAG_ARP).tolist() == [True, False, True]
@@ -14,6 +14,8 @@
 """Module run all the services related unit tests"""
 from services_module import ServicesModule
 import unittest
+from unittest import mock
+import json
 import os
 import sys
 import shutil
@@ -31,6 +33,44 @@ LOCAL_REPORT = os.path.join(REPORTS_DIR, 'services_report_local.html')
 LOCAL_REPORT_ALL_CLOSED = os.path.join(REPORTS_DIR,
                                        'services_report_all_closed_local.html')
 
+NMAP_HOST_DISCOVERY = '''<nmaprun><host><status state="up"/>
+<times srtt="2000" rttvar="1000" to="100000"/></host></nmaprun>'''
+
+NMAP_TCP_SWEEP = '''<nmaprun><host><ports>
+<port protocol="tcp" portid="22"><state state="open"/>
+<service name="ssh" method="table"/></port>
+<port protocol="tcp" portid="80"><state state="open"/>
+<service name="http" method="table"/></port>
+</ports></host></nmaprun>'''
+
+NMAP_TCP_SERVICES = '''<nmaprun><host><ports>
+<port protocol="tcp" portid="22"><state state="open"/>
+<service name="ssh" version="8.9p1" extrainfo="protocol 2.0"/></port>
+<port protocol="tcp" portid="80"><state state="open"/>
+<service name="http" version="1.18.0"/></port>
+</ports></host></nmaprun>'''
+
+NMAP_UDP_SWEEP = '''<nmaprun><host><ports>
+<port protocol="udp" portid="123"><state state="open|filtered"/>
+<service name="ntp" method="table"/></port>
+<port protocol="udp" portid="161"><state state="closed"/>
+<service name="snmp" method="table"/></port>
+</ports></host></nmaprun>'''
+
+NMAP_UDP_SERVICES = '''<nmaprun><host><ports>
+<port protocol="udp" portid="123"><state state="open"/>
+<service name="ntp" version="v4"/></port>
+</ports></host></nmaprun>'''
+
+
+def run_nmap(command):
+  if '-sn' in command:
+    return NMAP_HOST_DISCOVERY, ''
+  if '-sT' in command:
+    return (NMAP_TCP_SERVICES if '-sV' in command else NMAP_TCP_SWEEP), ''
+  return (NMAP_UDP_SERVICES if '-sV' in command else NMAP_UDP_SWEEP), ''
+
+
 class ServicesTest(unittest.TestCase):
   """Contains and runs all the unit tests concerning DNS behaviors"""
 
@@ -92,11 +132,40 @@ class ServicesTest(unittest.TestCase):
 
     self.assertEqual(report_out, report_local)
 
+  # Test the port scan only detects services on the open ports
+  def services_module_scan_test(self):
+    with mock.patch('services_module.util.run_command',
+                    side_effect=run_nmap) as run_command:
+      ServicesModule(module=MODULE,
+                     log_dir=OUTPUT_DIR,
+                     results_dir=OUTPUT_DIR,
+                     nmap_scan_results_path=OUTPUT_DIR)
+
+    commands = [call.args[0] for call in run_command.call_args_list]
+    service_scans = [command for command in commands if '-sV' in command]
+    self.assertEqual(len(service_scans), 2)
+    self.assertTrue(any('-p 22,80 ' in command for command in service_scans))
+    self.assertTrue(any('-p 123 ' in command for command in service_scans))
+    self.assertTrue(
+        all('--max-rtt-timeout 200ms' in command for command in commands[1:]))
+
+    with open(os.path.join(OUTPUT_DIR, 'services_scan_results.json'),
+              'r',
+              encoding='utf-8') as file:
+      scan_results = json.loads(file.read())
+
+    self.assertEqual(list(scan_results), ['22tcp', '80tcp', '123udp', '161udp'])
+    self.assertEqual(scan_results['22tcp']['version'], '8.9p1 protocol 2.0')
+    self.assertEqual(scan_results['123udp']['state'], 'open')
+    self.assertEqual(scan_results['161udp']['state'], 'closed')
+
 if __name__ == '__main__':
   suite = unittest.TestSuite()
   # Module report test
   suite.addTest(ServicesTest('services_module_ports_open_report_test'))
   suite.addTest(ServicesTest('services_module_report_all_closed_test'))
+  # Module port scan test
+  suite.addTest(ServicesTest('services_module_scan_test'))
 
   runner = unittest.TextTestRunner()
   test_result = runner.run(suite)
@@ -13,6 +13,9 @@
 # limitations under the License.
 """Module run all the TLS related unit tests"""
 from tls_util import TLSUtil
+from tls_flows import (read_tls_flows, cipher_name, TLS_VERSIONS,
+                       TLS_HANDSHAKE, TLS_CLIENT_HELLO, TLS_SERVER_HELLO,
+                       TLS_SERVER_HELLO_DONE, TCP_SYN, TCP_ACK)
 import os
 import unittest
 from common import logger
@@ -24,7 +27,9 @@ import ssl
 import shutil
 import logging
 import socket
+import struct
 import sys
+import tempfile
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
@@ -537,6 +542,194 @@ class TLSModuleTest(unittest.TestCase):
       cert_file.write(pem_cert.decode())
 
 
+def make_pcap(packets):
+  """Returns a pcap file of the IPv4 TCP packets, each given as the
+  source, destination, TCP flags, sequence number and payload"""
+  data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+  for (src_ip, src_port), (dst_ip, dst_port), flags, seq, payload in packets:
+    tcp = struct.pack('!HHIIBBHHH', src_port, dst_port, seq, 0, 0x50, flags,
+                      65535, 0, 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+                     socket.inet_aton(src_ip), socket.inet_aton(dst_ip)) + tcp
+    frame = bytes(12) + struct.pack('!H', 0x0800) + ip
+    data += struct.pack('<IIII', 0, 0, len(frame), len(frame)) + frame
+  return data
+
+
+def tls_record(content_type, body):
+  return struct.pack('!BHH', content_type, 0x0303, len(body)) + body
+
+
+def handshake(message_type, body):
+  return bytes([message_type]) + len(body).to_bytes(3, 'big') + body
+
+
+def tls_extension(ext_type, data):
+  return struct.pack('!HH', ext_type, len(data)) + data
+
+
+def client_hello(ciphers, supported_versions=None, sni=None):
+  extensions = b''
+  if sni is not None:
+    name = sni.encode()
+    extensions += tls_extension(
+        0, struct.pack('!HBH', len(name) + 3, 0, len(name)) + name)
+  if supported_versions is not None:
+    versions = b''.join(struct.pack('!H', v) for v in supported_versions)
+    extensions += tls_extension(43, bytes([len(versions)]) + versions)
+  body = struct.pack('!H', 0x0303) + bytes(32) + b'\x00'
+  body += struct.pack('!H', len(ciphers) * 2)
+  body += b''.join(struct.pack('!H', c) for c in ciphers)
+  body += b'\x01\x00' + struct.pack('!H', len(extensions)) + extensions
+  return handshake(TLS_CLIENT_HELLO, body)
+
+
+def server_hello(version, cipher=0xc02b):
+  # TLS 1.3 is selected through the supported versions extension
+  extensions = b''
+  if version == TLS_VERSIONS['1.3']:
+    extensions = tls_extension(43, struct.pack('!H', version))
+    version = TLS_VERSIONS['1.2']
+  body = struct.pack('!H', version) + bytes(32) + b'\x00'
+  body += struct.pack('!HB', cipher, 0)
+  body += struct.pack('!H', len(extensions)) + extensions
+  return handshake(TLS_SERVER_HELLO, body)
+
+
+FLOW_CLIENT = ('10.10.10.14', 50000)
+FLOW_SERVER = ('8.8.8.8', 443)
+CLIENT_SEQ = 1000
+SERVER_SEQ = 5000
+
+
+def tls_connection(client_stream, server_stream=b''):
+  packets = [(FLOW_CLIENT, FLOW_SERVER, TCP_SYN, CLIENT_SEQ - 1, b''),
+             (FLOW_SERVER, FLOW_CLIENT, TCP_SYN | TCP_ACK, SERVER_SEQ - 1,
+              b''),
+             (FLOW_CLIENT, FLOW_SERVER, TCP_ACK, CLIENT_SEQ, client_stream)]
+  if server_stream:
+    packets.append(
+        (FLOW_SERVER, FLOW_CLIENT, TCP_ACK, SERVER_SEQ, server_stream))
+  return packets
+
+
+class TLSFlowsTest(unittest.TestCase):
+  """Unit tests of reading TLS flows from capture files"""
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def read_flows(self, packets, truncate=0):
+    capture_file = os.path.join(self._dir, 'capture.pcap')
+    data = make_pcap(packets)
+    with open(capture_file, 'wb') as f:
+      f.write(data[:len(data) - truncate])
+    return read_tls_flows(capture_file)
+
+  def handshake_flow(self, server_version, server_messages=None):
+    server_stream = tls_record(
+        TLS_HANDSHAKE,
+        server_hello(server_version) + b''.join(server_messages or []))
+    flows = self.read_flows(
+        tls_connection(
+            tls_record(TLS_HANDSHAKE, client_hello([0xc02b])), server_stream))
+    return flows[0]
+
+  def tls_flows_client_hello_test(self):
+    # GREASE values are not cipher suites so have no name
+    hello = client_hello([0x0a0a, 0xc008, 0x1301, 0x002f],
+                         supported_versions=[0x0304, 0x0303],
+                         sni='example.com')
+    flows = self.read_flows(tls_connection(tls_record(TLS_HANDSHAKE, hello)))
+    self.assertEqual(len(flows), 1)
+    flow = flows[0]
+    self.assertEqual(flow.protocol, 'tls')
+    self.assertEqual((flow.client_ip, flow.client_port), FLOW_CLIENT)
+    self.assertEqual((flow.server_ip, flow.server_port), FLOW_SERVER)
+    self.assertEqual(flow.sni, 'example.com')
+    self.assertEqual(flow.ciphers, [
+        '0x0a0a', 'TLS_ECDHE_ECDSA_WITH_3DES_EDE_CBC_SHA',
+        'TLS_AES_128_GCM_SHA256', 'TLS_RSA_WITH_AES_128_CBC_SHA'
+    ])
+    self.assertTrue(flow.client_hellos[0].matches_version('1.2'))
+    self.assertTrue(flow.client_hellos[0].matches_version('1.3'))
+    self.assertFalse(flow.handshake_complete('1.2'))
+
+  def tls_flows_cipher_names_test(self):
+    # Cipher suites are named whether or not OpenSSL supports them
+    self.assertEqual(cipher_name(0xc008),
+                     'TLS_ECDHE_ECDSA_WITH_3DES_EDE_CBC_SHA')
+    self.assertEqual(cipher_name(0xc02f),
+                     'TLS_ECDHE_RSA_WITH_AES_128_GCM_SHA256')
+    self.assertEqual(cipher_name(0xfafa), '0xfafa')
+
+  def tls_flows_handshake_1_2_test(self):
+    done = handshake(TLS_SERVER_HELLO_DONE, b'')
+    flow = self.handshake_flow(TLS_VERSIONS['1.2'], [done])
+    self.assertEqual(flow.server_cipher,
+                     'TLS_ECDHE_ECDSA_WITH_AES_128_GCM_SHA256')
+    self.assertTrue(flow.handshake_complete('1.2'))
+    self.assertFalse(flow.handshake_complete('1.3'))
+
+    # The Server Hello Done is required for TLS 1.2
+    flow = self.handshake_flow(TLS_VERSIONS['1.2'])
+    self.assertFalse(flow.handshake_complete('1.2'))
+
+  def tls_flows_handshake_1_3_test(self):
+    # A TLS 1.3 handshake also meets TLS 1.2
+    flow = self.handshake_flow(TLS_VERSIONS['1.3'])
+    self.assertEqual(flow.server_version, TLS_VERSIONS['1.3'])
+    self.assertTrue(flow.handshake_complete('1.3'))
+    self.assertTrue(flow.handshake_complete('1.2'))
+    self.assertFalse(flow.handshake_complete('1.1'))
+
+  def tls_flows_handshake_1_1_test(self):
+    done = handshake(TLS_SERVER_HELLO_DONE, b'')
+    flow = self.handshake_flow(TLS_VERSIONS['1.1'], [done])
+    self.assertTrue(flow.handshake_complete('1.1'))
+    self.assertFalse(flow.handshake_complete('1.2'))
+
+  def tls_flows_reassembly_test(self):
+    # The hello is split across records and segments which arrive out
+    # of order and retransmitted
+    hello = client_hello([0xc02b, 0xc02f], sni='example.com')
+    stream = (tls_record(TLS_HANDSHAKE, hello[:30]) +
+              tls_record(TLS_HANDSHAKE, hello[30:]))
+    packets = tls_connection(b'')[:2]
+    for offset in (40, 0, 20, 40):
+      packets.append((FLOW_CLIENT, FLOW_SERVER, TCP_ACK, CLIENT_SEQ + offset,
+                      stream[offset:offset + 20 if offset < 40 else None]))
+    flow = self.read_flows(packets)[0]
+    self.assertEqual(flow.sni, 'example.com')
+    self.assertEqual(len(flow.ciphers), 2)
+
+  def tls_flows_client_detected_test(self):
+    # The capture starts after the connection was opened with a packet
+    # from the server
+    done = handshake(TLS_SERVER_HELLO_DONE, b'')
+    packets = [(FLOW_SERVER, FLOW_CLIENT, TCP_ACK, SERVER_SEQ,
+                tls_record(TLS_HANDSHAKE,
+                           server_hello(TLS_VERSIONS['1.2']) + done)),
+               (FLOW_CLIENT, FLOW_SERVER, TCP_ACK, CLIENT_SEQ,
+                tls_record(TLS_HANDSHAKE, client_hello([0xc02b])))]
+    flow = self.read_flows(packets)[0]
+    self.assertEqual((flow.client_ip, flow.client_port), FLOW_CLIENT)
+    self.assertTrue(flow.handshake_complete('1.2'))
+
+  def tls_flows_non_tls_test(self):
+    # Unencrypted data is not read as TLS and a partly written last
+    # packet is ignored
+    packets = [(FLOW_CLIENT, FLOW_SERVER, 0, CLIENT_SEQ, b'GET / HTTP/1.1\r\n'),
+               (FLOW_CLIENT, FLOW_SERVER, 0, CLIENT_SEQ + 16, b'\r\n')]
+    flow = self.read_flows(packets, truncate=1)[0]
+    self.assertIsNone(flow.protocol)
+    self.assertEqual(flow.client_hellos, [])
+    self.assertEqual(flow.non_tls_packets(), 1)
+
+
 if __name__ == '__main__':
   suite = unittest.TestSuite()
   suite.addTest(TLSModuleTest('client_hello_packets_test'))
@@ -576,6 +769,16 @@ if __name__ == '__main__':
 
   suite.addTest(TLSModuleTest('security_tls_client_allowed_protocols_test'))
 
+  # Test reading TLS flows from captures
+  suite.addTest(TLSFlowsTest('tls_flows_client_hello_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_cipher_names_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_handshake_1_2_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_handshake_1_3_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_handshake_1_1_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_reassembly_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_client_detected_test'))
+  suite.addTest(TLSFlowsTest('tls_flows_non_tls_test'))
+
   runner = unittest.TextTestRunner()
   test_result = runner.run(suite)
 